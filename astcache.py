@@ -0,0 +1,245 @@
+"""
+astcache.py
+
+A binary cache of the AST of a story, so that a story that hasn't
+changed since it was last compiled doesn't have to be lexed and parsed
+again. The cache is keyed by a hash of the source and compiler.VERSION,
+and anything wrong with it (a different story or compiler, a newer
+format, a truncated or corrupted file) just means it isn't used.
+
+The format is a header followed by a body:
+
+    header: MAGIC, FORMAT (2 bytes), key (16 bytes), hash of the body (16 bytes)
+    body:   the number of strings, nodes and child links (4 bytes each),
+            the length of every string, then all the strings as UTF-8,
+            five numbers per node: its type, value and match (as indexes
+            into the strings, 0 meaning None), its start offset plus one
+            (0 meaning None) and how many children it has,
+            then the index of every child of every node, in node order.
+
+Numbers are unsigned 32-bit little-endian. Tokens are stored as they
+are, and the nodes above them (see nodes.py) by their token_type and
+their children, which they're made back from. Each distinct string is
+stored once, and so is a node that appears in the tree more than once,
+which comes back as the same object.
+
+MIT License
+"""
+import gc
+import hashlib
+import itertools
+import os
+import struct
+import sys
+from array import array
+
+import compiler
+import lexer
+import log
+import nodes
+
+logger = log.getLogger("astcache")
+
+MAGIC = b"TWXAST"
+FORMAT = 3
+HEADER = struct.Struct(f"<{len(MAGIC)}sH16s16s")
+COUNTS = struct.Struct("<III")
+FIELDS = 5 # numbers per node
+
+def key(source):
+    """ the cache key for source (bytes): a hash of it and the compiler version. """
+    digest = hashlib.blake2b(digest_size = 16)
+    digest.update(compiler.VERSION.encode())
+    digest.update(b"\0")
+    digest.update(source)
+    return digest.digest()
+
+def _numbers(values):
+    numbers = array("I", values)
+    if sys.byteorder == "big":
+        numbers.byteswap()
+    return numbers.tobytes()
+
+def _unnumbers(data):
+    numbers = array("I")
+    numbers.frombytes(data)
+    if sys.byteorder == "big":
+        numbers.byteswap()
+    return numbers
+
+def dumps(ast, cachekey):
+    """
+    Serializes the tree under ast to bytes, tagged with cachekey.
+
+    >>> argument = nodes.Argument([lexer.Token("hi", "CHARACTER", "hi"),
+    ...                            lexer.Token("there", "CHARACTER", "there")])
+    >>> ast = nodes.make_macro(lexer.Token("link", "MACROCOMMAND", "\\link"), argument)
+    >>> data = dumps(ast, key(b"source"))
+    >>> data[:len(MAGIC)], len(data)
+    (b'TWXAST', 250)
+    >>> link = loads(data, key(b"source"))
+    >>> link, link.text, link.target
+    (Link('link'), Token('hi', 'CHARACTER', 'hi'), Token('there', 'CHARACTER', 'there'))
+    """
+    collecting = gc.isenabled()
+    gc.disable() # see loads
+    try:
+        body = _flatten(ast)
+    finally:
+        if collecting:
+            gc.enable()
+    checksum = hashlib.blake2b(body, digest_size = 16).digest()
+    return HEADER.pack(MAGIC, FORMAT, cachekey, checksum) + body
+
+def _flatten(ast):
+    strings = {None: 0}
+    string = strings.setdefault
+    ids = {id(ast): 0}
+    order = [ast]
+    fields = []
+    links = []
+    for token in order: # order grows as new nodes turn up
+        if isinstance(token, nodes.Node):
+            children = token.children
+            value = match = None
+        elif token.source is None:
+            children = token._children
+            value, match = token._value, token._match
+        else:
+            children = token._children
+            value, match = token.value, token.match
+        if children:
+            for child in children:
+                index = ids.get(id(child))
+                if index is None:
+                    index = ids[id(child)] = len(order)
+                    order.append(child)
+                links.append(index)
+        start = token.start
+        fields += (string(token.token_type, len(strings)),
+                  string(value, len(strings)),
+                  string(match, len(strings)),
+                  0 if start is None else start + 1,
+                  len(children) if children else 0)
+    del strings[None]
+    lengths = [len(string) for string in strings]
+    return b"".join([COUNTS.pack(len(lengths), len(order), len(links)),
+                     _numbers(lengths),
+                     "".join(strings).encode("utf-8", "surrogatepass"),
+                     _numbers(fields),
+                     _numbers(links)])
+
+def loads(data, cachekey):
+    """
+    Rebuilds a tree from bytes made by dumps, or returns None if they
+    weren't made with cachekey or are damaged.
+
+    >>> data = dumps(lexer.Token("hi", "CHARACTER", "hi"), key(b"source"))
+    >>> loads(data, key(b"source"))
+    Token('hi', 'CHARACTER', 'hi')
+    >>> loads(data, key(b"changed source")) is None
+    True
+    >>> loads(data[:-1] + b"!", key(b"source")) is None
+    True
+    >>> loads(b"junk", key(b"source")) is None
+    True
+    """
+    if len(data) < HEADER.size + COUNTS.size:
+        return None
+    magic, version, datakey, checksum = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT or datakey != cachekey:
+        return None
+    body = memoryview(data)[HEADER.size:]
+    if hashlib.blake2b(body, digest_size = 16).digest() != checksum:
+        logger.warning("ignoring corrupt AST cache")
+        return None
+    # nothing made here is garbage, so there's no point letting the cycle
+    # collector look over the new nodes again and again as they're made
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _build(body)
+    except (ValueError, IndexError, UnicodeDecodeError, struct.error):
+        logger.warning("ignoring corrupt AST cache")
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+
+def _build(body):
+    count, size, linkcount = COUNTS.unpack_from(body)
+    position = COUNTS.size
+    lengths = _unnumbers(body[position:position + 4 * count])
+    position += 4 * count
+    blob_end = position
+    text = ""
+    strings = [None]
+    if count:
+        # the blob is as long as the strings in it once they're encoded,
+        # which is where the node numbers start
+        blob_end = len(body) - 4 * (FIELDS * size + linkcount)
+        text = str(body[position:blob_end], "utf-8", "surrogatepass")
+        offset = 0
+        for length in lengths:
+            strings.append(text[offset:offset + length])
+            offset += length
+        if offset != len(text):
+            raise ValueError("string table doesn't match its lengths")
+    numbers = _unnumbers(body[blob_end:blob_end + 4 * FIELDS * size])
+    links = _unnumbers(body[blob_end + 4 * FIELDS * size:])
+    if len(numbers) != FIELDS * size or len(links) != linkcount or not size:
+        raise ValueError("wrong number of nodes")
+    new = lexer.Token.__new__
+    Token = lexer.Token
+    classes = nodes.CLASSES
+    tokens = []
+    append = tokens.append
+    for token_type, value, match, start in zip(numbers[0::5], numbers[1::5],
+                                               numbers[2::5], numbers[3::5]):
+        token_type = strings[token_type]
+        if token_type in classes:
+            append(None) # made from its children below
+            continue
+        token = new(Token)
+        token.token_type = token_type
+        token._value = strings[value]
+        token._match = strings[match]
+        token.source = None
+        token.start = start - 1 if start else None
+        token._children = None
+        append(token)
+    counts = numbers[4::5]
+    ends = list(itertools.accumulate(counts))
+    if ends[-1] != linkcount:
+        raise ValueError("wrong number of child links")
+    # children come after their parents, so making the nodes from the last
+    # one back means every node's children are there when it's made
+    for index in range(size - 1, -1, -1):
+        count = counts[index]
+        token = tokens[index]
+        if token is not None and not count:
+            continue
+        children = [tokens[child] for child in links[ends[index] - count:ends[index]]]
+        if None in children:
+            raise ValueError("a child comes before its parent")
+        if token is None:
+            tokens[index] = classes[strings[numbers[5 * index]]].from_children(children)
+        else:
+            token._children = children
+    return tokens[0]
+
+def load(filename, cachekey):
+    """ the AST cached in filename for cachekey, or None. """
+    try:
+        with open(filename, "rb") as file:
+            data = file.read()
+    except OSError:
+        return None
+    return loads(data, cachekey)
+
+def save(filename, ast, cachekey):
+    """ writes ast to filename, replacing it all at once. """
+    partial = filename + ".tmp"
+    with open(partial, "wb") as file:
+        file.write(dumps(ast, cachekey))
+    os.replace(partial, filename)
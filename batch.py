@@ -0,0 +1,293 @@
+"""
+batch.py
+
+Compiles many stories in one go, spread over a pool of worker
+processes, one per core. Each worker compiles whole files in-process
+with compiler.compile_file, so there's no interpreter start-up per
+story. A manifest of the hash of every story that compiled, taken over
+the story's file and every file it \\includes, keeps the next build
+from recompiling the ones that haven't changed.
+
+    python3 batch.py stories/ extra/*.twx
+
+MIT License
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import compiler
+import lexer
+import log
+
+logger = log.getLogger("batch")
+
+MANIFEST = ".tweetex-manifest.json"
+
+def expand(paths):
+    """
+    The .twx files named by paths, which can be files, directories (searched
+    recursively) or glob patterns, sorted and without duplicates. Files found
+    in a directory or by a pattern are only taken if they're stories, not
+    chapters that a story \\includes (see is_story).
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> for name in ["a.twx", "b.twx", "notes.txt", "sub/c.twx", "sub/chapter.twx"]:
+    ...     path = os.path.join(directory.name, name)
+    ...     os.makedirs(os.path.dirname(path), exist_ok = True)
+    ...     with open(path, "w") as file:
+    ...         _ = file.write("\\\\passage{one}" if "chapter" in name else "\\\\title{T}")
+    >>> found = expand([directory.name, os.path.join(directory.name, "*.twx")])
+    >>> [os.path.relpath(path, directory.name) for path in found]
+    ['a.twx', 'b.twx', 'sub/c.twx']
+    >>> directory.cleanup()
+    """
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            found.update(filter(is_story, glob.glob(os.path.join(path, "**", "*.twx"),
+                                                    recursive = True)))
+        elif glob.has_magic(path):
+            found.update(filter(is_story, glob.glob(path, recursive = True)))
+        else:
+            found.add(path)
+    return sorted(found)
+
+def is_story(filename):
+    """
+    True if the first command in filename is a preamble macro, as in every
+    story, rather than the \\passage or \\include an included file starts with.
+    Files that can't be read count as stories, so the build reports them.
+    """
+    try:
+        with open(filename, encoding = "utf-8") as file:
+            source = file.read()
+    except (OSError, UnicodeDecodeError):
+        return True
+    for token in lexer.Lexer(source).tokenize():
+        if token.token_type != "CHARACTER":
+            return token.token_type == "PREAMBLECOMMAND"
+    return False
+
+def outname(filename):
+    return filename[:-3] + "tw"
+
+CHUNK_SIZE = 1 << 16
+
+def file_digest(filename):
+    """ a hash of the contents of filename, read a chunk at a time. """
+    digest = hashlib.blake2b()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+def closure(filename):
+    """
+    The absolute paths of filename and of every file it includes, directly
+    or not, found with includes.Includes. A story that doesn't include
+    anything isn't parsed to find that out.
+    """
+    path = os.path.abspath(filename)
+    with open(path, "rb") as file:
+        if b"\\include" not in file.read():
+            return [path]
+    import includes # only needed for stories in more than one file
+    found = includes.Includes()
+    with log.capture(): # any errors are the compile's to report
+        entry = found.read(path, main = True)
+        if entry == False or not found.resolve(entry.parts, path):
+            return [path]
+    return [path] + found.dependencies()
+
+def closure_digest(paths):
+    """ a hash of compiler.VERSION and the name and contents of each of paths. """
+    digest = hashlib.blake2b(compiler.VERSION.encode())
+    for path in paths:
+        digest.update(path.encode("utf-8", "surrogateescape") + b"\0")
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()[:32]
+
+def compile_one(filename):
+    """
+    Compiles one story, for a worker process. Returns (filename, seconds,
+    error, entry), where error is None if the story compiled, or otherwise
+    the messages the compiler printed, and entry is the story's entry for
+    the manifest: the files it's made of and their hash, taken before the
+    compile so that an edit made during it isn't missed.
+    """
+    start = time.perf_counter()
+    try:
+        files = closure(filename)
+        entry = {"files": files, "hash": closure_digest(files)}
+        with log.capture() as messages:
+            ast = compiler.compile_file(filename, outname(filename))
+    except Exception as error: # a broken story shouldn't take the build down
+        return filename, time.perf_counter() - start, f"{type(error).__name__}: {error}", None
+    if ast == False:
+        return (filename, time.perf_counter() - start,
+                "\n".join(messages) or "Parsing failed", None)
+    return filename, time.perf_counter() - start, None, entry
+
+class Build:
+    """
+    One batch build, compiling every story that changed since the manifest
+    was last written.
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> def save(name, text):
+    ...     with open(os.path.join(directory.name, name), "w") as file:
+    ...         _ = file.write(text)
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...          "\\\\passage{one} Hi.")
+    >>> save("good.twx", story)
+    >>> save("bad.twx", "\\\\title{T} \\\\passage{one} Hi.")
+    >>> manifest = os.path.join(directory.name, "manifest.json")
+    >>> build = Build(manifest, workers = 1)
+    >>> build.run([directory.name])
+    False
+    >>> [os.path.basename(name) for name in build.compiled], build.skipped
+    (['good.twx'], [])
+    >>> [(os.path.basename(name), error) for name, error in build.failed]
+    [('bad.twx', 'Parsing Error: Preamble not formatted correctly.\\nParsing failed')]
+
+    Stories that haven't changed are skipped next time, but failed ones are retried.
+    >>> build = Build(manifest, workers = 1)
+    >>> build.run([directory.name])
+    False
+    >>> build.compiled, [os.path.basename(name) for name in build.skipped]
+    ([], ['good.twx'])
+    >>> [os.path.basename(name) for name, error in build.failed]
+    ['bad.twx']
+
+    A story is compiled again when a file it includes changes.
+    >>> os.remove(os.path.join(directory.name, "bad.twx"))
+    >>> save("good.twx", story + " \\\\include{ch.twx}")
+    >>> save("ch.twx", "\\\\passage{two} Old.")
+    >>> Build(manifest, workers = 1).run([directory.name])
+    True
+    >>> save("ch.twx", "\\\\passage{two} New.")
+    >>> build = Build(manifest, workers = 1)
+    >>> build.run([directory.name])
+    True
+    >>> [os.path.basename(name) for name in build.compiled]
+    ['good.twx']
+    >>> with open(os.path.join(directory.name, "good.tw")) as file:
+    ...     file.read().split("\\n")[-1]
+    'New.'
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, manifest = MANIFEST, workers = None, force = False):
+        self.manifest = manifest
+        self.workers = workers or os.cpu_count() or 1
+        self.force = force
+        self.hashes = {}   # filename -> {"files": what it's made of, "hash": their hash}
+        self.compiled = [] # filenames
+        self.skipped = []  # filenames
+        self.failed = []   # (filename, error)
+        self.seconds = {}  # filename -> seconds spent compiling it
+        self.total = 0.0
+        if not force:
+            self.load()
+
+    def load(self):
+        """ reads the manifest, ignoring it if it's missing, broken or stale. """
+        try:
+            with open(self.manifest) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(manifest, dict) or manifest.get("version") != compiler.VERSION:
+            return
+        self.hashes = manifest.get("files", {})
+
+    def save(self):
+        manifest = {"version": compiler.VERSION, "files": self.hashes}
+        partial = self.manifest + ".tmp"
+        with open(partial, "w") as file:
+            json.dump(manifest, file, indent = 1, sort_keys = True)
+        os.replace(partial, self.manifest)
+
+    def run(self, paths):
+        """ builds the stories named by paths; returns True if none of them failed. """
+        start = time.perf_counter()
+        pending = []
+        for filename in expand(paths):
+            if self.unchanged(filename):
+                self.skipped.append(filename)
+            else:
+                pending.append(filename)
+        if len(pending) > 1 and self.workers > 1:
+            with ProcessPoolExecutor(min(self.workers, len(pending))) as pool:
+                results = list(pool.map(compile_one, pending))
+        else: # not worth starting any processes for
+            results = [compile_one(filename) for filename in pending]
+        for filename, seconds, error, entry in results:
+            self.seconds[filename] = seconds
+            if error is None:
+                self.compiled.append(filename)
+                self.hashes[os.path.abspath(filename)] = entry
+            else:
+                self.failed.append((filename, error))
+                self.hashes.pop(os.path.abspath(filename), None)
+        self.save()
+        self.total = time.perf_counter() - start
+        return not self.failed
+
+    def unchanged(self, filename):
+        """
+        True if filename and the files it included when it last compiled are
+        the same as they were then, and its output is still there. A new
+        \\include changes the file with it in, so that's noticed too.
+        """
+        entry = self.hashes.get(os.path.abspath(filename))
+        if not isinstance(entry, dict) or not os.path.exists(outname(filename)):
+            return False
+        try:
+            return closure_digest(entry["files"]) == entry["hash"]
+        except (OSError, KeyError, TypeError):
+            return False
+
+    def report(self):
+        """ a summary of the build, with every error and the slowest stories. """
+        lines = [f"compiled {len(self.compiled)}, skipped {len(self.skipped)}, "
+                 f"failed {len(self.failed)} in {self.total:.2f} s "
+                 f"({sum(self.seconds.values()):.2f} s of compiling on "
+                 f"{self.workers} worker{'s' if self.workers != 1 else ''})"]
+        for filename, error in self.failed:
+            lines.append(f"FAILED {filename}: " + error.replace("\n", "; "))
+        slowest = sorted(self.seconds.items(), key = lambda item: item[1], reverse = True)
+        for filename, seconds in slowest[:5]:
+            lines.append(f"{seconds:8.3f} s  {filename}")
+        return "\n".join(lines)
+
+def getargs():
+    parser = argparse.ArgumentParser(description="compiles many TweeTeX files at once")
+    parser.add_argument('paths', metavar='path', nargs='+',
+            help='.twx files, directories to search for them, or glob patterns')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: one per core)')
+    parser.add_argument('--manifest', default=MANIFEST,
+            help=f'where to keep the hashes of compiled stories (default: {MANIFEST})')
+    parser.add_argument('--force', action='store_true',
+            help='recompile every story, even if it has not changed')
+    return parser.parse_args()
+
+def main():
+    args = getargs()
+    log.configure(log.QUIET)
+    build = Build(args.manifest, args.jobs, args.force)
+    ok = build.run(args.paths)
+    print(build.report())
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""
+benchmarks
+
+Timing scripts for the TweeTeX compiler. Run them from the top of the
+repository so the compiler modules can be imported, eg:
+
+    python3 -m benchmarks.suite --output results.jsonl
+
+suite runs the lexer, parser, templater and end-to-end benchmarks over
+stories from storygen at a range of sizes, and can compare a run with
+saved results to catch regressions between commits. The other modules
+each look at one thing (scaling of a single phase, memory, logging).
+
+MIT License
+"""
@@ -0,0 +1,133 @@
+"""
+benchmarks/ast_nodes.py
+
+Compares the typed AST nodes (see nodes.py) with the generic
+lexer.Tokens the parser used to build every node from, on a generated
+100,000 passage story: the memory the nodes above the tokens take, and
+how long templater.writeTokens takes to walk the tree, next to the walk
+it used to do, which picked what to do with each node by comparing
+token_type strings and reached into nodes by position.
+
+    python3 -m benchmarks.ast_nodes [passages]
+
+MIT License
+"""
+import gc
+import sys
+import time
+import tracemalloc
+
+import lexer
+import nodes
+import parser
+import templater
+from benchmarks.storygen import make_story
+
+PASSAGES = 100000
+
+def as_tokens(node, made = None):
+    """ the tree under node in the old layout, with a Token for every node. """
+    made = {} if made is None else made
+    if not isinstance(node, nodes.Node):
+        return node
+    if id(node) in made:  # a macro's Argument, shared between its arguments
+        return made[id(node)]
+    token = made[id(node)] = lexer.Token(token_type = node.token_type)
+    children = node.children
+    if isinstance(node, (nodes.Macro, nodes.Passage)):
+        # the parser used to add the one ARGUMENT token once for each argument
+        children = [children[0]] + [children[1]] * len(children[1].items) + children[2:]
+    token.children = [as_tokens(child, made) for child in children]
+    return token
+
+def old_write_tokens(parent, write):
+    """ templater.writeTokens as it was for trees of Tokens, less the preamble. """
+    stack = [parent]
+    while stack:
+        parent = stack.pop()
+        if isinstance(parent, str):
+            write(parent)
+            continue
+        token_type = parent.token_type
+        if token_type in ["ARGUMENT", "STORY"]:
+            stack.extend(reversed(parent.children))
+        elif token_type == "INCLUDE":
+            stack.extend(reversed(parent.children[2:]))
+        elif token_type == "PREAMBLE":
+            pass
+        elif token_type == "MACRO":
+            if parent.children[0].value == "link":
+                write(templater.TEMPLATES['link'](text = parent.children[1].children[0].value,
+                                                  link = parent.children[2].children[1].value))
+        elif token_type == "PASSAGE":
+            write('\n:: ')
+            stack.extend(reversed([child for child in parent.children
+                                   if child.token_type == "TEXT"]))
+            stack.append(parent.children[1])
+        elif token_type in templater.TEMPLATES:
+            if token_type == "TEXT":
+                write(templater.TEMPLATES["TEXT"]())
+                stack.extend(reversed(parent.children))
+            else:
+                write(templater.TEMPLATES[token_type](value = parent.value))
+        else:
+            write(parent.value)
+
+def traced(build):
+    """ returns what build() returned and the bytes it left allocated. """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+def best(run, repeat = 3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def count(ast):
+    """ the number of distinct nodes (not tokens) in ast. """
+    seen = set()
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (nodes.Node, lexer.Token)) and node.token_type in nodes.CLASSES \
+                and id(node) not in seen:
+            seen.add(id(node))
+            stack.extend(node.children)
+    return len(seen)
+
+def main(passages = PASSAGES):
+    mylexer = lexer.Lexer(make_story(passages, links = 3))
+    mylexer.lex()
+    tokens = list(mylexer.tokens.queue)
+    # the tokens already exist, so what's left allocated is the nodes
+    ast, typed = traced(lambda: parser.parse(lexer.TokenStream(tokens)))
+    old, generic = traced(lambda: as_tokens(ast))
+    number = count(ast)
+    print(f"story: {passages} passages, {len(tokens)} tokens, {number} nodes")
+    print(f"Token nodes:  {generic / 1e6:7.1f} MB  ({generic / number:4.0f} bytes/node)")
+    print(f"typed nodes:  {typed / 1e6:7.1f} MB  ({typed / number:4.0f} bytes/node)")
+    def old_walk():
+        output = []
+        for part in old.children[1:]:
+            old_write_tokens(part, output.append)
+        return "".join(output)
+    def new_walk():
+        output = []
+        for part in ast.parts:
+            templater.writeTokens(part, output)
+        return "".join(output)
+    same = old_walk() == new_walk()
+    old_seconds, new_seconds = best(old_walk), best(new_walk)
+    print(f"walk, Tokens: {old_seconds:7.3f} s")
+    print(f"walk, typed:  {new_seconds:7.3f} s  ({old_seconds / new_seconds:.2f}x faster, "
+          f"same output: {same})")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,68 @@
+"""
+benchmarks/command_registry.py
+
+Times lexing a generated story as more and more macros are registered
+(see commands.py), with the lexer's one command pattern, which looks
+each name up in the registry, and with a pattern that lists every
+command in an alternation, the way the lexer's token table used to.
+
+    python3 -m benchmarks.command_registry [passages]
+
+MIT License
+"""
+import itertools
+import string
+import sys
+import time
+
+import commands
+import lexer
+from benchmarks.storygen import make_story
+
+PASSAGES = 20000
+COUNTS = [0, 10, 100, 1000]
+
+def names(count):
+    """ count made up macro names, made of letters only like every command's. """
+    letters = itertools.product(string.ascii_lowercase, repeat = 3)
+    return ["x" + "".join(next(letters)) for _ in range(count)]
+
+def listing_scanner():
+    """ a Scanner with one alternation of names for each kind of command. """
+    token_types = {r'(\{)': "LEFTCURLY", r'(\})': "RIGHTCURLY"}
+    for kind, token_type in commands.KIND_TOKEN_TYPES.items():
+        token_types[r'(\\(' + "|".join(commands.of_kind(kind)) + r'))'] = token_type
+    token_types[r'([^\\\{\}]+)'] = "CHARACTER"
+    return lexer.Scanner(token_types)
+
+def time_lex(source, scanner, repeat = 5):
+    best = None
+    for _ in range(repeat):
+        mylexer = lexer.Lexer(source)
+        mylexer.scanner = scanner
+        start = time.perf_counter()
+        for _token in mylexer.tokenize():
+            pass
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def main(passages = PASSAGES):
+    source = make_story(passages, links = 3)
+    print(f"story: {passages} passages, {len(source) / 1e6:.1f} MB")
+    print(f"{'commands':>9} {'registry s':>11} {'alternation s':>14} {'ratio':>6}")
+    for count in COUNTS:
+        added = names(count)
+        for name in added:
+            commands.register(name, "macro", ["value"], "<<" + name + " {value}>>")
+        try:
+            total = len(commands.COMMANDS)
+            registry = time_lex(source, lexer.SCANNER)
+            listing = time_lex(source, listing_scanner())
+        finally:
+            for name in added:
+                commands.unregister(name)
+        print(f"{total:>9} {registry:>11.3f} {listing:>14.3f} {listing / registry:>6.2f}")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
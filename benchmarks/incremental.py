@@ -0,0 +1,41 @@
+"""
+benchmarks/incremental.py
+
+Times recompiling a generated story after editing one passage, with a
+full compile and with IncrementalCompiler (fresh from its cache file,
+and warm in memory).
+
+    python3 -m benchmarks.incremental [passages]
+
+MIT License
+"""
+import os
+import sys
+import tempfile
+import time
+
+import compiler
+from incremental import IncrementalCompiler
+from benchmarks.storygen import make_story
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main(passages = 5000):
+    source = make_story(passages, 3)
+    edited = source.replace("text in passage 17.", "edited text in passage 17.")
+    with tempfile.TemporaryDirectory() as directory:
+        outname = os.path.join(directory, "story.tw")
+        cachefile = outname + ".cache"
+        IncrementalCompiler(cachefile).compile(source)
+        warm = IncrementalCompiler()
+        warm.compile(source)
+        print(f"story: {passages} passages, one edited")
+        print(f"full compile:         {timed(compiler.compile_source, edited, outname):8.3f} s")
+        print(f"incremental (cache):  {timed(IncrementalCompiler(cachefile).compile, edited):8.3f} s")
+        print(f"incremental (warm):   {timed(warm.compile, edited):8.3f} s")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
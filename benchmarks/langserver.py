@@ -0,0 +1,63 @@
+"""
+benchmarks/langserver.py
+
+Times the edits a language server sees while someone types into a big
+generated story, from the didChange message coming in to the
+diagnostics going out: single characters typed into a passage, a new
+passage pasted in, and a \\passage broken and fixed again, which merges
+two passages and splits them apart. Opening the story (a full parse)
+is timed too, for comparison.
+
+    python3 -m benchmarks.langserver [passages] [edits]
+
+MIT License
+"""
+import statistics
+import sys
+import time
+
+from langserver import LanguageServer
+from benchmarks.storygen import make_story
+
+URI = "file:///story.twx"
+
+def change(server, start, end, text):
+    """ sends the edit replacing text[start:end]; returns how long it took, in ms. """
+    document = server.documents[URI]
+    edit = {"range": {"start": dict(zip(("line", "character"), document.position(start))),
+                      "end": dict(zip(("line", "character"), document.position(end)))},
+            "text": text}
+    began = time.perf_counter()
+    server.handle({"jsonrpc": "2.0", "method": "textDocument/didChange",
+                   "params": {"textDocument": {"uri": URI}, "contentChanges": [edit]}})
+    return (time.perf_counter() - began) * 1000
+
+def report(name, times):
+    print(f"{name:24} median {statistics.median(times):6.2f} ms   max {max(times):6.2f} ms")
+
+def main(passages = 50000, edits = 200):
+    source = make_story(passages, 3)
+    server = LanguageServer()
+    server.handle({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params":
+                   {"capabilities": {"general": {"positionEncodings": ["utf-32"]}}}})
+    start = time.perf_counter()
+    server.handle({"jsonrpc": "2.0", "method": "textDocument/didOpen",
+                   "params": {"textDocument": {"uri": URI, "text": source}}})
+    print(f"story: {passages} passages, {len(source)} characters")
+    print(f"open (full parse):       {time.perf_counter() - start:8.3f} s")
+    middle = source.index(f"text in passage {passages // 2}.")
+    report("type a character", [change(server, middle + number, middle + number, "x")
+                                for number in range(edits)])
+    text = server.documents[URI].text
+    end = text.index(f"\\passage{{Passage {passages // 2 + 1}}}")
+    pasted = "\\passage{Pasted}\nSome new text. \\link{Back}{Passage 0}\n"
+    report("paste a passage", [change(server, end, end, pasted)])
+    breaking = []
+    for _ in range(edits // 10):
+        breaking.append(change(server, end + 1, end + 2, ""))  # \assage{Pasted}
+        breaking.append(change(server, end + 1, end + 1, "p"))
+    report("break/fix a \\passage", breaking)
+    print(f"problems after editing:  {len(server.documents[URI].diagnostics())}")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,32 @@
+"""
+benchmarks/lexer_scaling.py
+
+Times Lexer.lex() on generated stories of doubling size. The time per
+megabyte should stay flat as the story grows if lexing is linear.
+
+    python3 -m benchmarks.lexer_scaling
+
+MIT License
+"""
+import time
+
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+SIZES = [1000, 2000, 4000, 8000, 16000, 32000, 64000]
+
+def time_lex(source):
+    start = time.perf_counter()
+    Lexer(source).lex()
+    return time.perf_counter() - start
+
+def main():
+    print(f"{'passages':>10} {'MB':>8} {'seconds':>9} {'s/MB':>7}")
+    for passages in SIZES:
+        source = make_story(passages)
+        megabytes = len(source) / 1e6
+        seconds = time_lex(source)
+        print(f"{passages:>10} {megabytes:>8.2f} {seconds:>9.3f} {seconds / megabytes:>7.3f}")
+
+if __name__ == "__main__":
+    main()
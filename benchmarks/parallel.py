@@ -0,0 +1,39 @@
+"""
+benchmarks/parallel.py
+
+Times compiling one big generated story serially and with parallel.py
+on increasing numbers of processes, checking that every run gives the
+same output as the serial compile. Speedups can't go past the number of
+cores on the machine, which is printed first.
+
+    python3 -m benchmarks.parallel [passages] [max processes]
+
+MIT License
+"""
+import os
+import sys
+import time
+
+import parallel
+from benchmarks.storygen import make_story
+
+def main(passages = 200000, most = None):
+    most = most or os.cpu_count() or 1
+    source = make_story(passages, 3)
+    print(f"story: {passages} passages, {len(source) / 1e6:.1f} MB; {os.cpu_count()} cores")
+    start = time.perf_counter()
+    serial = parallel.compile_story(source, workers = 1)
+    base = time.perf_counter() - start
+    print(f"{'processes':>9} {'seconds':>9} {'speedup':>8}")
+    print(f"{1:9d} {base:9.2f} {1.0:8.2f}")
+    workers = 2
+    while workers <= most:
+        start = time.perf_counter()
+        output = parallel.compile_story(source, workers = workers)
+        seconds = time.perf_counter() - start
+        assert output == serial, "parallel output differs from serial output"
+        print(f"{workers:9d} {seconds:9.2f} {base / seconds:8.2f}")
+        workers *= 2
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
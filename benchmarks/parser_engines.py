@@ -0,0 +1,94 @@
+"""
+benchmarks/parser_engines.py
+
+Compares the two parser engines: parser.parse(), the recursive descent
+parser, and llparser.parse(), the table-driven one. For stories of
+growing size it checks that both build the same AST and times each on
+the same tokens; then it finds how deeply links can be nested inside
+links before each engine fails.
+
+    python3 -m benchmarks.parser_engines [max nesting to try]
+
+MIT License
+"""
+import sys
+import time
+
+import llparser
+import log
+import parser
+from lexer import Lexer, TokenStream
+from benchmarks.storygen import make_story
+
+SIZES = [1000, 10000, 100000]
+
+def same(first, second):
+    """ whether two ASTs have the same shape and tokens, without recursing. """
+    pairs = [(first, second)]
+    while pairs:
+        first, second = pairs.pop()
+        if (first.token_type, first.value) != (second.token_type, second.value):
+            return False
+        if len(first.children) != len(second.children):
+            return False
+        pairs.extend(zip(first.children, second.children))
+    return True
+
+def lex(source):
+    mylexer = Lexer(source)
+    mylexer.lex()
+    return list(mylexer.tokens.queue)
+
+def time_parse(engine, tokens):
+    """ the best of three parses of tokens, and the AST. """
+    best = None
+    for _ in range(3):
+        stream = TokenStream(tokens)  # parsing uses the stream up
+        start = time.perf_counter()
+        ast = engine(stream)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, ast
+
+def parses(engine, depth):
+    """ whether engine can parse a link nested depth levels deep. """
+    # make_story(1, nesting = depth), without its quadratic string building
+    header, body = make_story(1).split("\\link{Go on}")
+    tokens = lex(header + "\\link{" * depth + "\\link{Go on}"
+                 + "{Passage 0}}" * depth + body)
+    try:
+        with log.capture():
+            return engine(TokenStream(tokens)) != False
+    except RecursionError:
+        return False
+
+def deepest(engine, limit):
+    """ the deepest nesting engine can parse, up to limit. """
+    depth = 1
+    while depth < limit and parses(engine, depth * 2):
+        depth *= 2
+    if depth >= limit:
+        return limit if parses(engine, limit) else depth
+    low, high = depth, min(depth * 2, limit)  # parses at low, not at high
+    while high - low > 1:
+        middle = (low + high) // 2
+        if parses(engine, middle):
+            low = middle
+        else:
+            high = middle
+    return low
+
+def main(limit = 100000):
+    print(f"{'passages':>10} {'tokens':>9} {'recursive s':>12} {'table s':>9} {'ratio':>6}  same AST")
+    for passages in SIZES:
+        tokens = lex(make_story(passages, links = 3, nesting = 1))
+        recursive, first = time_parse(parser.parse, tokens)
+        table, second = time_parse(llparser.parse, tokens)
+        print(f"{passages:>10} {len(tokens):>9} {recursive:>12.3f} {table:>9.3f} "
+              f"{table / recursive:>6.2f}  {same(first, second)}")
+    print(f"deepest nesting (trying up to {limit}), recursion limit {sys.getrecursionlimit()}:")
+    print(f"  recursive descent: {deepest(parser.parse, limit)}")
+    print(f"  table-driven:      {deepest(llparser.parse, limit)}")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
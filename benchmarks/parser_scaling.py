@@ -0,0 +1,38 @@
+"""
+benchmarks/parser_scaling.py
+
+Times parser.parse() on token streams of doubling length, up to about a
+million tokens. The time per million tokens should stay flat as the
+stream grows if parsing is linear.
+
+    python3 -m benchmarks.parser_scaling
+
+MIT License
+"""
+import contextlib
+import os
+import time
+
+import parser
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+SIZES = [6250, 12500, 25000, 50000, 100000]
+
+def time_parse(tokens):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        parser.parse(tokens)
+        return time.perf_counter() - start
+
+def main():
+    print(f"{'passages':>10} {'tokens':>9} {'seconds':>9} {'s/Mtok':>7}")
+    for passages in SIZES:
+        mylexer = Lexer(make_story(passages))
+        mylexer.lex()
+        count = len(mylexer.tokens)
+        seconds = time_parse(mylexer.tokens)
+        print(f"{passages:>10} {count:>9} {seconds:>9.3f} {seconds / count * 1e6:>7.3f}")
+
+if __name__ == "__main__":
+    main()
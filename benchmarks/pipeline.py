@@ -0,0 +1,71 @@
+"""
+benchmarks/pipeline.py
+
+Compares the pipelined compile path (compiler.compile_file) with the
+two-phase one (read the file, lex it all, then parse) on a generated
+story, for wall-clock time and peak traced memory, both for the whole
+compile and for lexing and parsing alone. Each path is run
+once for time and once under tracemalloc for memory, because tracing
+slows everything down.
+
+    python3 -m benchmarks.pipeline [passages]
+
+MIT License
+"""
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import compiler
+import lexer
+import parser
+from benchmarks.storygen import make_story
+
+def two_phase(path, outname):
+    with open(path) as file:
+        source = file.read()
+    compiler.compile_source(source, outname)
+
+def pipelined(path, outname):
+    compiler.compile_file(path, outname)
+
+def two_phase_parse(path, outname):
+    with open(path) as file:
+        mylexer = lexer.Lexer(file.read())
+    mylexer.lex()
+    parser.parse(mylexer.tokens)
+
+def pipelined_parse(path, outname):
+    with open(path, "rb") as file:
+        parser.parse(lexer.TokenStream(lexer.StreamLexer(file).tokenize()))
+
+def measure(compile, path, outname):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        compile(path, outname)
+        seconds = time.perf_counter() - start
+        tracemalloc.start()
+        compile(path, outname)
+        _size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return seconds, peak
+
+def main(passages = 20000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "story.twx")
+        outname = os.path.join(directory, "story.tw")
+        with open(path, "w") as file:
+            file.write(make_story(passages))
+        print(f"story: {passages} passages, {os.path.getsize(path) / 1e6:.2f} MB")
+        print(f"{'path':>20} {'seconds':>9} {'peak MB':>9}")
+        for name, compile in [("two-phase", two_phase), ("pipelined", pipelined),
+                              ("two-phase lex+parse", two_phase_parse),
+                              ("pipelined lex+parse", pipelined_parse)]:
+            seconds, peak = measure(compile, path, outname)
+            print(f"{name:>20} {seconds:>9.3f} {peak / 1e6:>9.1f}")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,95 @@
+"""
+benchmarks/reachability.py
+
+Generates stories in which a growing share of the passages can't be
+reached from the start, and times what the compiler does after parsing
+with and without --prune-unreachable: checking the links (which records
+the link graph) and generating the Twee code for every passage, against
+checking, finding the reachable passages and the cycles, and generating
+only the reachable passages. Then times making the link graph, the
+search and finding the cycles on their own on stories of doubling size,
+which should take time in proportion to the size if they're linear.
+
+    python3 -m benchmarks.reachability [passages]
+
+MIT License
+"""
+import gc
+import sys
+import time
+
+import log
+import parser
+import reachability
+import symbols
+import templater
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+PASSAGES = 20000
+SHARES = [0.0, 0.25, 0.5, 0.9]
+SIZES = [10000, 20000, 40000, 80000]
+
+def orphans(count):
+    """ count passages that no reachable passage links to, linked in a ring. """
+    return "".join(f"\\passage{{Orphan {number}}}\nNobody comes here. "
+                   f"\\link{{Onward}}{{Orphan {(number + 1) % count}}}\n"
+                   for number in range(count))
+
+def parse(source):
+    mylexer = Lexer(source)
+    mylexer.lex()
+    with log.capture():
+        return parser.parse(mylexer.tokens)
+
+def timed(run, repeat = 3):
+    """
+    the best time of run() and what it returned, with the garbage collector
+    off, since otherwise the time goes on scanning the AST as much as on run.
+    """
+    best = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+    finally:
+        gc.enable()
+    return best, result
+
+def checked(ast):
+    table = symbols.SymbolTable()
+    for _passage in ast.parts:
+        table.add(_passage)
+    table.check(ast)
+    return table
+
+def main(passages = PASSAGES):
+    print(f"{'unreachable':>12} {'full s':>8} {'pruned s':>9} {'full MB':>8} {'pruned MB':>10}")
+    for share in SHARES:
+        lost = int(passages * share)
+        ast = parse(make_story(passages - lost, links = 3) + orphans(lost))
+        def full():
+            checked(ast)
+            return templater.visitTokens(ast)
+        def pruned():
+            graph = reachability.Reachability(ast, checked(ast).edges)
+            graph.cycles()
+            return templater.visitTokens(reachability.prune(ast, graph.reachable))
+        seconds, output = timed(full)
+        pruned_seconds, smaller = timed(pruned)
+        print(f"{share:>11.0%} {seconds:>8.3f} {pruned_seconds:>9.3f} {len(output) / 1e6:>8.2f} "
+              f"{len(smaller) / 1e6:>10.2f}")
+    print(f"{'passages':>10} {'graph s':>8} {'search s':>9} {'cycles s':>9} {'us/passage':>11}")
+    for size in SIZES:
+        ast = parse(make_story(size, links = 3))
+        build, graph = timed(lambda: reachability.Reachability(ast))
+        search, _found = timed(lambda: graph.search([graph.start]))
+        cycles, _cycles = timed(graph.cycles)
+        total = build + search + cycles
+        print(f"{size:>10} {build:>8.3f} {search:>9.3f} {cycles:>9.3f} {total / size * 1e6:>11.1f}")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
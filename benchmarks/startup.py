@@ -0,0 +1,61 @@
+"""
+benchmarks/startup.py
+
+Compares how long `import tweetex` takes, from python -X importtime, in
+the working tree and in a git revision (HEAD by default), and which of
+the heavier standard library modules each of them pulls in.
+
+    python3 -m benchmarks.startup [revision] [runs]
+
+MIT License
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MODULE = "tweetex"
+WATCHED = ["argparse", "json", "re", "tracemalloc", "concurrent.futures", "hashlib"]
+
+def import_times(directory, runs):
+    """ the median total import time of MODULE in microseconds, and the modules it imported. """
+    # let the first run write .pyc files, as they would be on a normal install,
+    # so that the runs that count aren't compiling the source every time
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    subprocess.run([sys.executable, "-c", f"import {MODULE}"], cwd = directory, env = env,
+                   capture_output = True)
+    totals = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {MODULE}"],
+                                cwd = directory, env = env, capture_output = True, text = True)
+        imported = set()
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _self, cumulative, name = line[len("import time:"):].split("|")
+            imported.add(name.strip())
+            if name.strip() == MODULE:
+                totals.append(int(cumulative))
+    return statistics.median(totals), imported
+
+def checkout(revision, directory):
+    archive = subprocess.run(["git", "archive", revision], capture_output = True, check = True)
+    subprocess.run(["tar", "-x", "-C", directory], input = archive.stdout, check = True)
+
+def main(revision = "HEAD", runs = "20"):
+    runs = int(runs)
+    with tempfile.TemporaryDirectory() as directory:
+        checkout(revision, directory)
+        before, before_modules = import_times(directory, runs)
+    after, after_modules = import_times(os.getcwd(), runs)
+    print(f"import {MODULE}, median of {runs} runs")
+    print(f"{revision:>14}: {before / 1000:7.1f} ms, {len(before_modules)} modules")
+    print(f"{'working tree':>14}: {after / 1000:7.1f} ms, {len(after_modules)} modules")
+    for name in WATCHED:
+        print(f"{name:>20}: {'yes' if name in before_modules else 'no':>4} -> "
+              f"{'yes' if name in after_modules else 'no'}")
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
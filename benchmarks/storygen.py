@@ -0,0 +1,92 @@
+"""
+benchmarks/storygen.py
+
+Makes synthetic TweeTeX stories for benchmarking. Every story has the
+full preamble and starts at passage 0, and every link points at a
+passage that exists, so the stories compile.
+
+MIT License
+"""
+import itertools
+
+WORDS = ["the", "door", "opens", "onto", "a", "long", "corridor", "lit",
+         "by", "flickering", "lamps", "and", "you", "hear", "footsteps"]
+
+def filler(length, seed = 0):
+    """
+    Returns length characters of plain words (no backslashes or braces).
+
+    >>> filler(20)
+    'the door opens onto '
+    >>> filler(20, 3)
+    'onto a long corridor'
+    """
+    words = itertools.islice(itertools.cycle(WORDS), seed % len(WORDS), None)
+    text = []
+    size = 0
+    for word in words:
+        if size >= length:
+            break
+        text.append(word)
+        size += len(word) + 1
+    return " ".join(text)[:length].ljust(length)
+
+def iter_story(passages, links = 1, text_length = None, nesting = 0):
+    """
+    Yields the source of a story a piece at a time (see make_story), so
+    very big stories can be written out without being held in memory.
+    """
+    yield ("\\title{Generated Story}\n"
+           "\\author{storygen}\n"
+           "\\ifid{00000000-0000-0000-0000-000000000000}\n"
+           "\\start{Passage 0}\n")
+    for number in range(passages):
+        if text_length is None:
+            text = f"This is some text in passage {number}."
+        else:
+            text = filler(text_length, number)
+        parts = [f"\n\\passage{{Passage {number}}}\n{text}\n"]
+        for link in range(1, links + 1):
+            target = f"Passage {(number + link) % passages}"
+            label = "Go on"
+            for _level in range(nesting):
+                label = f"\\link{{{label}}}{{{target}}}"
+            parts.append(f"\\link{{{label}}}{{{target}}}\n")
+        yield "".join(parts)
+
+def make_story(passages, links = 1, text_length = None, nesting = 0):
+    """
+    Returns the source of a valid story with the given number of passages.
+    Each passage has the given number of links to the passages after it,
+    and either a short sentence or text_length characters of filler text.
+    With nesting, each link's text is itself a link that many levels deep.
+
+    >>> print(make_story(2))
+    \\title{Generated Story}
+    \\author{storygen}
+    \\ifid{00000000-0000-0000-0000-000000000000}
+    \\start{Passage 0}
+    <BLANKLINE>
+    \\passage{Passage 0}
+    This is some text in passage 0.
+    \\link{Go on}{Passage 1}
+    <BLANKLINE>
+    \\passage{Passage 1}
+    This is some text in passage 1.
+    \\link{Go on}{Passage 0}
+    <BLANKLINE>
+
+    >>> print(make_story(1, links = 2, text_length = 12, nesting = 1).split("\\n\\n")[1])
+    \\passage{Passage 0}
+    the door ope
+    \\link{\\link{Go on}{Passage 0}}{Passage 0}
+    \\link{\\link{Go on}{Passage 0}}{Passage 0}
+    <BLANKLINE>
+    """
+    return "".join(iter_story(passages, links, text_length, nesting))
+
+def write_story(filename, passages, links = 1, text_length = None, nesting = 0):
+    """ writes a story made by iter_story to the file called filename. """
+    with open(filename, "w") as file:
+        for part in iter_story(passages, links, text_length, nesting):
+            file.write(part)
@@ -0,0 +1,44 @@
+"""
+benchmarks/stream_memory.py
+
+Lexes generated stories of growing size straight from an mmap with
+StreamLexer, throwing the tokens away as they come, and reports the peak
+traced memory. It should stay near the chunk size however big the
+story gets.
+
+    python3 -m benchmarks.stream_memory
+
+MIT License
+"""
+import mmap
+import os
+import tempfile
+import time
+import tracemalloc
+
+from lexer import StreamLexer
+from benchmarks.storygen import make_story
+
+SIZES = [10000, 40000, 160000]
+
+def main():
+    print(f"{'passages':>10} {'MB':>8} {'seconds':>9} {'peak KB':>9}")
+    for passages in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "story.twx")
+            with open(path, "w") as file:
+                file.write(make_story(passages))
+            with open(path, "rb") as file, \
+                 mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as source:
+                tracemalloc.start()
+                start = time.perf_counter()
+                for _token in StreamLexer(source).tokenize():
+                    pass
+                seconds = time.perf_counter() - start
+                _size, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                megabytes = len(source) / 1e6
+        print(f"{passages:>10} {megabytes:>8.2f} {seconds:>9.3f} {peak / 1e3:>9.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+benchmarks/suite.py
+
+Runs the lexer, parser, templater and end-to-end benchmarks on generated
+stories at a range of sizes, and optionally saves the results as JSON
+lines so that runs from different commits can be compared.
+
+    python3 -m benchmarks.suite                       # 10 to 100,000 passages
+    python3 -m benchmarks.suite --scales 1000000      # a million (needs a few GB)
+    python3 -m benchmarks.suite --output before.jsonl
+    python3 -m benchmarks.suite --compare before.jsonl
+
+Each result records the benchmark, the story parameters, the best time
+over --repeat runs, and the git commit it was run on. --compare matches
+results on benchmark and story parameters and reports any that got
+slower by more than --threshold, exiting with status 1 if there are any.
+
+MIT License
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import compiler
+import lexer
+import parser
+import templater
+from benchmarks.storygen import make_story
+
+SCALES = [10, 100, 1000, 10000, 100000]
+BENCHMARKS = ["lexer", "parser", "templater", "end-to-end"]
+
+def bench_lexer(source, path):
+    for _token in lexer.Lexer(source).tokenize():
+        pass
+
+def bench_parser(source, path):
+    # lexed up front so only the parse is timed
+    tokens = lexer.TokenStream()
+    tokens.queue.extend(lexer.Lexer(source).tokenize())
+    start = time.perf_counter()
+    parser.parse(tokens)
+    return time.perf_counter() - start
+
+def bench_templater(source, path):
+    mylexer = lexer.Lexer(source)
+    ast = parser.parse(lexer.TokenStream(mylexer.tokenize()))
+    with open(os.devnull, "w") as sink:
+        start = time.perf_counter()
+        templater.writeTokens(ast, sink)
+        return time.perf_counter() - start
+
+def bench_end_to_end(source, path):
+    compiler.compile_file(path, path[:-3] + "tw")
+
+RUNNERS = {"lexer": bench_lexer, "parser": bench_parser,
+           "templater": bench_templater, "end-to-end": bench_end_to_end}
+
+def run(benchmark, source, path, repeat):
+    """
+    Returns the best time of repeat runs. A runner can return the time
+    of the part it means to measure; otherwise the whole call is timed.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        seconds = RUNNERS[benchmark](source, path)
+        if seconds is None:
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output = True, text = True, check = True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+def key(result):
+    return (result["benchmark"], result["passages"], result["links"],
+            result["text_length"], result["nesting"])
+
+def compare(results, filename, threshold):
+    """
+    Prints how each result compares with the matching one in filename.
+    Returns the number that got slower by more than threshold.
+
+    >>> import io
+    >>> old = {"benchmark": "lexer", "passages": 10, "links": 1, "text_length": None,
+    ...        "nesting": 0, "seconds": 1.0}
+    >>> new = dict(old, seconds = 1.5)
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     filename = os.path.join(directory, "old.jsonl")
+    ...     with open(filename, "w") as file:
+    ...         _ = file.write(json.dumps(old) + "\\n")
+    ...     compare([new], filename, 0.1)
+         lexer       10    1.000 s ->    1.500 s   1.50x  REGRESSION
+    1
+    """
+    previous = {}
+    with open(filename) as file:
+        for line in file:
+            if line.strip():
+                result = json.loads(line)
+                previous[key(result)] = result # the latest run wins
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{result['benchmark']:>10} {result['passages']:>8} "
+              f"{old['seconds']:8.3f} s -> {result['seconds']:8.3f} s {ratio:6.2f}x{flag}")
+    return regressions
+
+def getargs(argv):
+    argparser = argparse.ArgumentParser(description = "TweeTeX compiler benchmarks")
+    argparser.add_argument("--scales", default = ",".join(map(str, SCALES)),
+                           help = "comma separated numbers of passages")
+    argparser.add_argument("--benchmarks", default = ",".join(BENCHMARKS),
+                           help = "comma separated: " + ", ".join(BENCHMARKS))
+    argparser.add_argument("--links", type = int, default = 3, help = "links per passage")
+    argparser.add_argument("--text-length", type = int, default = None,
+                           help = "characters of text per passage")
+    argparser.add_argument("--nesting", type = int, default = 0,
+                           help = "levels of links nested in each link's text")
+    argparser.add_argument("--repeat", type = int, default = 3, help = "runs per result (best is kept)")
+    argparser.add_argument("--output", help = "append results to this JSON lines file")
+    argparser.add_argument("--compare", help = "compare with results in this JSON lines file")
+    argparser.add_argument("--threshold", type = float, default = 0.10,
+                           help = "slowdown that counts as a regression (default 0.10)")
+    return argparser.parse_args(argv)
+
+def main(argv = None):
+    args = getargs(argv)
+    revision = commit()
+    results = []
+    print(f"{'benchmark':>10} {'passages':>8} {'MB':>8} {'seconds':>9} {'us/passage':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "story.twx")
+        for passages in map(int, args.scales.split(",")):
+            source = make_story(passages, args.links, args.text_length, args.nesting)
+            with open(path, "w") as file:
+                file.write(source)
+            for benchmark in args.benchmarks.split(","):
+                seconds = run(benchmark, source, path, args.repeat)
+                result = {"benchmark": benchmark, "passages": passages, "links": args.links,
+                          "text_length": args.text_length, "nesting": args.nesting,
+                          "bytes": len(source.encode()), "seconds": seconds,
+                          "commit": revision, "python": platform.python_version(),
+                          "date": datetime.datetime.now().isoformat(timespec = "seconds")}
+                results.append(result)
+                print(f"{benchmark:>10} {passages:>8} {result['bytes'] / 1e6:>8.2f} "
+                      f"{seconds:>9.3f} {seconds / passages * 1e6:>11.2f}")
+    if args.output:
+        with open(args.output, "a") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+    if args.compare:
+        print(f"\ncompared with {args.compare}:")
+        if compare(results, args.compare, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+benchmarks/templater_scaling.py
+
+Times templater.makeNewFile() on generated stories of doubling size. The
+time per megabyte of Twee output should stay flat if generation is
+linear in the size of the output.
+
+    python3 -m benchmarks.templater_scaling
+
+MIT License
+"""
+import contextlib
+import os
+import tempfile
+import time
+
+import parser
+import templater
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+SIZES = [5000, 10000, 20000, 40000, 80000]
+
+def main():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory, \
+         open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        outname = os.path.join(directory, "story.tw")
+        for passages in SIZES:
+            mylexer = Lexer(make_story(passages, 3))
+            mylexer.lex()
+            ast = parser.parse(mylexer.tokens)
+            start = time.perf_counter()
+            templater.makeNewFile(outname, ast)
+            seconds = time.perf_counter() - start
+            rows.append((passages, os.path.getsize(outname) / 1e6, seconds))
+    print(f"{'passages':>10} {'output MB':>10} {'seconds':>9} {'s/MB':>7}")
+    for passages, megabytes, seconds in rows:
+        print(f"{passages:>10} {megabytes:>10.2f} {seconds:>9.3f} {seconds / megabytes:>7.3f}")
+
+if __name__ == "__main__":
+    main()
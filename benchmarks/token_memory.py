@@ -0,0 +1,52 @@
+"""
+benchmarks/token_memory.py
+
+Measures the memory held by the tokens of a generated 100,000 passage
+story, next to the same tokens in the old layout (a plain object with a
+__dict__, an empty children list, and its own copies of value and match).
+
+    python3 -m benchmarks.token_memory
+
+MIT License
+"""
+import gc
+import tracemalloc
+
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+PASSAGES = 100000
+
+class DictToken:
+    # the layout lexer.Token had before it got __slots__ and source spans
+    def __init__(self, value, token_type, match):
+        self.value = value
+        self.token_type = token_type
+        self.children = []
+        self.match = match
+
+def traced(build):
+    """ returns what build() returned and the bytes it left allocated. """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+def main():
+    source = make_story(PASSAGES)
+    mylexer = Lexer(source)
+    _, slotted = traced(mylexer.lex)
+    tokens = list(mylexer.tokens.queue)
+    # copy the strings out so the old layout really owns two copies
+    _, old = traced(lambda: [DictToken("".join(t.value), t.token_type, "".join(t.match))
+                             for t in tokens])
+    megabytes = len(source) / 1e6
+    print(f"story: {PASSAGES} passages, {megabytes:.1f} MB, {len(tokens)} tokens")
+    print(f"old tokens:     {old / 1e6:8.1f} MB  ({old / len(tokens):5.0f} bytes/token)")
+    print(f"slotted tokens: {slotted / 1e6:8.1f} MB  ({slotted / len(tokens):5.0f} bytes/token)")
+    print(f"reduction:      {old / slotted:8.1f}x")
+
+if __name__ == "__main__":
+    main()
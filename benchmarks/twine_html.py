@@ -0,0 +1,53 @@
+"""
+benchmarks/twine_html.py
+
+Times writing a generated story to disk as Twee 3 code (templater) and as
+a Twine 2 HTML story archive (twine2), from the same AST, and compares
+the sizes of the two files.
+
+    python3 -m benchmarks.twine_html [passages]
+
+MIT License
+"""
+import os
+import sys
+import tempfile
+import time
+
+import log
+import parser
+import templater
+import twine2
+from lexer import Lexer
+from benchmarks.storygen import make_story
+
+PASSAGES = 100000
+
+def time_write(writer, ast, path, repeat = 3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        writer.makeNewFile(path, ast)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+def main(passages = PASSAGES):
+    mylexer = Lexer(make_story(passages, links = 3))
+    mylexer.lex()
+    with log.capture():
+        ast = parser.parse(mylexer.tokens)
+    print(f"story: {passages} passages")
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        for name, writer, extension in [("Twee 3", templater, "tw"), ("Twine 2 HTML", twine2, "html")]:
+            path = os.path.join(directory, "story." + extension)
+            with log.capture():
+                seconds = time_write(writer, ast, path)
+            results.append(seconds)
+            size = os.path.getsize(path) / 1e6
+            print(f"{name:>13}: {seconds:7.3f} s  {size:6.1f} MB  {size / seconds:6.1f} MB/s")
+    print(f"HTML takes {results[1] / results[0]:.2f}x as long as Twee")
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,37 @@
+"""
+benchmarks/verbosity.py
+
+Times compiler.compile_file() on a generated story at each logging
+level, with the log going to /dev/null, to show what per-token output
+costs and that the default level doesn't pay for it.
+
+    python3 -m benchmarks.verbosity [passages]
+
+MIT License
+"""
+import os
+import sys
+import tempfile
+import time
+
+import compiler
+import log
+from benchmarks.storygen import make_story
+
+LEVELS = [("-q", log.QUIET), ("default", log.DEFAULT), ("-v", log.DEBUG), ("-vv", log.TRACE)]
+
+def main(passages = 20000):
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        path = os.path.join(directory, "story.twx")
+        outname = os.path.join(directory, "story.tw")
+        with open(path, "w") as file:
+            file.write(make_story(passages, 3))
+        print(f"story: {passages} passages, {os.path.getsize(path) / 1e6:.2f} MB")
+        for flag, level in LEVELS:
+            log.configure(level, devnull)
+            start = time.perf_counter()
+            compiler.compile_file(path, outname)
+            print(f"{flag:>8} {time.perf_counter() - start:8.3f} s")
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,112 @@
+"""
+commands.py
+
+The registry of TweeTeX commands. Every command is registered once here
+with its name, its kind, the names of its arguments and the template it
+turns into, and the rest of the compiler is built from the registry:
+
+- the lexer matches any backslash and name with one pattern, and looks
+  the name up in KINDS to find its token type,
+- the parser looks commands up by name to find the preamble commands a
+  story needs and how many arguments a macro takes,
+- the templater turns every macro's template into a function that
+  writes the macro out,
+- and the symbol table checks the argument of any macro that names a
+  passage (see Command.target).
+
+So adding a macro is one call to register(), and doesn't make the lexer's
+pattern any longer or add a branch anywhere.
+
+MIT License
+"""
+
+# the kinds of command, and the token types the lexer gives them
+KIND_TOKEN_TYPES = {
+    "preamble": "PREAMBLECOMMAND",
+    "passage": "PASSAGECOMMAND",
+    "include": "INCLUDECOMMAND",
+    "macro": "MACROCOMMAND",
+}
+
+COMMANDS = {}  # name -> Command
+KINDS = {}     # name -> token type, for the lexer
+
+class Command:
+    """
+    A command. arguments names the arguments it takes, which are also the
+    fields of its template, a str.format string that the templater fills
+    in with the text of each argument (macros only). target is the name of
+    the argument that names a passage, if one does.
+
+    >>> goto = COMMANDS["goto"]
+    >>> goto.arity, goto.target, goto.target_index
+    (1, 'passage', 0)
+    >>> COMMANDS["link"].target_index
+    1
+    """
+    __slots__ = ("name", "kind", "arguments", "template", "target", "target_index", "required")
+
+    def __init__(self, name, kind, arguments = (), template = None, target = None,
+                 required = False):
+        self.name = name
+        self.kind = kind
+        self.arguments = tuple(arguments)
+        self.template = template
+        self.target = target
+        # which argument names a passage, or None
+        self.target_index = None if target is None else self.arguments.index(target)
+        self.required = required
+
+    @property
+    def arity(self):
+        return len(self.arguments)
+
+    def __repr__(self):
+        return f"Command({self.name!r}, {self.kind!r})"
+
+def register(name, kind, arguments = (), template = None, target = None, required = False):
+    """
+    Adds a command to the registry, replacing any command of the same name.
+    kind is one of KIND_TOKEN_TYPES. A required command (the preamble ones)
+    must appear in every story. Returns the Command.
+
+    >>> register("say", "macro", ["words"], "<<print {words}>>")
+    Command('say', 'macro')
+    >>> KINDS["say"]
+    'MACROCOMMAND'
+    >>> unregister("say")
+    """
+    if kind not in KIND_TOKEN_TYPES:
+        raise ValueError(f"unknown kind of command: {kind!r}")
+    command = COMMANDS[name] = Command(name, kind, arguments, template, target, required)
+    KINDS[name] = KIND_TOKEN_TYPES[kind]
+    return command
+
+def unregister(name):
+    del COMMANDS[name]
+    del KINDS[name]
+
+def of_kind(kind):
+    """ the names of the commands of a kind, in the order they were registered. """
+    return [name for name, command in COMMANDS.items() if command.kind == kind]
+
+def required(kind):
+    """ the names of the commands of a kind that every story must have. """
+    return [name for name, command in COMMANDS.items()
+            if command.kind == kind and command.required]
+
+register("title", "preamble", ["value"], required = True)
+register("author", "preamble", ["value"], required = True)
+register("ifid", "preamble", ["value"], required = True)
+register("start", "preamble", ["value"], target = "value", required = True)
+register("passage", "passage", ["title"])
+register("include", "include", ["filename"])
+register("link", "macro", ["text", "link"], "[[{text}|{link}]]", target = "link")
+register("goto", "macro", ["passage"], '<<goto "{passage}">>', target = "passage")
+register("set", "macro", ["variable", "value"], "<<set {variable} to {value}>>")
+register("if", "macro", ["condition", "body"], "<<if {condition}>>{body}<</if>>")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,322 @@
+"""
+compiler.py
+
+Runs a TweeTeX story through the lexer, parser and templater.
+
+compile_file is the pipelined path used by tweetex.py: the parser pulls
+tokens from a StreamLexer as it needs them, so lexing and parsing happen
+together and the full list of tokens is never held in memory.
+compile_source is the older two-phase path, which lexes the whole text
+into a token queue before parsing starts, and compile_string does the
+same but returns the Twee code rather than writing it to a file.
+
+All of them read in the files named by \\include (see includes.py), and
+check that every \\link and the \\start passage name a passage that
+exists (see symbols.py), logging a warning for each one that doesn't.
+compile_file can also keep the AST in a cache file (see astcache.py) and
+load it from there, rather than lexing and parsing, while the story and
+the compiler stay the same.
+Each of them writes Twee 3 code unless given backend = "html", which
+writes a Twine 2 HTML story archive instead (see twine2.py), and with
+prune = True leaves out the passages that can't be reached from the
+\\start passage (see reachability.py).
+Each of them takes an optional stats.Stats object, which is filled in
+with timings and counts for the compile (one is made automatically if
+any stats hooks are registered).
+
+MIT License
+"""
+import io
+
+import lexer
+import log
+import nodes
+import parser
+import stats
+import symbols
+import templater
+
+logger = log.getLogger("compiler")
+
+# bump this whenever a change to the compiler changes its output, so that
+# anything cached by an older version is thrown away.
+VERSION = "0.3"
+
+# the kinds of output, and the extension of the files they're written to
+BACKENDS = {"twee": "tw", "html": "html"}
+
+def _traced(tokens):
+    """ passes tokens through, logging each one. """
+    for token in tokens:
+        logger.log(log.TRACE, "%s", token)
+        yield token
+
+def _collecting(metrics):
+    """ the Stats object to fill in, if anyone wants one. """
+    if metrics is None and stats.HOOKS:
+        return stats.Stats()
+    return metrics
+
+def _check(ast, table, metrics, source = None, filename = None):
+    """
+    Checks the links in ast against the passages in table and reports
+    any problems, by line if the source can be had.
+    """
+    if metrics is None:
+        valid = table.check(ast)
+    else:
+        with metrics.phase("check"):
+            valid = table.check(ast)
+    if valid:
+        return
+    if source is None and filename is not None:
+        try:
+            with open(filename, encoding = "utf-8") as file:
+                source = file.read()
+        except (OSError, ValueError):
+            pass
+    table.report(source)
+
+def _includes_files(ast):
+    return any(type(child) is nodes.Include for child in ast.parts)
+
+def _resolve(ast, table, filename, include_root = None):
+    """
+    Reads the files that ast includes, if any, relative to filename, or to
+    include_root for a string, which they then have to be inside. Returns
+    ast, or False if one of them couldn't be read or parsed.
+    """
+    if not _includes_files(ast):
+        return ast
+    import includes # only needed for stories in more than one file
+    if not includes.Includes(include_root).resolve(ast, filename, table):
+        return False
+    return ast
+
+def _backend(backend):
+    """ the module that writes the output for backend, one of BACKENDS. """
+    if backend == "html":
+        import twine2 # only needed for HTML
+        return twine2
+    if backend != "twee":
+        raise ValueError(f"unknown backend: {backend!r}")
+    return templater
+
+def _prune(ast, metrics, table = None):
+    """
+    Returns ast without the passages that can't be reached from its start
+    passage, after logging how many there are and the cycles in the links
+    between passages. ast is returned as it is if it has no start passage.
+    table is the SymbolTable that checked ast, if there is one, whose
+    record of the links saves finding them again.
+    """
+    import reachability # only needed for --prune-unreachable
+    graph = reachability.Reachability(ast, None if table is None else table.edges)
+    if graph.start not in graph.edges:
+        logger.warning("not pruning unreachable passages, since the start passage doesn't exist")
+        return ast
+    cycles = graph.cycles()
+    for line in graph.report(cycles).splitlines():
+        logger.info("%s", line)
+    if logger.isEnabledFor(log.DEBUG):
+        for title in graph.unreachable:
+            logger.debug("unreachable: %r", title)
+        for cycle in cycles:
+            logger.debug("cycle: %s", ", ".join(map(repr, cycle)))
+    if metrics is not None:
+        metrics.reachable = len(graph.reachable)
+        metrics.unreachable = len(graph.edges) - len(graph.reachable)
+        metrics.cycles = len(cycles)
+    return reachability.prune(ast, graph.reachable)
+
+def _generate(outname, ast, metrics, backend = "twee", prune = False, table = None):
+    """
+    writes the output for ast to outname, or returns it if outname is None,
+    leaving out unreachable passages if prune is true (see _prune).
+    """
+    if metrics is not None:
+        metrics.count_ast(ast)
+        if prune:
+            with metrics.phase("prune"):
+                ast = _prune(ast, metrics, table)
+        with metrics.phase("generate"):
+            return _generate(outname, ast, None, backend)
+    if prune:
+        ast = _prune(ast, None, table)
+    writer = _backend(backend)
+    if outname is None:
+        return writer.visitTokens(ast)
+    writer.makeNewFile(outname, ast)
+
+def compile_stream(file, outname, chunk_size = lexer.StreamLexer.CHUNK_SIZE, metrics = None,
+                   backend = "twee", prune = False, started = False):
+    """
+    Compiles the story read from file (a file object or mmap) and writes
+    the output to outname. Returns the AST, or False if parsing failed.
+    started is true if metrics.start() has been called for this compile
+    already, so the time spent before this is counted in the total.
+
+    >>> import io
+    >>> compile_stream(io.StringIO("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                            "\\\\passage{one} Hi \\\\bogus{x}"), None)
+    Lexing error: unknown command at '\\\\bogus{x}'
+    False
+    """
+    metrics = _collecting(metrics)
+    if metrics is not None and not started:
+        metrics.start(getattr(file, "name", None))
+    mylexer = lexer.StreamLexer(file, chunk_size)
+    tokens = mylexer.tokenize()
+    if logger.isEnabledFor(log.TRACE):
+        tokens = _traced(tokens)
+    table = symbols.SymbolTable()
+    if metrics is None:
+        ast = parser.parse(lexer.TokenStream(tokens), table)
+    else:
+        with metrics.phase("parse"):
+            ast = parser.parse(lexer.TokenStream(metrics.count_tokens(tokens)), table)
+        # the parser was waiting on the lexer for some of that
+        metrics.seconds["parse"] -= metrics.seconds["lex"]
+    if ast != False and not mylexer.complete:
+        # the parser only saw the story up to where the lexer gave up
+        log.report(f"Lexing error: unknown command at {mylexer.rest()!r}")
+        ast = False
+    if ast != False:
+        ast = _resolve(ast, table, getattr(file, "name", None))
+    if ast != False:
+        _check(ast, table, metrics, filename = getattr(file, "name", None))
+        _generate(outname, ast, metrics, backend, prune, table)
+    if metrics is not None:
+        metrics.finish()
+    return ast
+
+def compile_file(filename, outname, metrics = None, cache = None, backend = "twee", prune = False):
+    """
+    Compiles the story in the file called filename and writes the
+    output to outname. Returns the AST, or False if parsing failed. If
+    cache is the name of an AST cache file, the AST is loaded from it if
+    it's up to date, and written to it if not.
+    """
+    if cache is None:
+        with open(filename, "rb") as file:
+            return compile_stream(file, outname, metrics = metrics, backend = backend,
+                                  prune = prune)
+    import astcache # only needed here
+    with open(filename, "rb") as file:
+        source = file.read()
+    cachekey = astcache.key(source)
+    metrics = _collecting(metrics)
+    if metrics is None:
+        ast = astcache.load(cache, cachekey)
+    else:
+        metrics.start(filename)
+        with metrics.phase("load"):
+            ast = astcache.load(cache, cachekey)
+    if ast is None:
+        file = io.BytesIO(source)
+        file.name = filename
+        ast = compile_stream(file, outname, metrics = metrics, backend = backend, prune = prune,
+                             started = True)
+        # the cache is only keyed by this file, so it can't hold what's included
+        if ast != False and not _includes_files(ast):
+            astcache.save(cache, ast, cachekey)
+        return ast
+    logger.info("loaded the AST from %s", cache)
+    table = symbols.SymbolTable()
+    for _passage in ast.parts:
+        table.add(_passage)
+    _check(ast, table, metrics, filename = filename)
+    _generate(outname, ast, metrics, backend, prune, table)
+    if metrics is not None:
+        metrics.finish()
+    return ast
+
+def compile_source(source, outname, metrics = None, backend = "twee", prune = False):
+    """
+    Compiles the story in the string source in two phases, lexing all
+    of it before parsing, and writes the output to outname. Returns
+    the AST, or False if parsing failed.
+    """
+    metrics = _collecting(metrics)
+    ast, table = _parse_source(source, metrics)
+    if ast != False:
+        _generate(outname, ast, metrics, backend, prune, table)
+    if metrics is not None:
+        metrics.finish()
+    return ast
+
+def compile_string(source, metrics = None, backend = "twee", prune = False, include_root = None):
+    """
+    Compiles the story in the string source and returns its Twee code
+    (or its Twine 2 archive, for backend = "html"), or False if parsing
+    failed. If include_root is given, files the story includes are taken
+    relative to it, and have to be inside it.
+
+    >>> print(compile_string("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                      "\\\\passage{one} Hi."))
+    :: StoryData 
+    { 
+        "author": "A",
+        "ifid": "I",
+        "start": "one",
+        "format": "SugarCube"
+    }
+    :: StoryTitle 
+    T
+    <BLANKLINE>
+    :: one
+    Hi.
+    >>> compile_string("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                "\\\\passage{one} Hi \\\\bogus{x}")
+    Lexing error: unknown command at '\\\\bogus{x}'
+    False
+    >>> print(compile_string("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                      "\\\\passage{one} Hi.", backend = "html"))  # doctest: +ELLIPSIS
+    <tw-storydata name="T" startnode="1" ...>
+    ...
+    <tw-passagedata pid="1" name="one" ...>Hi.</tw-passagedata>
+    </tw-storydata>
+    <BLANKLINE>
+    >>> compile_string("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                "\\\\passage{one} Hi. \\\\passage{two} Lost.", prune = True).splitlines()[-2:]
+    [':: one', 'Hi. ']
+    """
+    metrics = _collecting(metrics)
+    ast, table = _parse_source(source, metrics, include_root)
+    if ast != False:
+        ast = _generate(None, ast, metrics, backend, prune, table)
+    if metrics is not None:
+        metrics.finish()
+    return ast
+
+def _parse_source(source, metrics, include_root = None):
+    """
+    lexes all of source, then parses and checks it. Returns the AST, or False,
+    and the symbols.SymbolTable it was checked with.
+    """
+    if metrics is not None:
+        metrics.start()
+        with metrics.phase("lex"):
+            mylexer = lexer.Lexer(source)
+            complete = mylexer.lex()
+        metrics.tokens = len(mylexer.tokens)
+    else:
+        mylexer = lexer.Lexer(source)
+        complete = mylexer.lex()
+    if complete == False:
+        log.report(f"Lexing error: unknown command at {mylexer.rest()!r}")
+        return False, None
+    if logger.isEnabledFor(log.TRACE):
+        for token in mylexer.tokens.queue:
+            logger.log(log.TRACE, "%s", token)
+    table = symbols.SymbolTable()
+    if metrics is None:
+        ast = parser.parse(mylexer.tokens, table)
+    else:
+        with metrics.phase("parse"):
+            ast = parser.parse(mylexer.tokens, table)
+    if ast != False:
+        ast = _resolve(ast, table, None, include_root)
+    if ast != False:
+        _check(ast, table, metrics, source = source)
+    return ast, table
@@ -0,0 +1,218 @@
+"""
+includes.py
+
+Stories split over several files. \\include{file}, between passages or
+right after the preamble, puts the passages of another .twx file at
+that point in the story. An included file holds nothing but passages
+and more includes (see parser.parts), and its name is taken relative to
+the file that includes it. An Includes object can be confined to a
+directory, as the compile server's are, and then refuses to read any
+file outside it, once symbolic links are followed.
+
+Each file is read, lexed and parsed at most once per compile, however
+many places include it, and its passages appear once, where it's first
+included; including it again adds nothing. An Includes object keeps
+every file it has parsed along with a hash of its contents, so when the
+story is compiled again (as --watch does) only the files that changed
+are lexed and parsed again; the rest of the tree is put back together
+from the parsed files it already has.
+
+MIT License
+"""
+import hashlib
+import os
+
+import lexer
+import log
+import nodes
+import parser
+import symbols
+import templater
+
+logger = log.getLogger("includes")
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size = 16).digest()
+
+class IncludedFile:
+    """ one parsed file: its hash, source text and list of passages and includes. """
+
+    def __init__(self, key, source, parts):
+        self.key = key
+        self.source = source
+        self.parts = parts
+
+class Includes:
+    """
+    The files a story includes, and the dependency graph between them.
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> def save(name, text):
+    ...     with open(os.path.join(directory.name, name), "w") as file:
+    ...         _ = file.write(text)
+    >>> save("story.twx", "\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...      "\\\\passage{one} \\\\link{Go}{two} \\\\include{one.twx} \\\\include{two.twx}")
+    >>> save("one.twx", "\\\\passage{two} \\\\link{On}{three} \\\\include{two.twx}")
+    >>> save("two.twx", "\\\\passage{three} The end.")
+    >>> main = os.path.join(directory.name, "story.twx")
+    >>> includes = Includes()
+    >>> twee = includes.compile_file(main, main[:-3] + "tw")
+    >>> twee.split("\\n")[-7:]
+    ['', ':: one', '[[Go|two]]', ':: two', '[[On|three]]', ':: three', 'The end.']
+    >>> includes.parsed, includes.reused
+    (3, 0)
+    >>> sorted(os.path.basename(path) for path in includes.dependencies())
+    ['one.twx', 'two.twx']
+
+    Only the file that changed is parsed again.
+    >>> save("two.twx", "\\\\passage{three} The real end.")
+    >>> includes.compile_file(main, main[:-3] + "tw").split("\\n")[-1]
+    'The real end.'
+    >>> includes.parsed, includes.reused
+    (1, 2)
+
+    Confined to a directory, it won't read a file outside it.
+    >>> confined = Includes(confine = directory.name)
+    >>> save("two.twx", "\\\\passage{three} \\\\include{../secret.twx}")
+    >>> confined.compile_file(main, None)
+    Include error: '../secret.twx' is outside the directory files can be included from
+    False
+    >>> save("two.twx", "\\\\passage{three} \\\\include{/etc/passwd}")
+    >>> confined.compile_file(main, None)
+    Include error: '/etc/passwd' is outside the directory files can be included from
+    False
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, confine = None):
+        # the directory included files have to be in, or None for anywhere
+        self.confine = os.path.realpath(confine) if confine is not None else None
+        self.files = {}   # absolute path -> IncludedFile
+        self.root = None  # absolute path of the main file of the last story resolved
+        self.graph = {}   # absolute path -> the paths it includes, from the last resolve
+        self.parsed = 0   # files lexed and parsed by the last compile or resolve
+        self.reused = 0   # files that hadn't changed since they were last parsed
+
+    def dependencies(self):
+        """ every file included, directly or not, by the last story resolved. """
+        return [path for path in self.graph if path in self.files and path != self.root]
+
+    def read(self, path, main = False):
+        """
+        The IncludedFile for path, lexing and parsing it only if it's changed,
+        or False if it can't be read or parsed. The main file of a story is
+        parsed as a whole story, preamble and all.
+        """
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except OSError as error:
+            log.report(f"Include error: can't read {os.path.relpath(path)}: {error.strerror}")
+            return False
+        key = digest(data)
+        entry = self.files.get(path)
+        if entry is not None and entry.key == key:
+            self.reused += 1
+            return entry
+        source = data.decode("utf-8")
+        mylexer = lexer.Lexer(source)
+        if mylexer.lex() == False:
+            log.report(f"Lexing error in {os.path.relpath(path)}: unknown command at "
+                       f"{mylexer.rest()!r}")
+            return False
+        if main:
+            parts = parser.parse(mylexer.tokens)
+        else:
+            parts = parser.parts(mylexer.tokens)
+        if parts == False:
+            log.report(f"Parsing Error: in {os.path.relpath(path)}")
+            return False
+        entry = self.files[path] = IncludedFile(key, source, parts)
+        self.parsed += 1
+        return entry
+
+    def allowed(self, path):
+        """ True if the file at path can be included, as it's inside confine. """
+        if self.confine is None:
+            return True
+        return os.path.commonpath([self.confine, os.path.realpath(path)]) == self.confine
+
+    def resolve(self, story, filename = None, table = None):
+        """
+        Fills in every INCLUDE in story, the AST of the file called filename
+        (or of a string, whose includes are relative to the confining
+        directory, or else the current one), with the passages of the file
+        it names, adding them to table (a symbols.SymbolTable) if given. Returns True, or False if
+        an included file couldn't be read or parsed.
+        """
+        self.root = os.path.abspath(filename) if filename else None
+        base = os.path.dirname(self.root) if self.root else (self.confine or os.getcwd())
+        self.graph = {}
+        seen = {self.root}
+        resolved = self._expand(story.parts, self.root, base, seen, [self.root], table)
+        for path in list(self.files): # forget files that aren't part of the story any more
+            if path not in seen:
+                del self.files[path]
+        return resolved
+
+    def _expand(self, parts, path, base, seen, chain, table):
+        includes = self.graph.setdefault(path, [])
+        for node in parts:
+            if type(node) is not nodes.Include:
+                continue
+            del node.parts[:] # from the last time this tree was resolved
+            target = os.path.normpath(os.path.join(base, node.argument.text))
+            if not self.allowed(target):
+                log.report(f"Include error: {node.argument.text!r} is outside the directory "
+                           f"files can be included from")
+                return False
+            includes.append(target)
+            if target in chain:
+                logger.warning("include cycle: %s", " -> ".join(
+                    os.path.relpath(step) for step in chain[1:] + [target]))
+                continue
+            if target in seen:
+                continue
+            seen.add(target)
+            entry = self.read(target)
+            if entry == False:
+                return False
+            node.parts.extend(entry.parts)
+            if table is not None:
+                origin = (os.path.relpath(target), entry.source)
+                for part in entry.parts:
+                    if type(part) is nodes.Passage:
+                        table.add(part, origin)
+            if not self._expand(entry.parts, target, os.path.dirname(target),
+                                seen, chain + [target], table):
+                return False
+        return True
+
+    def compile_file(self, filename, outname):
+        """
+        Compiles the story in the file called filename, with everything it
+        includes, and writes its Twee code to outname (unless it's None).
+        Returns the Twee code, or False if it didn't compile.
+        """
+        self.parsed = self.reused = 0
+        path = os.path.abspath(filename)
+        entry = self.read(path, main = True)
+        if entry == False:
+            return False
+        story = entry.parts
+        table = symbols.SymbolTable()
+        for child in story.parts:
+            if type(child) is nodes.Passage:
+                table.add(child)
+        if not self.resolve(story, filename, table):
+            return False
+        if not table.check(story):
+            table.report(entry.source)
+        result = templater.visitTokens(story)
+        logger.info("parsed %d files, reused %d", self.parsed, self.reused)
+        if outname is not None:
+            with open(outname, "w", encoding = "utf-8") as file:
+                file.write(result)
+            logger.info("successfully wrote story to file")
+        return result
@@ -0,0 +1,242 @@
+"""
+incremental.py
+
+Incremental compilation. A story is split into its preamble and one
+chunk of source per \\passage, and each passage chunk is hashed. Passages
+whose source hasn't changed since the last compile reuse their parsed
+PASSAGE node and Twee output, from memory if the same IncrementalCompiler
+compiled them before, or from the cache file otherwise (Twee output
+and summary only). The preamble is always recompiled, since it's small, and nothing
+a passage compiles to depends on the preamble or on other passages, so
+changing \\start or \\title never leaves a stale passage behind.
+
+The links in every passage, reused or not, are still checked against
+the titles of all of them, from the symbols.summary() kept with each
+passage, so a reused passage needn't be parsed again to be checked.
+
+The cache file is JSON, tagged with compiler.VERSION so that a new
+version of the compiler starts again from scratch, and only holds the
+passages from the most recent compile.
+
+MIT License
+"""
+import hashlib
+import itertools
+import json
+import os
+import re
+
+import compiler
+import lexer
+import log
+import nodes
+import parser
+import symbols
+import templater
+
+logger = log.getLogger("incremental")
+
+PASSAGE = re.compile(r"\\passage(?![A-Za-z])") # not the start of a longer command
+
+def split(source):
+    """
+    Splits source into the preamble and a list of passages, each one
+    running from its \\passage command up to the next one. Since no token
+    but a command can contain a backslash, every \\passage in the source
+    is the start of a passage.
+
+    >>> split("\\\\title{T} \\\\passage{a} one \\\\passage{b} two")
+    ('\\\\title{T} ', ['\\\\passage{a} one ', '\\\\passage{b} two'])
+    """
+    starts = [found.start() for found in PASSAGE.finditer(source)]
+    if not starts:
+        return source, []
+    ends = starts[1:] + [len(source)]
+    return source[:starts[0]], [source[start:end] for start, end in zip(starts, ends)]
+
+def digest(text):
+    return hashlib.blake2b(text.encode(), digest_size = 16).hexdigest()
+
+def _tokens(source):
+    """ lexes all of source, or returns False if it has a bad token in it. """
+    mylexer = lexer.Lexer(source)
+    if mylexer.lex() == False:
+        log.report(f"Lexing error: unknown command at {mylexer.rest()!r}")
+        return False
+    return mylexer.tokens
+
+def preamble(source):
+    """ parses the preamble, which the parser expects to end at a \\passage. """
+    tokens = _tokens(source)
+    if tokens == False:
+        return False
+    tokens.enqueue(lexer.Token("passage", "PASSAGECOMMAND", "\\passage"))
+    _preamble, _tokenQueue = parser.preamble(tokens)
+    if _preamble != False and parser.peek_token(_tokenQueue).token_type == "INCLUDECOMMAND":
+        # the preamble stopped at an \include
+        log.report("Parsing Error: \\include can't be used here; compile the story normally.")
+        return False
+    return _preamble
+
+def passage(source):
+    """ parses the source of one passage, as split() returns it. """
+    tokens = _tokens(source)
+    if tokens == False:
+        return False
+    _passage, _tokenQueue = parser.passage(tokens)
+    if _passage != False and parser.peek_token(_tokenQueue).token_type == "INCLUDECOMMAND":
+        # the passage stopped at an \include
+        log.report("Parsing Error: \\include can't be used here; compile the story normally.")
+        return False
+    return _passage
+
+def starts(preamble_source, passage_sources):
+    """
+    The offset in the story of each of the passage sources split() made.
+
+    >>> starts(*split("\\\\title{T} \\\\passage{a} one \\\\passage{b} two"))
+    [10, 26]
+    """
+    return list(itertools.accumulate([len(preamble_source)]
+                                     + [len(text) for text in passage_sources[:-1]]))
+
+def check(source, _preamble, summaries, bases):
+    """
+    Checks the links and \\start passage of a story that was parsed a
+    passage at a time, from the symbols.summary() of each passage and the
+    offset its source starts at, and logs any problems by line in source.
+    """
+    table = symbols.SymbolTable()
+    if not table.check_summaries(zip(summaries, bases), _preamble):
+        table.report(source)
+
+class IncrementalCompiler:
+    """
+    Compiles stories, remembering each passage it compiles so that the
+    next compile can skip the ones that haven't changed.
+
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...          "\\\\passage{one} Hi. \\\\link{Go}{two} \\\\passage{two} Bye.")
+    >>> mycompiler = IncrementalCompiler()
+    >>> print(mycompiler.compile(story))
+    :: StoryData 
+    { 
+        "author": "A",
+        "ifid": "I",
+        "start": "one",
+        "format": "SugarCube"
+    }
+    :: StoryTitle 
+    T
+    <BLANKLINE>
+    :: one
+    Hi. [[Go|two]]
+    :: two
+    Bye.
+    >>> mycompiler.compiled, mycompiler.reused
+    (2, 0)
+    >>> output = mycompiler.compile(story.replace("Bye.", "See you."))
+    >>> mycompiler.compiled, mycompiler.reused
+    (1, 1)
+    >>> output == mycompiler.compile(story.replace("Bye.", "See you."))
+    True
+    >>> mycompiler.compiled, mycompiler.reused
+    (0, 2)
+
+    Links are checked against every passage, compiled or reused.
+    >>> import logging, sys
+    >>> handler = logging.StreamHandler(sys.stdout)
+    >>> logging.getLogger("tweetex").addHandler(handler)
+    >>> _ = mycompiler.compile(story.replace("Bye.", "\\\\link{Lost}{three}"))
+    line 1, column 90: link to missing passage 'three'
+    >>> mycompiler.compiled, mycompiler.reused
+    (1, 1)
+    >>> logging.getLogger("tweetex").removeHandler(handler)
+    """
+
+    def __init__(self, cachefile = None):
+        self.cachefile = cachefile
+        self.entries = {} # digest -> [Twee output, PASSAGE node or None, symbols.summary()]
+        self.story = None # the AST of the last compile, if every passage was parsed here
+        self.compiled = 0 # passages compiled by the last compile
+        self.reused = 0   # passages reused by the last compile
+        if cachefile:
+            self.load()
+
+    def load(self):
+        """ reads the cache file, ignoring it if it's missing, broken or stale. """
+        try:
+            with open(self.cachefile, encoding = "utf-8") as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return
+        if not isinstance(cache, dict) or cache.get("version") != compiler.VERSION:
+            return
+        for key, entry in cache.get("passages", {}).items():
+            if isinstance(entry, list) and len(entry) == 2: # [Twee output, summary]
+                self.entries.setdefault(key, [entry[0], None, entry[1]])
+
+    def save(self):
+        cache = {"version": compiler.VERSION,
+                 "passages": {key: [entry[0], entry[2]] for key, entry in self.entries.items()}}
+        partial = self.cachefile + ".tmp"
+        with open(partial, "w", encoding = "utf-8") as file:
+            json.dump(cache, file)
+        os.replace(partial, self.cachefile)
+
+    def compile(self, source):
+        """
+        Compiles the story in source and returns its Twee code, or False if
+        it doesn't parse.
+        """
+        preamble_source, passage_sources = split(source)
+        if not passage_sources:
+            log.report("Parsing Error: story has no passages.")
+            return False
+        _preamble = preamble(preamble_source)
+        if _preamble == False:
+            log.report("Parsing Error: Preamble not formatted correctly.")
+            return False
+        output = [templater.visitTokens(_preamble)]
+        entries = {}
+        parts = [_preamble]
+        self.compiled = self.reused = 0
+        for passage_source in passage_sources:
+            key = digest(passage_source)
+            entry = entries.get(key) or self.entries.get(key)
+            if entry is None:
+                _passage = passage(passage_source)
+                if _passage == False:
+                    log.report("Parsing Error: passage not formatted correctly.")
+                    return False
+                entry = [templater.visitTokens(_passage), _passage, symbols.summary(_passage)]
+                self.compiled += 1
+            else:
+                self.reused += 1
+            entries[key] = entry
+            output.append(entry[0])
+            parts.append(entry[1])
+        self.entries = entries
+        check(source, _preamble, [entries[digest(text)][2] for text in passage_sources],
+              starts(preamble_source, passage_sources))
+        if None in parts:
+            self.story = None
+        else:
+            self.story = nodes.Story(parts[0], parts[1:])
+        if self.cachefile:
+            self.save()
+        logger.info("compiled %d passages, reused %d", self.compiled, self.reused)
+        return "".join(output)
+
+    def compile_file(self, filename, outname):
+        """
+        Compiles the story in the file called filename and writes its Twee
+        code to outname. Returns the Twee code, or False if parsing failed.
+        """
+        with open(filename, encoding = "utf-8") as file:
+            result = self.compile(file.read())
+        if result != False:
+            with open(outname, "w", encoding = "utf-8") as file:
+                file.write(result)
+            logger.info("successfully wrote story to file")
+        return result
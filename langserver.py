@@ -0,0 +1,549 @@
+"""
+langserver.py
+
+A language server for TweeTeX, speaking the Language Server Protocol
+(JSON-RPC messages with Content-Length headers) on stdin and stdout:
+
+    python3 langserver.py
+
+Editors send the whole story when they open it and then only the
+ranges of text that change as it's edited. A Document keeps the story
+split into its preamble and one segment per passage, as
+incremental.split does, along with the parsed node of each segment. An
+edit only lexes and parses the segments it touches, from the \\passage
+before it up to the next one, so its cost depends on the size of the
+passages it touches rather than on the size of the story. The titles
+and link targets of every segment go into indexes that are updated as
+segments come and go, and the diagnostics (parse errors, duplicate
+titles, \\link and \\start targets that don't exist), the outline of
+passages and go-to-definition on a link target are all worked out from
+those.
+
+Positions are counted in characters if the editor can count them that
+way ("utf-32" in the protocol), and in UTF-16 code units otherwise.
+
+MIT License
+"""
+import bisect
+import itertools
+import json
+import sys
+import time
+
+import compiler
+import incremental
+import log
+import symbols
+
+logger = log.getLogger("langserver")
+
+ERROR = 1   # diagnostic severities
+WARNING = 2
+PASSAGE_KIND = 2 # the symbol kind passages have in an outline: Module, the nearest to a section
+
+def _span(tokens, default):
+    """ the (start, end) of the text that the lexed ones among tokens cover, or default. """
+    lexed = [token for token in tokens if token.source is not None]
+    if not lexed:
+        return default
+    return lexed[0].start, lexed[-1].end
+
+class Segment:
+    """
+    The preamble or one passage of a Document: its text, its parsed node
+    (False if it doesn't parse), and what the document's indexes need to
+    know about it. Offsets in a segment count from its start.
+    """
+
+    def __init__(self, text, is_preamble):
+        self.text = text
+        self.index = 0       # where it is in Document.segments (see Document._index)
+        self.title = None    # the title of a passage that parsed
+        self.title_span = (0, 0)
+        self.links = []      # (start, end, title) of every link target, and of \start
+        self.problems = []   # (start, end, severity, message) found in the segment alone
+        with log.capture() as messages:
+            if is_preamble:
+                self.node = incremental.preamble(text)
+            else:
+                self.node = incremental.passage(text)
+        if self.node == False:
+            messages.append("Parsing Error: "
+                            + ("Preamble" if is_preamble else "passage") + " not formatted correctly.")
+            line_end = text.find("\n")
+            end = len(text) if line_end == -1 else line_end
+            self.problems += [(0, end, ERROR, message) for message in messages]
+        elif is_preamble:
+            for macro in self.node.macros:
+                arguments = macro.argument.items
+                if macro.name == "start" and arguments:
+                    self.links.append(_span(arguments, (0, 0)) + (macro.argument.text,))
+        else:
+            self.title = self.node.name
+            self.title_span = _span(self.node.title.items, (0, self.node.command.end))
+            for command, target in symbols.links(self.node):
+                if target is None:
+                    self.problems.append((command.start, command.end, WARNING,
+                                          f"{command.value} has no target passage"))
+                else:
+                    self.links.append((target.start, target.end, target.value))
+        self.targets = {title for _start, _end, title in self.links}
+
+class Document:
+    """
+    One open story, kept up to date with edit(). Offsets are indexes into
+    text.
+
+    >>> document = Document("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one}\\n"
+    ...                     "\\\\passage{one} \\\\link{Go}{two}\\n")
+    >>> for start, end, severity, message in document.diagnostics():
+    ...     print(document.position(start), document.text[start:end], message)
+    (1, 24) two link to missing passage 'two'
+
+    Adding the missing passage only parses the new one.
+    >>> document.edit(len(document.text), len(document.text), "\\\\passage{two} The end.")
+    >>> document.diagnostics(), document.reparsed
+    ([], 1)
+    >>> [title for title, start, end, title_start, title_end in document.outline()]
+    ['one', 'two']
+    >>> title_start, title_end = document.definition(document.text.index("two}"))
+    >>> document.position(title_start), document.text[title_start:title_end]
+    ((2, 9), 'two')
+
+    Typing in a passage only parses that passage again.
+    >>> document.edit(document.offset(2, 18), document.offset(2, 21), "Bye")
+    >>> document.text.splitlines()[-1], document.reparsed
+    ('\\\\passage{two} The Bye.', 1)
+
+    Breaking a \\passage makes the rest of it part of the passage before.
+    >>> document.edit(document.offset(2, 1), document.offset(2, 8), "passge")
+    >>> for start, end, severity, message in document.diagnostics():
+    ...     print(document.position(start), message)
+    (0, 37) start passage 'one' doesn't exist
+    (1, 0) Lexing error: unknown command at '\\n\\\\passge{two} The By'
+    (1, 0) Parsing Error: passage not formatted correctly.
+    """
+
+    def __init__(self, text):
+        self.segments = [Segment("", True)]
+        self.lengths = [0]   # of the text of each segment
+        self.newlines = [0]  # in the text of each segment
+        self.starts = [0, 0] # offset of each segment, then the length of the text
+        self.lines = [0, 0]  # newlines before each segment, then in the whole text
+        self.titles = {}     # title -> set of the segments defining it
+        self.linkers = {}    # title -> set of the segments with links to it
+        self.missing = set() # titles linked to that no segment defines
+        self.duplicates = set() # titles defined by more than one segment
+        self.flagged = set() # segments with problems of their own
+        self.reparsed = 0    # segments parsed by the last edit
+        self.numbered = 1    # how many segments at the start have the right index
+        self._learn(self.segments[0])
+        self.edit(0, 0, text)
+
+    def __len__(self):
+        return self.starts[-1]
+
+    @property
+    def text(self):
+        """ the whole text, which is only kept a segment at a time. """
+        return "".join(segment.text for segment in self.segments)
+
+    def slice(self, start, end):
+        """ text[start:end], put together from just the segments it's in. """
+        count = len(self.segments)
+        first = bisect.bisect_right(self.starts, start, 0, count) - 1
+        last = bisect.bisect_right(self.starts, end, 0, count) - 1
+        base = self.starts[first]
+        text = "".join(segment.text for segment in self.segments[first:last + 1])
+        return text[start - base:end - base]
+
+    def edit(self, start, end, text):
+        """ replaces text[start:end] with text, parsing only the segments that changed. """
+        count = len(self.segments)
+        # the segment before the one the edit starts in too if the edit starts
+        # right at a \passage, which it could be about to break
+        first = max(0, bisect.bisect_left(self.starts, start, 0, count) - 1)
+        last = bisect.bisect_right(self.starts, end, 0, count) - 1
+        region_start = self.starts[first]
+        region = "".join(segment.text for segment in self.segments[first:last + 1])
+        region = region[:start - region_start] + text + region[end - region_start:]
+        while first > 0 and not incremental.PASSAGE.match(region):
+            # the \passage the region started with is gone, so what's left of it
+            # belongs to the segment before
+            first -= 1
+            region = self.segments[first].text + region
+        preamble, passages = incremental.split(region)
+        texts = ([preamble] if first == 0 else []) + passages
+        old = self.segments[first:last + 1]
+        unchanged = {segment.text: segment for segment in old[first == 0:]}
+        new = []
+        self.reparsed = 0
+        for number, piece in enumerate(texts):
+            if number == 0 and first == 0:
+                segment = old[0] if old[0].text == piece else None
+                is_preamble = True
+            else:
+                segment = unchanged.pop(piece, None)
+                is_preamble = False
+            if segment is None:
+                segment = Segment(piece, is_preamble)
+                self.reparsed += 1
+            new.append(segment)
+        for segment in old:
+            self._forget(segment)
+        self.segments[first:last + 1] = new
+        self.lengths[first:last + 1] = [len(segment.text) for segment in new]
+        self.newlines[first:last + 1] = [segment.text.count("\n") for segment in new]
+        for index, segment in enumerate(new, first):
+            segment.index = index
+        if len(new) != len(old):
+            # the segments after the edit have moved; _index() numbers them again
+            # when one of them is next needed
+            self.numbered = min(self.numbered, first + len(new))
+        for segment in new:
+            self._learn(segment)
+        self.starts[first:] = itertools.accumulate([self.starts[first]] + self.lengths[first:])
+        self.lines[first:] = itertools.accumulate([self.lines[first]] + self.newlines[first:])
+
+    def _learn(self, segment):
+        if segment.title is not None:
+            definers = self.titles.setdefault(segment.title, set())
+            definers.add(segment)
+            self.missing.discard(segment.title)
+            if len(definers) > 1:
+                self.duplicates.add(segment.title)
+        for title in segment.targets:
+            self.linkers.setdefault(title, set()).add(segment)
+            if title not in self.titles:
+                self.missing.add(title)
+        if segment.problems:
+            self.flagged.add(segment)
+
+    def _forget(self, segment):
+        if segment.title is not None:
+            definers = self.titles[segment.title]
+            definers.discard(segment)
+            if len(definers) < 2:
+                self.duplicates.discard(segment.title)
+            if not definers:
+                del self.titles[segment.title]
+                if segment.title in self.linkers:
+                    self.missing.add(segment.title)
+        for title in segment.targets:
+            linkers = self.linkers[title]
+            linkers.discard(segment)
+            if not linkers:
+                del self.linkers[title]
+                self.missing.discard(title)
+        self.flagged.discard(segment)
+
+    def _index(self, segment):
+        """ where segment is in segments. """
+        index = segment.index
+        if index >= len(self.segments) or self.segments[index] is not segment:
+            for index in range(self.numbered, len(self.segments)):
+                self.segments[index].index = index
+            self.numbered = len(self.segments)
+        return segment.index
+
+    def _start(self, segment):
+        return self.starts[self._index(segment)]
+
+    def _definition(self, title):
+        """ the first segment defining title, or None. """
+        definers = self.titles.get(title)
+        if not definers:
+            return None
+        return min(definers, key = self._index)
+
+    def diagnostics(self):
+        """ every problem in the document, as (start, end, severity, message), in order. """
+        found = []
+        for segment in self.flagged:
+            base = self._start(segment)
+            found += [(base + start, base + end, severity, message)
+                      for start, end, severity, message in segment.problems]
+        for title in self.duplicates:
+            first = self._definition(title)
+            line = self.position(self._start(first))[0] + 1
+            for segment in self.titles[title]:
+                if segment is not first:
+                    base = self._start(segment)
+                    found.append((base + segment.title_span[0], base + segment.title_span[1], WARNING,
+                                  f"duplicate passage {title!r} (first defined on line {line})"))
+        for title in self.missing:
+            for segment in self.linkers[title]:
+                base = self._start(segment)
+                if segment is self.segments[0]:
+                    message = f"start passage {title!r} doesn't exist"
+                else:
+                    message = f"link to missing passage {title!r}"
+                found += [(base + start, base + end, WARNING, message)
+                          for start, end, target in segment.links if target == title]
+        found.sort()
+        return found
+
+    def outline(self):
+        """ (title, start, end, title start, title end) for every passage that parsed. """
+        passages = []
+        for segment, base in zip(self.segments[1:], self.starts[1:]):
+            if segment.title is not None:
+                passages.append((segment.title, base, base + len(segment.text),
+                                 base + segment.title_span[0], base + segment.title_span[1]))
+        return passages
+
+    def definition(self, offset):
+        """
+        The (start, end) of the title of the passage that the link target or
+        \\start at offset names, or None if there isn't one there.
+        """
+        index = bisect.bisect_right(self.starts, offset, 0, len(self.segments)) - 1
+        segment = self.segments[index]
+        local = offset - self.starts[index]
+        for start, end, title in segment.links:
+            if start <= local <= end:
+                target = self._definition(title)
+                if target is None:
+                    return None
+                base = self._start(target)
+                return base + target.title_span[0], base + target.title_span[1]
+        return None
+
+    def position(self, offset):
+        """ the (line, column) of offset, both counting from 0. """
+        index = bisect.bisect_right(self.starts, offset, 0, len(self.segments)) - 1
+        local = offset - self.starts[index]
+        text = self.segments[index].text
+        line = self.lines[index] + text.count("\n", 0, local)
+        newline = text.rfind("\n", 0, local)
+        column = local - newline - 1
+        while newline == -1 and index > 0: # the line started in an earlier segment
+            index -= 1
+            text = self.segments[index].text
+            newline = text.rfind("\n")
+            column += len(text) - newline - 1
+        return line, column
+
+    def offset(self, line, column):
+        """ the offset of (line, column), kept inside the text and the line. """
+        if line <= 0:
+            index, local = 0, 0
+        else:
+            # the newline ending the line before is in the segment before the first
+            # one with at least line newlines before it
+            index = bisect.bisect_left(self.lines, line, 0, len(self.segments) + 1) - 1
+            if index >= len(self.segments):
+                return len(self)
+            local = -1
+            for _ in range(line - self.lines[index]):
+                local = self.segments[index].text.find("\n", local + 1)
+            local += 1
+        remaining = max(column, 0)
+        while True: # up to column characters on, or the end of the line
+            text = self.segments[index].text
+            newline = text.find("\n", local, local + remaining)
+            if newline != -1:
+                return self.starts[index] + newline
+            taken = min(remaining, len(text) - local)
+            remaining -= taken
+            if remaining == 0 or index == len(self.segments) - 1:
+                return self.starts[index] + local + taken
+            index, local = index + 1, 0
+
+def read_message(stream):
+    """ the next JSON-RPC message on stream (binary), or None at the end of it. """
+    length = None
+    while True:
+        header = stream.readline()
+        if not header:
+            return None
+        header = header.strip()
+        if not header:
+            break
+        name, _, value = header.decode("ascii").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    if length is None:
+        raise ValueError("message without a Content-Length")
+    return json.loads(stream.read(length))
+
+def write_message(stream, message):
+    body = json.dumps(message).encode("utf-8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+class LanguageServer:
+    """
+    Answers the messages an editor sends; handle() takes one message and
+    returns the ones to send back.
+
+    >>> server = LanguageServer()
+    >>> reply = server.handle({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params":
+    ...     {"capabilities": {"general": {"positionEncodings": ["utf-16", "utf-32"]}}}})
+    >>> reply[0]["result"]["capabilities"]["positionEncoding"]
+    'utf-32'
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one}\\n"
+    ...          "\\\\passage{one} \\\\link{Go}{two}\\n")
+    >>> document = {"uri": "file:///story.twx", "text": story}
+    >>> [diagnostic] = server.handle({"jsonrpc": "2.0", "method": "textDocument/didOpen",
+    ...     "params": {"textDocument": document}})[0]["params"]["diagnostics"]
+    >>> diagnostic["range"], diagnostic["message"]
+    ({'start': {'line': 1, 'character': 24}, 'end': {'line': 1, 'character': 27}}, "link to missing passage 'two'")
+    >>> server.handle({"jsonrpc": "2.0", "method": "textDocument/didChange", "params": {
+    ...     "textDocument": {"uri": "file:///story.twx", "version": 2},
+    ...     "contentChanges": [{"range": {"start": {"line": 2, "character": 0},
+    ...                                   "end": {"line": 2, "character": 0}},
+    ...                         "text": "\\\\passage{two} The end."}]}})[0]["params"]["diagnostics"]
+    []
+    >>> server.handle({"jsonrpc": "2.0", "id": 2, "method": "textDocument/definition", "params": {
+    ...     "textDocument": {"uri": "file:///story.twx"},
+    ...     "position": {"line": 1, "character": 25}}})[0]["result"]["range"]
+    {'start': {'line': 2, 'character': 9}, 'end': {'line': 2, 'character': 12}}
+    >>> [passage["name"] for passage in server.handle({"jsonrpc": "2.0", "id": 3,
+    ...     "method": "textDocument/documentSymbol",
+    ...     "params": {"textDocument": {"uri": "file:///story.twx"}}})[0]["result"]]
+    ['one', 'two']
+    >>> server.handle({"jsonrpc": "2.0", "id": 4, "method": "workspace/symbol", "params": {}})
+    [{'jsonrpc': '2.0', 'id': 4, 'error': {'code': -32601, 'message': 'unknown method workspace/symbol'}}]
+    """
+
+    def __init__(self):
+        self.documents = {} # uri -> Document
+        self.encoding = "utf-16"
+        self.running = True
+
+    def handle(self, message):
+        method = message.get("method")
+        params = message.get("params") or {}
+        handler = getattr(self, "on_" + str(method).replace("/", "_"), None)
+        if "id" not in message: # a notification, which gets no reply
+            if handler is None:
+                return []
+            try:
+                return handler(params) or []
+            except Exception: # a bad edit shouldn't stop the server
+                logger.exception("error handling %s", method)
+                return []
+        if handler is None:
+            error = {"code": -32601, "message": f"unknown method {method}"}
+            return [{"jsonrpc": "2.0", "id": message["id"], "error": error}]
+        try:
+            result = handler(params)
+        except Exception as error:
+            logger.exception("error handling %s", method)
+            error = {"code": -32603, "message": f"{type(error).__name__}: {error}"}
+            return [{"jsonrpc": "2.0", "id": message["id"], "error": error}]
+        return [{"jsonrpc": "2.0", "id": message["id"], "result": result}]
+
+    def run(self, stdin = None, stdout = None):
+        """ answers messages from stdin until the editor says to exit. """
+        stdin = stdin or sys.stdin.buffer
+        stdout = stdout or sys.stdout.buffer
+        while self.running:
+            message = read_message(stdin)
+            if message is None:
+                break
+            for reply in self.handle(message):
+                write_message(stdout, reply)
+
+    # converting between offsets and protocol positions
+
+    def _offset(self, document, position):
+        line, character = position["line"], position["character"]
+        if self.encoding == "utf-32":
+            return document.offset(line, character)
+        offset = document.offset(line, 0)
+        line_text = document.slice(offset, document.offset(line, len(document)))
+        if line_text.isascii():
+            return offset + min(character, len(line_text))
+        units = 0
+        for column, char in enumerate(line_text):
+            if units >= character:
+                return offset + column
+            units += 2 if ord(char) > 0xFFFF else 1
+        return offset + len(line_text)
+
+    def _position(self, document, offset):
+        line, column = document.position(offset)
+        if self.encoding == "utf-16":
+            line_text = document.slice(offset - column, offset)
+            if not line_text.isascii():
+                column += sum(1 for char in line_text if ord(char) > 0xFFFF)
+        return {"line": line, "character": column}
+
+    def _range(self, document, start, end):
+        return {"start": self._position(document, start), "end": self._position(document, end)}
+
+    def _publish(self, uri):
+        document = self.documents.get(uri)
+        diagnostics = []
+        if document is not None:
+            diagnostics = [{"range": self._range(document, start, end), "severity": severity,
+                            "source": "tweetex", "message": message}
+                           for start, end, severity, message in document.diagnostics()]
+        return [{"jsonrpc": "2.0", "method": "textDocument/publishDiagnostics",
+                 "params": {"uri": uri, "diagnostics": diagnostics}}]
+
+    # the protocol's methods
+
+    def on_initialize(self, params):
+        offered = params.get("capabilities", {}).get("general", {}).get("positionEncodings", [])
+        if "utf-32" in offered:
+            self.encoding = "utf-32"
+        return {"capabilities": {"positionEncoding": self.encoding,
+                                 "textDocumentSync": {"openClose": True, "change": 2},
+                                 "documentSymbolProvider": True,
+                                 "definitionProvider": True},
+                "serverInfo": {"name": "tweetex", "version": compiler.VERSION}}
+
+    def on_shutdown(self, params):
+        return None
+
+    def on_exit(self, params):
+        self.running = False
+
+    def on_textDocument_didOpen(self, params):
+        uri = params["textDocument"]["uri"]
+        self.documents[uri] = Document(params["textDocument"]["text"])
+        return self._publish(uri)
+
+    def on_textDocument_didChange(self, params):
+        uri = params["textDocument"]["uri"]
+        start = time.perf_counter()
+        for change in params["contentChanges"]:
+            document = self.documents.get(uri)
+            if "range" not in change or document is None: # the whole text
+                self.documents[uri] = Document(change["text"])
+                continue
+            document.edit(self._offset(document, change["range"]["start"]),
+                          self._offset(document, change["range"]["end"]), change["text"])
+        logger.debug("edited %s in %.2f ms", uri, (time.perf_counter() - start) * 1000)
+        return self._publish(uri)
+
+    def on_textDocument_didClose(self, params):
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        return self._publish(uri)
+
+    def on_textDocument_documentSymbol(self, params):
+        document = self.documents[params["textDocument"]["uri"]]
+        return [{"name": title, "kind": PASSAGE_KIND,
+                 "range": self._range(document, start, end),
+                 "selectionRange": self._range(document, title_start, title_end)}
+                for title, start, end, title_start, title_end in document.outline()]
+
+    def on_textDocument_definition(self, params):
+        uri = params["textDocument"]["uri"]
+        document = self.documents[uri]
+        found = document.definition(self._offset(document, params["position"]))
+        if found is None:
+            return None
+        return {"uri": uri, "range": self._range(document, *found)}
+
+def main():
+    # stdout carries the protocol, so anything logged goes to stderr
+    log.configure(log.QUIET, sys.stderr)
+    LanguageServer().run()
+
+if __name__ == "__main__":
+    main()
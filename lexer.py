@@ -5,27 +5,81 @@ general purpose lexer class.
 
 Nick Creel | Feb 5 2020 | MIT License
 """
+import codecs
 import re
+import sys
+from collections import deque
+
+import commands
 ## TODO: make some simple test story function that makes a simple story for testing...
 
-class Queue:
-	""" Mostly a standard FIFO queue, with the option of put()ting something in 0th
-		position like a stack."""
-	def __init__(self):
-		self.queue = []
+class TokenStream:
+	""" A FIFO stream of tokens backed by a deque, so taking the next token,
+		peeking at it, and put()ting a token back in 0th position are all
+		constant time no matter how long the stream is.
+
+		A stream can also be made from an iterable of tokens (eg a lexer's
+		tokenize() generator), in which case tokens are only pulled from it
+		when they are needed, and only the ones put back are held on to.
+
+	>>> stream = TokenStream()
+	>>> stream.enqueue(Token('{', 'LEFTCURLY', '{'))
+	>>> stream.enqueue(Token('}', 'RIGHTCURLY', '}'))
+	>>> stream.peek()
+	Token('{', 'LEFTCURLY', '{')
+	>>> token = stream.dequeue()
+	>>> stream
+	[Token('}', 'RIGHTCURLY', '}')]
+	>>> stream.put(token)
+	>>> len(stream)
+	2
+	>>> stream.isEmpty()
+	False
+
+	>>> stream = TokenStream(Lexer("{lazy}").tokenize())
+	>>> stream
+	[]
+	>>> stream.dequeue()
+	Token('{', 'LEFTCURLY', '{')
+	>>> stream.peek()
+	Token('lazy', 'CHARACTER', 'lazy')
+	>>> stream
+	[Token('lazy', 'CHARACTER', 'lazy')]
+	"""
+	def __init__(self, tokens = ()):
+		self.queue = deque()
+		self.source = iter(tokens)
 	def __repr__(self):
-		return f"{self.queue}"
+		return f"{list(self.queue)}"
+	def __len__(self):
+		# only counts the tokens that have been pulled from the source
+		return len(self.queue)
 	def enqueue(self, something):
 		self.queue.append(something)
 	def dequeue(self):
-		return self.queue.pop(0)
+		if self.queue or self._pull():
+			return self.queue.popleft()
+		raise IndexError("dequeue from an empty TokenStream")
+	def peek(self):
+		if self.queue or self._pull():
+			return self.queue[0]
+		raise IndexError("peek at an empty TokenStream")
 	def put(self, something):
-		self.queue.insert(0, something)
+		self.queue.appendleft(something)
 	def isEmpty(self):
-		if self.queue:
+		if self.queue or self._pull():
 			return False
 		else:
 			return True
+	def _pull(self):
+		for token in self.source:
+			self.queue.append(token)
+			return True
+		return False
+
+class Queue(TokenStream):
+	""" Mostly a standard FIFO queue, with the option of put()ting something in 0th
+		position like a stack. Kept for older code, this is just a TokenStream."""
 
 class Token:
     """
@@ -59,19 +113,195 @@ class Token:
     Token('\passage', 'PASSAGECOMMAND', '\passage')
     >>> Token('hello', 'CHARACTER', 'hello')
     Token('hello', 'CHARACTER', 'hello')
+
+    Tokens made by the lexer don't keep their own copies of the text
+    they matched. They keep the source text they came from and the
+    start and end offsets of the match in it, and value and match are
+    sliced out of the source when asked for. A token only gets a list
+    of children once something asks for it, so leaves stay small.
+
+    >>> token = Token.from_span("  \\\\link{", 2, 7, 'MACROCOMMAND', 1)
+    >>> token
+    Token('link', 'MACROCOMMAND', '\link')
+    >>> token.start, token.end
+    (2, 7)
+
+    Tokens made by hand have no span in a source.
+    >>> token = Token('hello', 'CHARACTER', 'hello')
+    >>> token.start, token.end, token.skip
+    (None, None, 0)
     """
+    __slots__ = ('token_type', 'source', 'start', 'end', 'skip',
+                 '_value', '_match', '_children')
 
     def __init__(self, value = None, token_type = None, match = None):
         # i just made these all none because I didn't want to rearrange
         # all my examples...
-        self.value = value
+        self._value = value
         self.token_type = token_type
-        self.children = []
-        self.match = match
+        self._children = None
+        self._match = match
+        self.source = None
+        self.start = None
+        self.end = None
+        self.skip = 0
+
+    @classmethod
+    def from_span(cls, source, start, end, token_type, skip = 0):
+        """
+        Makes a token for source[start:end]. The value is the same
+        span with the first skip characters left off (eg the backslash
+        of a command).
+        """
+        token = cls.__new__(cls)
+        token.token_type = token_type
+        token.source = source
+        token.start = start
+        token.end = end
+        token.skip = skip
+        token._children = None
+        return token
+
+    @property
+    def value(self):
+        if self.source is None:
+            return self._value
+        return self.source[self.start + self.skip:self.end]
+
+    @value.setter
+    def value(self, value):
+        self._detach()
+        self._value = value
+
+    @property
+    def match(self):
+        if self.source is None:
+            return self._match
+        return self.source[self.start:self.end]
+
+    @match.setter
+    def match(self, match):
+        self._detach()
+        self._match = match
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = []
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    @property
+    def leaf(self):
+        """ True if the token has no children. Asking doesn't make a list for them. """
+        return not self._children
+
+    def _detach(self):
+        # copy the span out of the source so value and match can be set
+        # separately.
+        if self.source is not None:
+            self._value, self._match = self.value, self.match
+            self.source = None
 
     def __repr__(self):
         return f"Token('{self.value}', '{self.token_type}', '{self.match}')"
 
+# token table, in priority order: the first expression that matches wins.
+# group 1 of each expression is the match, and the last group is the value.
+# A token type can also be a dict from value to token type, for a group of
+# tokens told apart by their value: every command is matched by the one
+# expression here and its type looked up in the command registry (see
+# commands.py), so adding a command doesn't make the pattern any longer.
+TOKEN_TYPES = { r'(\{)' : "LEFTCURLY",
+                r'(\})':"RIGHTCURLY",
+                r'(\\([A-Za-z]+))': commands.KINDS,
+                r'([^\\\{\}]+)': 'CHARACTER'}
+
+class Scanner:
+    """
+    A scanner compiles a token table (see TOKEN_TYPES) into a single
+    master regular expression, with one named group per token type, so
+    that the source can be walked by offset with pattern.match(text, pos)
+    instead of slicing off a new copy of the source for every token.
+    Leading whitespace is skipped the same way str.lstrip() skipped it,
+    and the alternatives are tried in table order, so the scanner
+    produces exactly the tokens the old one-expression-at-a-time lexer did.
+
+    >>> scanner = Scanner(TOKEN_TYPES)
+    >>> scanner.token(scanner.pattern.match("  \\\\link{here}"))
+    Token('link', 'MACROCOMMAND', '\\link')
+    >>> scanner.token(scanner.pattern.match("{here}", 1))
+    Token('here', 'CHARACTER', 'here')
+    >>> scanner.token(scanner.pattern.match("\\\\set{x}{1}"))
+    Token('set', 'MACROCOMMAND', '\\set')
+    >>> scanner.token(scanner.pattern.match("\\\\unknown")) is None
+    True
+    >>> scanner.at_end("text   ", 4)
+    True
+    """
+
+    def __init__(self, token_types):
+        self.token_types = token_types
+        self.groups = {} # group name -> (token type, match group, value group)
+        alternatives = []
+        index = 1 # group 1 is the leading whitespace
+        for number, (expression, token_type) in enumerate(token_types.items()):
+            name = f"T{number}"
+            inner = re.compile(expression).groups
+            alternatives.append(f"(?P<{name}>{expression})")
+            index += 1
+            self.groups[name] = (token_type, index + min(inner, 1), index + inner)
+            index += inner
+        # (?=(\s*))\1 skips whitespace without ever backtracking into it, so
+        # whitespace in front of a bad token can't become a CHARACTER token.
+        self.pattern = re.compile(r"(?=(\s*))\1(?:" + "|".join(alternatives) + ")")
+        self.whitespace = re.compile(r"\s*")
+        self._trailing = re.compile(r"\s*\Z")
+
+    def token(self, match):
+        """
+        builds a Token from a successful match of the master pattern, or
+        returns None if it matched a command that isn't in the registry.
+        """
+        token_type, match_group, value_group = self.groups[match.lastgroup]
+        if type(token_type) is not str:
+            token_type = token_type.get(match.group(value_group))
+            if token_type is None:
+                return None
+        start = match.start(match_group)
+        return Token.from_span(match.string, start, match.end(match_group),
+                               token_type, match.start(value_group) - start)
+
+    def copy_token(self, match, offset = 0):
+        """
+        builds a Token that owns copies of its value and match, for when
+        the matched text won't stay around (see StreamLexer). Command
+        names are interned, since the same few of them come up over and over.
+        offset is the position of match.string in the whole source, so
+        that the token's start is still an offset into the source.
+        """
+        token_type, match_group, value_group = self.groups[match.lastgroup]
+        if type(token_type) is not str:
+            token_type = token_type.get(match.group(value_group))
+            if token_type is None:
+                return None
+        matched = match.group(match_group)
+        if value_group == match_group:
+            token = Token(matched, token_type, matched)
+        else:
+            token = Token(sys.intern(match.group(value_group)), token_type, sys.intern(matched))
+        token.start = offset + match.start(match_group)
+        return token
+
+    def at_end(self, text, pos):
+        """ True if nothing but whitespace is left in text after pos. """
+        return self._trailing.match(text, pos) is not None
+
+SCANNER = Scanner(TOKEN_TYPES)
+
 class Lexer:
     """
     Lexer is an object which takes the contents of a source file as
@@ -79,11 +309,12 @@ class Lexer:
     Note: A lexer must be initialized with its source file as an
     input, then the lex method may be called.
 
-    A lexer object has three attributes:
+    A lexer object has four attributes:
     text = the source file contents
     tokens = list of tokens generated during lexing
     token_types = legal set of tokens which can be recognized, and
                   corresponding regular expressions
+    position = offset in text where lexing stopped
     >>> mylexer = Lexer("hello")
     >>> mylexer.lex()
     >>> mylexer.tokens
@@ -92,46 +323,163 @@ class Lexer:
     >>> mylexer.lex()
     >>> mylexer.tokens
     [Token('link', 'MACROCOMMAND', '\link')]
+
+    Lexing stops at the first thing that isn't a token.
+    >>> mylexer = Lexer("{one} \\\\unknown{two}")
+    >>> mylexer.lex()
+    False
+    >>> mylexer.tokens
+    [Token('{', 'LEFTCURLY', '{'), Token('one', 'CHARACTER', 'one'), Token('}', 'RIGHTCURLY', '}')]
     """
-    # MACROCOMMANDS = ["link"]
-    # PREAMBLECOMMANDS = ["author", "title", "start", "ifid"]
-    # there's probably some way to insert a list of strings into a regular expression...
 
     def __init__(self, text):
         self.text = text
-        self.tokens = Queue()
-        self.token_types = { r'(\{)' : "LEFTCURLY",
-                             r'(\})':"RIGHTCURLY",
-                             r'(\\(link))':"MACROCOMMAND",
-                             r'(\\(author|title|ifid|start))':"PREAMBLECOMMAND",
-                             r'(\\(passage))':"PASSAGECOMMAND",
-                             r'([^\\\{\}]+)': 'CHARACTER'}
-
-    def _next_token(self, source):
-        string = source.lstrip()
-        for token in self.token_types:
-            match = re.match(token, string)
-            if match and len(match.groups())==2:
-                tokenobj = Token(match.group(2),self.token_types[token], match.group(1))
-                self.tokens.enqueue(tokenobj)
-                result = string[len(match.group(1)):]
-                return result
-            elif match and len(match.groups()) is 1:
-                tokenobj = Token(match.group(1), self.token_types[token], match.group(1))
-                self.tokens.enqueue(tokenobj)
-                result = string[len(match.group(1)):]
-                return result
-        return False
+        self.tokens = TokenStream()
+        self.token_types = TOKEN_TYPES
+        self.scanner = SCANNER
+        self.position = 0
+        self.complete = False
+
+    def tokenize(self):
+        """
+        Generates the tokens of self.text one at a time, stopping at the end
+        of the text or at the first character that can't start a token.
+        """
+        text = self.text
+        match = self.scanner.pattern.match
+        token = self.scanner.token
+        pos = 0
+        found = match(text, pos)
+        while found is not None:
+            made = token(found)
+            if made is None: # a command that isn't registered
+                break
+            yield made
+            pos = found.end()
+            found = match(text, pos)
+        self.position = pos
+        self.complete = self.scanner.at_end(text, pos)
 
     def lex(self):
-        source = self.text
-        while len(source) != 0:
-            chunk = self._next_token(source)
-            if chunk != False:
-                source = chunk
+        for token in self.tokenize():
+            self.tokens.enqueue(token)
+        if not self.complete:
+            return False
+
+    def rest(self, length = 20):
+        """
+        Up to length characters of the source from where lexing stopped,
+        to show in error messages.
+
+        >>> mylexer = Lexer("one \\\\unknown{two}")
+        >>> mylexer.lex()
+        False
+        >>> mylexer.rest()
+        '\\\\unknown{two}'
+        """
+        return self.text[self.position:self.position + length]
+
+class StreamLexer(Lexer):
+    """
+    A lexer that reads its source a chunk at a time from a file object
+    (text or binary) or an mmap, instead of needing the whole text up front.
+    Only the current chunk and whatever token is still being read are held
+    in memory, so tokenize() can be used on sources of any size. A token
+    that runs over the end of a chunk is matched again once more text has
+    been read, so the tokens are the same as Lexer gives for the whole text.
+
+    >>> import io
+    >>> mylexer = StreamLexer(io.StringIO("\\passage{first} some text"), chunk_size = 3)
+    >>> list(mylexer.tokenize())
+    [Token('passage', 'PASSAGECOMMAND', '\passage'), Token('{', 'LEFTCURLY', '{'), Token('first', 'CHARACTER', 'first'), Token('}', 'RIGHTCURLY', '}'), Token('some text', 'CHARACTER', 'some text')]
+
+    Binary files are decoded as they are read.
+    >>> mylexer = StreamLexer(io.BytesIO("caf\u00e9 \\link".encode()), chunk_size = 4)
+    >>> mylexer.lex()
+    >>> mylexer.tokens
+    [Token('café ', 'CHARACTER', 'café '), Token('link', 'MACROCOMMAND', '\link')]
+    >>> mylexer.position
+    10
+
+    A token longer than a chunk is read in one go, however long it is,
+    and where lexing stopped is shown as Lexer shows it.
+    >>> mylexer = StreamLexer(io.StringIO("x" * 1000 + " \\\\unknown{two}"), chunk_size = 7)
+    >>> mylexer.lex()
+    False
+    >>> len(mylexer.tokens.queue[0].value), mylexer.rest()
+    (1001, '\\\\unknown{two}')
+    """
+    CHUNK_SIZE = 1 << 16
+    # no command is longer than this, so once this much text is waiting
+    # after a backslash that doesn't match, reading more can't help.
+    LOOKAHEAD = 64
+
+    def __init__(self, file, chunk_size = CHUNK_SIZE, encoding = "utf-8"):
+        super().__init__(None)
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.stopped = "" # the source from where lexing stopped, see rest()
+
+    def _read(self):
+        """ returns the next chunk of text, or None at end of file. """
+        data = self.file.read(self.chunk_size)
+        if isinstance(data, str):
+            return data or None
+        if not data:
+            rest = self.decoder.decode(b"", final = True)
+            return rest or None
+        return self.decoder.decode(data)
+
+    def tokenize(self):
+        """
+        Generates tokens as the source is read, stopping at the end of the
+        file or at the first character that can't start a token.
+        """
+        match = self.scanner.pattern.match
+        token = self.scanner.copy_token
+        skip = self.scanner.whitespace.match
+        buffer = ""
+        offset = 0 # position of buffer[0] in the whole source
+        pos = 0
+        eof = False
+        while True:
+            found = match(buffer, pos)
+            if found is not None and (eof or found.end() < len(buffer)):
+                made = token(found, offset)
+                if made is None: # a command that isn't registered
+                    pos = skip(buffer, pos).end()
+                    break
+                yield made
+                pos = found.end()
                 continue
-            else:
-                return False
+            if found is None:
+                pos = skip(buffer, pos).end()
+                if eof or len(buffer) - pos >= self.LOOKAHEAD:
+                    break
+            # either nothing matched yet or the match might go on into the
+            # next chunk: drop what's been lexed and read some more. At least
+            # as much is read as is already waiting, so a long token is
+            # matched again a few times, not once for every chunk in it.
+            offset += pos
+            pending = [buffer[pos:]]
+            wanted = len(pending[0])
+            read = 0
+            while not eof and (read == 0 or read < wanted):
+                chunk = self._read()
+                if chunk is None:
+                    eof = True
+                else:
+                    pending.append(chunk)
+                    read += len(chunk)
+            buffer = "".join(pending)
+            pos = 0
+        self.position = offset + pos
+        self.complete = eof and pos == len(buffer)
+        self.stopped = buffer[pos:pos + self.LOOKAHEAD]
+
+    def rest(self, length = 20):
+        return self.stopped[:length]
 
 if __name__ == '__main__':
     import doctest
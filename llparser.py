@@ -0,0 +1,325 @@
+"""
+llparser.py
+
+A second parser engine for TweeTeX, driven by a predictive (LL(1)) parse
+table rather than by recursive descent. The table is generated from
+GRAMMAR below, which is the grammar in parser.py written out over the
+lexer's token types, with the repetitions in that grammar turned into
+right-recursive rules. parse() then reads the tokens once, left to
+right, looking only at the next token to choose a rule, and keeps the
+rules it's part way through on an explicit stack. It never puts a token
+back and never calls itself, so nesting is limited only by memory, not
+by Python's recursion limit.
+
+It builds the same AST as parser.parse(), out of the classes in the
+nodes library, and fills in a symbols.SymbolTable the same way. Where
+the two differ is on text the grammar doesn't allow: a stray "{" or "}"
+in a passage's text is an error here, where parser.py drops it.
+
+MIT License
+"""
+import itertools
+
+import commands
+import lexer
+import log
+import nodes
+
+logger = log.getLogger("parser")
+
+GRAMMAR = """
+<story> :== <preamble> <part> <parts> EOF
+<preamble> :== <preamblemacro> <preamblemacros>
+<preamblemacros> :== <preamblemacro> <preamblemacros> | ""
+<preamblemacro> :== PREAMBLECOMMAND <single>
+<parts> :== <part> <parts> | ""
+<part> :== <passage> | <include>
+<include> :== INCLUDECOMMAND <single>
+<passage> :== PASSAGECOMMAND <arguments> <text>
+<macro> :== MACROCOMMAND <arguments>
+<single> :== <argument>
+<arguments> :== <argument> <more>
+<more> :== <argument> <more> | ""
+<argument> :== LEFTCURLY <content> RIGHTCURLY
+<content> :== CHARACTER | <macro>
+<text> :== <items>
+<items> :== CHARACTER <items> | <macro> <items> | ""
+"""
+
+# the rules that make a node in the AST, and the class of the node. Each
+# node is made from the list of children it would have (see nodes.py)
+# once its rule has been matched, except for the Argument that holds all
+# of the arguments of a macro or passage, which is made and added to the
+# macro's children first, and filled in as each argument is matched.
+NODES = {
+    "story": nodes.Story,
+    "preamble": nodes.Preamble,
+    "preamblemacro": nodes.PreambleMacro,
+    "include": nodes.Include,
+    "passage": nodes.Passage,
+    "macro": nodes.Macro,
+    "single": nodes.Argument,
+    "arguments": nodes.Argument,
+    "text": nodes.Text,
+}
+
+# how tokens are named in error messages
+NAMES = {
+    "PREAMBLECOMMAND": "a preamble macro",
+    "PASSAGECOMMAND": "\\passage",
+    "INCLUDECOMMAND": "\\include",
+    "MACROCOMMAND": "a macro",
+    "LEFTCURLY": "'{'",
+    "RIGHTCURLY": "'}'",
+    "CHARACTER": "text",
+    "EOF": "the end of the story",
+}
+
+def read_grammar(grammar):
+    """
+    Reads a grammar written like GRAMMAR into a dict from each rule's name
+    to a list of its alternatives, each a tuple of symbols. Rules are
+    written <name> and token types in capitals, and "" is an empty
+    alternative.
+
+    >>> read_grammar('<list> :== ITEM <list> | ""')
+    {'list': [('ITEM', 'list'), ()]}
+    """
+    rules = {}
+    for line in grammar.strip().splitlines():
+        name, alternatives = line.split(":==")
+        rules[name.strip().strip("<>")] = [
+            tuple(symbol.strip("<>") for symbol in alternative.split() if symbol != '""')
+            for alternative in alternatives.split("|")]
+    return rules
+
+def first_sets(rules):
+    """
+    The FIRST set of every rule: the token types its expansions can begin
+    with, and None if it can expand to nothing.
+
+    >>> rules = read_grammar('<list> :== ITEM <list> | ""')
+    >>> first_sets(rules)["list"] == {"ITEM", None}
+    True
+    """
+    first = {name: set() for name in rules}
+    changed = True
+    while changed:
+        changed = False
+        for name, alternatives in rules.items():
+            for alternative in alternatives:
+                found = first_of(alternative, first)
+                if not found <= first[name]:
+                    first[name] |= found
+                    changed = True
+    return first
+
+def first_of(symbols, first):
+    """ the FIRST set of a sequence of symbols, given the FIRST sets of the rules. """
+    found = set()
+    for symbol in symbols:
+        if symbol not in first:  # a token type
+            found.add(symbol)
+            return found
+        found |= first[symbol] - {None}
+        if None not in first[symbol]:
+            return found
+    found.add(None)
+    return found
+
+def follow_sets(rules, first):
+    """
+    The FOLLOW set of every rule: the token types that can come straight
+    after it.
+
+    >>> rules = read_grammar('<pair> :== <list> END \\n<list> :== ITEM <list> | ""')
+    >>> follow_sets(rules, first_sets(rules))["list"]
+    {'END'}
+    """
+    follow = {name: set() for name in rules}
+    changed = True
+    while changed:
+        changed = False
+        for name, alternatives in rules.items():
+            for alternative in alternatives:
+                for index, symbol in enumerate(alternative):
+                    if symbol not in rules:
+                        continue
+                    found = first_of(alternative[index + 1:], first)
+                    if None in found:
+                        found = (found - {None}) | follow[name]
+                    if not found <= follow[symbol]:
+                        follow[symbol] |= found
+                        changed = True
+    return follow
+
+def build_table(grammar = GRAMMAR):
+    """
+    Builds the parse table for grammar: a dict from each rule's name to a
+    dict from the next token's type to the alternative to expand the rule
+    to, reversed, ready to be pushed onto the parse stack. Raises
+    ValueError if the grammar isn't LL(1), that is if one token could
+    start two alternatives of the same rule.
+
+    >>> table = build_table()
+    >>> table["items"]["CHARACTER"]
+    ('items', 'CHARACTER')
+    >>> sorted(table["items"])
+    ['CHARACTER', 'EOF', 'INCLUDECOMMAND', 'MACROCOMMAND', 'PASSAGECOMMAND']
+    >>> build_table('<s> :== A B | A C')
+    Traceback (most recent call last):
+    ...
+    ValueError: grammar is not LL(1): 'A' could start <s> as either 'A B' or 'A C'
+    """
+    rules = read_grammar(grammar)
+    first = first_sets(rules)
+    follow = follow_sets(rules, first)
+    table = {name: {} for name in rules}
+    for name, alternatives in rules.items():
+        for alternative in alternatives:
+            found = first_of(alternative, first)
+            if None in found:
+                found = (found - {None}) | follow[name]
+            for token_type in found:
+                row = table[name]
+                if token_type in row:
+                    raise ValueError(f"grammar is not LL(1): {token_type!r} could start <{name}> "
+                                     f"as either {' '.join(reversed(row[token_type]))!r} "
+                                     f"or {' '.join(alternative)!r}")
+                row[token_type] = tuple(reversed(alternative))
+    return table
+
+TABLE = build_table()
+
+# what parse() looks up: for each rule and next token, the class of node
+# the rule makes, if any, and the alternative to push
+_ENTRIES = {name: {token_type: (NODES.get(name), alternative)
+                   for token_type, alternative in row.items()}
+            for name, row in TABLE.items()}
+
+def _tokens(tokenQueue):
+    """ the tokens in tokenQueue, a TokenStream or any iterable of tokens. """
+    if isinstance(tokenQueue, lexer.TokenStream):
+        return itertools.chain(tokenQueue.queue, tokenQueue.source)
+    return iter(tokenQueue)
+
+def _describe(token):
+    if token.token_type == "EOF":
+        return NAMES["EOF"]
+    return repr(token.match)
+
+def _expected(symbol):
+    allowed = TABLE[symbol] if symbol in TABLE else [symbol]
+    names = [name for token_type, name in NAMES.items() if token_type in allowed]
+    if len(names) == 1:
+        return names[0]
+    return ", ".join(names[:-1]) + " or " + names[-1]
+
+def parse(tokenQueue, symbols = None):
+    """
+    Parses a story from tokenQueue, returning its AST, or False (after
+    reporting why) if it doesn't parse. If symbols (a symbols.SymbolTable)
+    is given, every passage is added to it as it's parsed. Takes the same
+    arguments, and builds the same tree, as parser.parse().
+
+    >>> import parser, templater
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...          "\\\\passage{one} Go \\\\link{on}{two}. "
+    ...          "\\\\passage{two} \\\\link{\\\\link{in}{one}}{out}")
+    >>> def tokens():
+    ...     mylexer = lexer.Lexer(story)
+    ...     mylexer.lex()
+    ...     return mylexer.tokens
+    >>> ast = parse(tokens())
+    >>> ast.parts
+    [Passage('one'), Passage('two')]
+    >>> _link = ast.parts[1].body.items[0]
+    >>> _link, _link.text, _link.target
+    (Link('link'), Link('link'), Token('out', 'CHARACTER', 'out'))
+    >>> templater.visitTokens(ast) == templater.visitTokens(parser.parse(tokens()))
+    True
+
+    Nesting isn't limited by the recursion limit, here or in the templater.
+    >>> deep = lexer.Lexer(story + "\\\\link{Go}{" * 5000 + "one" + "}" * 5000)
+    >>> deep.lex()
+    >>> twee = templater.visitTokens(parse(deep.tokens))
+    >>> twee.endswith("[[in|one]]|out]]" + "[[Go|" * 5000 + "one" + "]]" * 5000)
+    True
+
+    >>> story = story.replace("\\\\ifid{I}", "")
+    >>> parse(tokens())
+    Parsing Error: Preamble not formatted correctly.
+    Parsing failed
+    False
+    >>> story = "\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} \\\\passage{one} a } b"
+    >>> parse(tokens())
+    Parsing Error: expected \\passage, \\include, a macro, text or the end of the story, not '}'
+    Parsing failed
+    False
+    """
+    table = _ENTRIES
+    tokens = _tokens(tokenQueue)
+    end = lexer.Token(value = "EOF", token_type = "EOF")
+    token = next(tokens, end)
+    kind = token.token_type
+    root = []
+    children = [root]  # the children of the nodes being built so far, innermost last
+    stack = ["story"]  # rules and token types still to match, and nodes to finish
+    pop = stack.pop
+    while stack:
+        top = pop()
+        if type(top) is not str:  # all of a node's rule has been matched
+            items = children.pop()
+            if type(top) is nodes.Argument:
+                continue  # already added to its macro
+            node = top.from_children(items)
+            children[-1].append(node)
+            if top is nodes.Passage:
+                if symbols is not None:
+                    symbols.add(node)
+            elif top is nodes.Macro:
+                arity = commands.COMMANDS[node.name].arity
+                if len(node.arguments) > arity:
+                    log.report(f"Parsing error: {node.command.match} takes {arity} argument"
+                               f"{'' if arity == 1 else 's'}, not {len(node.arguments)}")
+                    break
+            elif top is nodes.Preamble:
+                if sorted(_macro.name for _macro in node.macros) \
+                        != sorted(commands.required("preamble")):
+                    log.report("Parsing Error: Preamble not formatted correctly.")
+                    break
+            continue
+        row = table.get(top)
+        if row is None:  # a token type
+            if top != kind:
+                log.report(f"Parsing Error: expected {_expected(top)}, not {_describe(token)}")
+                break
+            if kind != "LEFTCURLY" and kind != "RIGHTCURLY" and kind != "EOF":
+                children[-1].append(token)
+            token = next(tokens, end)
+            kind = token.token_type
+            continue
+        entry = row.get(kind)
+        if entry is None:
+            log.report(f"Parsing Error: expected {_expected(top)}, not {_describe(token)}")
+            break
+        cls, alternative = entry
+        if cls is not None:
+            if cls is nodes.Argument:
+                cls = nodes.Argument()
+                children[-1].append(cls)
+                children.append(cls.items)
+            else:
+                children.append([])
+            stack.append(cls)
+        stack.extend(alternative)
+    else:
+        logger.info("Parsing complete")
+        return root[0]
+    log.report("Parsing failed")
+    return False
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,103 @@
+"""
+log.py
+
+Logging for the TweeTeX compiler. Each module logs to a child of the
+"tweetex" logger. Nothing is shown until configure() is called (tweetex.py
+does this from its -q/-v flags) or the program using the compiler sets
+up logging itself. There's one extra level,
+TRACE, below DEBUG, for messages about every single token or node;
+code in hot loops should check isEnabledFor(TRACE) once up front so
+that nothing gets formatted when tracing is off.
+
+    -q    QUIET     warnings only
+          DEFAULT   what the compiler did, eg "successfully wrote story to file"
+    -v    DEBUG     stages of the compile, and the AST
+    -vv   TRACE     every token and node
+
+Errors in the story being compiled (not formatted correctly, unknown
+commands) aren't logged: they're printed with report(), unless capture()
+is collecting them, which is how tweetex.compile_string keeps quiet.
+
+MIT License
+"""
+import contextlib
+import contextvars
+import logging
+import sys
+
+TRACE = 5
+logging.addLevelName(TRACE, "TRACE")
+
+QUIET = logging.WARNING
+DEFAULT = logging.INFO
+DEBUG = logging.DEBUG
+LEVELS = [DEFAULT, DEBUG, TRACE] # by number of -v flags
+
+# a library shouldn't print anything unless asked to
+logging.getLogger("tweetex").addHandler(logging.NullHandler())
+
+_captured = contextvars.ContextVar("captured", default = None)
+
+def getLogger(name):
+    """
+    >>> getLogger("parser").name
+    'tweetex.parser'
+    """
+    return logging.getLogger("tweetex." + name)
+
+def level(quiet = False, verbose = 0):
+    """
+    Works out the logging level for the command line flags.
+
+    >>> level(quiet = True) == QUIET
+    True
+    >>> level(verbose = 2) == TRACE
+    True
+    >>> level(verbose = 5) == TRACE
+    True
+    """
+    if quiet:
+        return QUIET
+    return LEVELS[min(verbose, len(LEVELS) - 1)]
+
+def configure(level = DEFAULT, stream = None):
+    """
+    Sends compiler messages at level and above to stream (stdout by default).
+    Calling this again replaces the earlier setup.
+    """
+    root = logging.getLogger("tweetex")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    root.addHandler(handler)
+    root.setLevel(level)
+    root.propagate = False
+
+def report(message):
+    """
+    Prints an error message about the story being compiled, or adds it to
+    the list that capture() is collecting in this thread.
+
+    >>> report("Parsing failed")
+    Parsing failed
+    >>> with capture() as messages:
+    ...     report("Parsing failed")
+    >>> messages
+    ['Parsing failed']
+    """
+    messages = _captured.get()
+    if messages is None:
+        print(message)
+    else:
+        messages.append(message)
+
+@contextlib.contextmanager
+def capture():
+    """ collects the messages passed to report() in a list, instead of printing them. """
+    messages = []
+    token = _captured.set(messages)
+    try:
+        yield messages
+    finally:
+        _captured.reset(token)
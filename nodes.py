@@ -0,0 +1,278 @@
+"""
+nodes.py
+
+The nodes of a TweeTeX AST. The leaves of the tree are the lexer's
+Tokens (CHARACTER tokens and the commands); everything above them is
+one of the classes here, which keep their parts in named fields, so a
+passage's title is _passage.title rather than _passage.children[1], and
+a link's target is link.target. They have __slots__ and no more fields
+than they need, so they're smaller than the Tokens the parser used to
+make for them.
+
+Every node still has the token_type of the Token it replaces, and a
+read-only children list of the nodes and tokens under it, each listed
+once, for code that walks the tree without caring what kind of node
+it's on (see astcache). from_children() makes a node back from that
+list. How many arguments a macro has is len(macro.arguments), not
+something to count in its children.
+
+MIT License
+"""
+
+class Node:
+    """
+    The base of the AST node classes. Nodes aren't tokens, so they have no
+    value, match or position in the source.
+    """
+    __slots__ = ()
+    token_type = None
+    value = None
+    match = None
+    source = None
+    start = None
+    end = None
+    leaf = False
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+class Argument(Node):
+    """
+    The arguments of a macro, \\passage or preamble macro: items holds what
+    was between each pair of braces, a CHARACTER token or a Macro. A macro
+    with two arguments has one Argument with two items.
+
+    >>> import lexer
+    >>> argument = Argument([lexer.Token("Go", "CHARACTER", "Go")])
+    >>> argument.text
+    'Go'
+    """
+    __slots__ = ("items",)
+    token_type = "ARGUMENT"
+
+    def __init__(self, items = None):
+        self.items = [] if items is None else items
+
+    @property
+    def text(self):
+        """ the text of the arguments, leaving out any macros in them. """
+        items = self.items
+        if len(items) == 1 and not isinstance(items[0], Node):  # the usual case
+            return items[0].value
+        return "".join([item.value for item in items if not isinstance(item, Node)])
+
+    @property
+    def children(self):
+        return self.items
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children)
+
+class Macro(Node):
+    """ a macro in a passage's text or in an argument: its command token and arguments. """
+    __slots__ = ("command", "argument")
+    token_type = "MACRO"
+
+    def __init__(self, command, argument):
+        self.command = command
+        self.argument = argument
+
+    @property
+    def name(self):
+        return self.command.value
+
+    @property
+    def arguments(self):
+        return self.argument.items
+
+    @property
+    def children(self):
+        return [self.command, self.argument]
+
+    @classmethod
+    def from_children(cls, children):
+        return make_macro(children[0], children[1])
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r})"
+
+class Link(Macro):
+    """
+    A \\link macro. text is its first argument and target its second, the
+    title of the passage it goes to, or None if it only has one.
+
+    >>> import lexer
+    >>> link = make_macro(lexer.Token("link", "MACROCOMMAND", "\\\\link"),
+    ...                   Argument([lexer.Token("Go", "CHARACTER", "Go"),
+    ...                             lexer.Token("two", "CHARACTER", "two")]))
+    >>> link, link.text, link.target
+    (Link('link'), Token('Go', 'CHARACTER', 'Go'), Token('two', 'CHARACTER', 'two'))
+    >>> link.children
+    [Token('link', 'MACROCOMMAND', '\\link'), Argument()]
+    """
+    __slots__ = ()
+
+    @property
+    def text(self):
+        return self.argument.items[0]
+
+    @property
+    def target(self):
+        items = self.argument.items
+        return items[1] if len(items) > 1 else None
+
+MACROS = {"link": Link}
+
+def make_macro(command, argument):
+    """ the Macro for command: a Link for \\link, or a plain Macro. """
+    return MACROS.get(command.value, Macro)(command, argument)
+
+class Text(Node):
+    """
+    the text of a passage: CHARACTER tokens and Macros, in order. Text after
+    a stray brace starts a new line, so it's a Text of its own in the items.
+    """
+    __slots__ = ("items",)
+    token_type = "TEXT"
+
+    def __init__(self, items = None):
+        self.items = [] if items is None else items
+
+    @property
+    def children(self):
+        return self.items
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children)
+
+class Passage(Node):
+    """
+    A passage: its \\passage command token, its title (an Argument) and
+    its body (a Text).
+    """
+    __slots__ = ("command", "title", "body")
+    token_type = "PASSAGE"
+
+    def __init__(self, command, title, body):
+        self.command = command
+        self.title = title
+        self.body = body
+
+    @property
+    def name(self):
+        """ the title of the passage, as text. """
+        return self.title.text
+
+    @property
+    def children(self):
+        return [self.command, self.title, self.body]
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children[0], children[1], children[2])
+
+    def __repr__(self):
+        return f"Passage({self.name!r})"
+
+class Include(Node):
+    """
+    An \\include: its command token, its argument (the name of the file)
+    and, once the includes library has read the file, the passages and
+    includes in it.
+    """
+    __slots__ = ("command", "argument", "parts")
+    token_type = "INCLUDE"
+
+    def __init__(self, command, argument, parts = None):
+        self.command = command
+        self.argument = argument
+        self.parts = [] if parts is None else parts
+
+    @property
+    def children(self):
+        return [self.command, self.argument] + self.parts
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children[0], children[1], children[2:])
+
+    def __repr__(self):
+        return f"Include({self.argument.text!r})"
+
+class PreambleMacro(Node):
+    """ one macro of the preamble: its command token and its argument. """
+    __slots__ = ("command", "argument")
+    token_type = "PREAMBLEMACRO"
+
+    def __init__(self, command, argument):
+        self.command = command
+        self.argument = argument
+
+    @property
+    def name(self):
+        return self.command.value
+
+    @property
+    def children(self):
+        return [self.command, self.argument]
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children[0], children[1])
+
+    def __repr__(self):
+        return f"PreambleMacro({self.name!r})"
+
+class Preamble(Node):
+    """ the preamble: a list of PreambleMacros. """
+    __slots__ = ("macros",)
+    token_type = "PREAMBLE"
+
+    def __init__(self, macros = None):
+        self.macros = [] if macros is None else macros
+
+    @property
+    def children(self):
+        return self.macros
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children)
+
+class Story(Node):
+    """ a whole story: its Preamble, then its Passages and Includes. """
+    __slots__ = ("preamble", "parts")
+    token_type = "STORY"
+
+    def __init__(self, preamble, parts = None):
+        self.preamble = preamble
+        self.parts = [] if parts is None else parts
+
+    @property
+    def children(self):
+        return [self.preamble] + self.parts
+
+    @classmethod
+    def from_children(cls, children):
+        return cls(children[0], children[1:])
+
+def passages(story):
+    """ the Passages of story in order, with those in included files where they were included. """
+    parts = list(reversed(story.parts))
+    while parts:
+        part = parts.pop()
+        if type(part) is Include:
+            parts.extend(reversed(part.parts))
+        else:
+            yield part
+
+# the node class for each token type
+CLASSES = {cls.token_type: cls for cls in
+           (Argument, Macro, Text, Passage, Include, PreambleMacro, Preamble, Story)}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
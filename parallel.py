@@ -0,0 +1,132 @@
+"""
+parallel.py
+
+Compiles one big story on several cores. Once the preamble is out of
+the way, every passage lexes, parses and turns into Twee without
+looking at any other passage, so the story is split at its \\passage
+commands (see incremental.split) and the passages are handed out in
+chunks to a pool of worker processes. Each worker sends back the Twee
+code for its chunk, and the chunks are joined in source order, which
+gives exactly what the serial compiler writes. The workers also send
+back the symbols.summary() of each passage, so the links between them
+are checked in the main process, as the serial compiler checks them.
+
+MIT License
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import incremental
+import log
+import symbols
+import templater
+
+logger = log.getLogger("parallel")
+
+CHUNKS_PER_WORKER = 4 # more than one, so a slow chunk doesn't hold the rest up
+
+def compile_chunk(sources):
+    """
+    Compiles a list of passage sources to Twee, for a worker process.
+    Returns the Twee code for all of them and a list of their
+    symbols.summary(), or False if one doesn't parse.
+    """
+    output = []
+    summaries = []
+    for source in sources:
+        _passage = incremental.passage(source)
+        if _passage == False:
+            log.report("Parsing Error: passage not formatted correctly.")
+            return False
+        output.append(templater.visitTokens(_passage))
+        summaries.append(symbols.summary(_passage))
+    return "".join(output), summaries
+
+def chunked(items, count):
+    """
+    Splits items into at most count runs of nearly equal length, in order.
+
+    >>> chunked(list(range(7)), 3)
+    [[0, 1, 2], [3, 4], [5, 6]]
+    >>> chunked([1], 4)
+    [[1]]
+    """
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    runs = []
+    start = 0
+    for index in range(count):
+        end = start + size + (index < extra)
+        runs.append(items[start:end])
+        start = end
+    return runs
+
+def compile_story(source, workers = None):
+    """
+    Compiles the story in source on workers processes (one per core by
+    default) and returns its Twee code, or False if it doesn't parse.
+
+    >>> import lexer, parser
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{p0} " +
+    ...          " ".join(f"\\\\passage{{p{n}}} Hi {n}. \\\\link{{Go}}{{p{n + 1}}}" for n in range(20)))
+    >>> mylexer = lexer.Lexer(story)
+    >>> mylexer.lex()
+    >>> compile_story(story, workers = 2) == templater.visitTokens(parser.parse(mylexer.tokens))
+    True
+    >>> compile_story("\\\\title{T} \\\\passage{one} Hi.", workers = 2)
+    Parsing Error: Preamble not formatted correctly.
+    False
+
+    Links are checked as they are by the serial compiler.
+    >>> import logging, sys
+    >>> handler = logging.StreamHandler(sys.stdout)
+    >>> logging.getLogger("tweetex").addHandler(handler)
+    >>> _ = compile_story(story.replace("{p20}", "{p30}"), workers = 2)
+    line 1, column 718: link to missing passage 'p30'
+    >>> logging.getLogger("tweetex").removeHandler(handler)
+    """
+    workers = workers or os.cpu_count() or 1
+    preamble_source, passage_sources = incremental.split(source)
+    if not passage_sources:
+        log.report("Parsing Error: story has no passages.")
+        return False
+    _preamble = incremental.preamble(preamble_source)
+    if _preamble == False:
+        log.report("Parsing Error: Preamble not formatted correctly.")
+        return False
+    output = [templater.visitTokens(_preamble)]
+    summaries = []
+    chunks = chunked(passage_sources, workers * CHUNKS_PER_WORKER)
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(compile_chunk, chunks)
+            for result in results:
+                if result == False:
+                    return False
+                output.append(result[0])
+                summaries += result[1]
+    else:
+        for chunk in chunks:
+            result = compile_chunk(chunk)
+            if result == False:
+                return False
+            output.append(result[0])
+            summaries += result[1]
+    incremental.check(source, _preamble, summaries,
+                      incremental.starts(preamble_source, passage_sources))
+    logger.info("compiled %d passages on %d processes", len(passage_sources), workers)
+    return "".join(output)
+
+def compile_file(filename, outname, workers = None):
+    """
+    Compiles the story in the file called filename on workers processes
+    and writes its Twee code to outname. Returns the Twee code, or False
+    if parsing failed.
+    """
+    with open(filename, encoding = "utf-8") as file:
+        result = compile_story(file.read(), workers)
+    if result != False:
+        with open(outname, "w", encoding = "utf-8") as file:
+            file.write(result)
+        logger.info("successfully wrote story to file")
+    return result
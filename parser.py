@@ -9,19 +9,26 @@ function repeatedly calls subsequent function until each piece of the
 input is matched to a terminal symbol in the grammar.
 
 In the TweeTeX compiler, this parser takes the output of the Lexer library
-as input and returns an abstract syntax tree, or AST. The tree is built of
-Token objects, which are defined in the Lexer library, and each Token object
-is a node in the tree. A branch on the tree terminates when the Token object
-has no children. Each of the functions below should create at least one branch
-for the tree, and branches are added by subsequent function calls.
+as input and returns an abstract syntax tree, or AST. The leaves of the tree
+are the Token objects made by the Lexer library, and the nodes above them are
+the classes in the nodes library (Story, Passage, Link and so on), which
+keep their parts in named fields. Each of the functions below should create
+at least one branch for the tree, and branches are added by subsequent
+function calls.
+
+A file named by an \include holds <part>* (see parts), and is read by the
+includes library rather than here. The commands, and how many arguments each
+macro takes, come from the commands library.
 
 spec:
 
-<story> :== <preamble> <passage>+
+<story> :== <preamble> <part>+
+<part> :== <passage> | <include>
+<include> :== "\include" <argument>
 <preamble> :== "\" <preamblecommand> <argument> {"\" <preamblecommand> <argument>}
 <macro> :== "\" <macrocommand>  <argument>*
 <preamblecommand> :== "start" | "author" | "title" | "ifid"
-<macrocommand> :== "link"
+<macrocommand> :== "link" | "goto" | "set" | "if"
 <passage> :== "\passage" { <argument> } <text>
 <char> :== [^\\\{\}]
 <argument> :== "{" (<char>+ | <macro>) "}"
@@ -29,7 +36,12 @@ spec:
 
 Nick Creel | Feb 5 2020 | MIT License
 """
+import commands
 import lexer #we need this mostly for the Token object, and testing.
+import log
+import nodes
+
+logger = log.getLogger("parser")
 
 def make_test_queue(kind):
 	"""
@@ -88,6 +100,8 @@ def make_test_queue(kind):
 		teststory = r"link{link_text}"
 	elif kind == "argumentpass":
 		teststory = r"{argument}"
+	elif kind == "argumentmacro":
+		teststory = r"{\link{inner}{innertarget}}{target}"
 	elif kind == "argumentfail":
 		teststory = "{\start{start}}"
 	elif kind == "textpass":
@@ -131,49 +145,127 @@ def next_token(tokenQueue):
 	else:
 		raise Exception("Token queue is None, parsing error.")
 
-def parse(tokenQueue):
+def peek_token(tokenQueue):
+	"""
+	Like next_token, but leaves the token at the front of the queue.
+
+	>>> peek_token(lexer.TokenStream())
+	Token('EOF', 'EOF', 'None')
+	>>> tokenQueue = make_test_queue("macropass")
+	>>> peek_token(tokenQueue)
+	Token('link', 'MACROCOMMAND', '\\link')
+	>>> len(tokenQueue)
+	4
+	"""
+	if tokenQueue.isEmpty():
+		return lexer.Token(value = "EOF", token_type = "EOF")
+	if tokenQueue != None:
+		return tokenQueue.peek()
+	else:
+		raise Exception("Token queue is None, parsing error.")
+
+def parse(tokenQueue, symbols = None):
 	"""
 	This function creates the abstract syntax tree by calling the story function.
 	If the story is parsed successfully, then ast evaluates to True and the ast
-	is returned. Otherwise, parse returns False.
+	is returned. Otherwise, parse returns False. If symbols (a symbols.SymbolTable)
+	is given, every passage is added to it as it's parsed.
 	"""
-	ast = story(tokenQueue)
+	ast = story(tokenQueue, symbols)
 	if ast != False:
-		print("Parsing complete")
+		logger.info("Parsing complete")
 		return ast
 	else:
-		print("Parsing failed")
+		log.report("Parsing failed")
 		return False
 
-def story(tokenQueue):
+def story(tokenQueue, symbols = None):
 	"""
 	The story function takes a token queue as input and returns a token if parsing
-	is successful or False otherwise.
+	is successful or False otherwise. Each passage is added to symbols, if given.
 	>>> tokenQueue = make_test_queue("storypass")
 	>>> _story = story(tokenQueue)
 	>>> _story
-	Token('None', 'STORY', 'None')
+	Story()
+	>>> _story.parts
+	[Passage('first'), Passage('second')]
 
 	"""
-	_story = lexer.Token(token_type = "STORY")
 	_preamble, tokenQueue = preamble(tokenQueue) #get the preamble
 	#debug... print(tokenQueue)
 
 	if _preamble == False: 	# if the preamble is NOT correctly formatted...
 		#stop right here!
-		print("Parsing Error: Preamble not formatted correctly.")
+		log.report("Parsing Error: Preamble not formatted correctly.")
 		return False
 	else:										# if preamble is correctly formatted,
-		_story.children.append(_preamble)        # append the preamble to the story tree.
-		passages = []							# used to store all passages
-		while tokenQueue.queue[0].token_type != "EOF":
-			print('passages:',passages)
-			_passage, tokenQueue = passage(tokenQueue)    # get passage
-			passages.append(_passage)		    # add passage to passage list
-		for pas in passages:					# for each passage...
-			_story.children.append(pas)			# append passage to story tree
+		passages = parts(tokenQueue, symbols)	# all the passages and includes
+		if passages == False:
+			return False
+		_story = nodes.Story(_preamble, passages)	# the preamble, then the passages
 	return _story
 
+def parts(tokenQueue, symbols = None):
+	"""
+	Parses passages and includes up to the end of the token queue, and returns a list
+	of them, or False if one of them doesn't parse. Each passage is added to symbols,
+	if given.
+
+	>>> testlex = lexer.Lexer(r"\passage{one} Hi. \include{chapter.twx} \passage{two}")
+	>>> testlex.lex()
+	>>> parts(testlex.tokens)
+	[Passage('one'), Include('chapter.twx'), Passage('two')]
+
+	>>> testlex = lexer.Lexer(r"Hi. \passage{one}")
+	>>> testlex.lex()
+	>>> parts(testlex.tokens)
+	Parsing Error: expected \passage or \include, not 'Hi. '
+	False
+
+	Only the start of a long stray run of text is shown.
+	>>> testlex = lexer.Lexer("x" * 1000)
+	>>> testlex.lex()
+	>>> parts(testlex.tokens)
+	Parsing Error: expected \passage or \include, not 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx...'
+	False
+	"""
+	_parts = []
+	while peek_token(tokenQueue).token_type != "EOF":
+		parse_part = PARTS.get(peek_token(tokenQueue).token_type)
+		if parse_part is None:
+			found = peek_token(tokenQueue).match
+			if len(found) > SNIPPET:
+				found = found[:SNIPPET] + "..."
+			log.report(f"Parsing Error: expected \\passage or \\include, not {found!r}")
+			return False
+		_part, tokenQueue = parse_part(tokenQueue)
+		if _part == False:
+			return False
+		if symbols is not None and type(_part) is nodes.Passage:
+			symbols.add(_part)						# index it by title
+		_parts.append(_part)
+	return _parts
+
+def include(tokenQueue):
+	"""
+	Parses an include, returning a tuple containing an Include node, with the include
+	command and its argument (the name of the file), and the token queue.
+
+	>>> testlex = lexer.Lexer(r"\include{chapter.twx}")
+	>>> testlex.lex()
+	>>> _include, tokenQueue = include(testlex.tokens)
+	>>> _include.command
+	Token('include', 'INCLUDECOMMAND', '\include')
+	>>> _include.argument.items
+	[Token('chapter.twx', 'CHARACTER', 'chapter.twx')]
+	"""
+	command = next_token(tokenQueue)
+	_argument, tokenQueue = argument(tokenQueue)
+	if _argument == False or len(_argument.items) != 1:
+		log.report("Parsing error: argument for include not formatted correctly")
+		return (False, None)
+	return (nodes.Include(command, _argument), tokenQueue)
+
 def preamble(tokenQueue):
 	"""
 	The preamble function takes a token queue as input and returns a tuple containing a
@@ -184,22 +276,22 @@ def preamble(tokenQueue):
 	>>> tokenQueue
 	[Token('passage', 'PASSAGECOMMAND', '\passage'), Token('{', 'LEFTCURLY', '{'), Token('start', 'CHARACTER', 'start'), Token('}', 'RIGHTCURLY', '}')]
 	>>> _preamble
-	Token('None', 'PREAMBLE', 'None')
-	>>> _preamble.children[0]
-	Token('None', 'PREAMBLEMACRO', 'None')
-	>>> _preamble.children[0].children[0]
+	Preamble()
+	>>> _preamble.macros[0]
+	PreambleMacro('author')
+	>>> _preamble.macros[0].command
 	Token('author', 'PREAMBLECOMMAND', '\\author')
 	"""
 
-	preamble_commands = ["title", "author", "ifid", "start"]
-	_preamble = lexer.Token(token_type = "PREAMBLE") 	# make preamble token
+	preamble_commands = commands.required("preamble")
+	_preamble = nodes.Preamble() 						# make preamble node
 	while True:											# break this loop with returns
 		token = next_token(tokenQueue)				 	# grab a token
-		if token.token_type == "PASSAGECOMMAND" and preamble_commands == []:
+		if token.token_type in ["PASSAGECOMMAND", "INCLUDECOMMAND"] and preamble_commands == []:
 			#this should only execute if all preamble macros found...
 			tokenQueue.put(token)
 			return(_preamble, tokenQueue)
-		elif token.token_type == "PASSAGECOMMAND" and preamble_commands != []:
+		elif token.token_type in ["PASSAGECOMMAND", "INCLUDECOMMAND"] and preamble_commands != []:
 			#if we reach a passage before we have all the required preamble commands...
 			return(False, None)
 		elif token.value not in preamble_commands or token.token_type != "PREAMBLECOMMAND":
@@ -211,7 +303,7 @@ def preamble(tokenQueue):
 			if _premacro == False:
 				return(False, None)
 			else:
-				_preamble.children.append(_premacro)
+				_preamble.macros.append(_premacro)
 
 def preamblemacro(token, tokenQueue):
 	"""
@@ -221,8 +313,8 @@ def preamblemacro(token, tokenQueue):
 	>>> token = next_token(testqueue)
 	>>> _premacro, tokenQueue = preamblemacro(token, testqueue)
 	>>> _premacro
-	Token('None', 'PREAMBLEMACRO', 'None')
-	>>> _premacro.children[0]
+	PreambleMacro('start')
+	>>> _premacro.command
 	Token('start', 'PREAMBLECOMMAND', '\start')
 
 	>>> testqueue = make_test_queue("preamblemacrofail")
@@ -240,38 +332,35 @@ def preamblemacro(token, tokenQueue):
 	>>> _premacro
 	False
 	"""
-	_preamblemacro = lexer.Token(token_type =  "PREAMBLEMACRO")
 	if token.token_type != "PREAMBLECOMMAND":
-		print("Parsing error: macro token not of type PREAMBLECOMMAND")
+		log.report("Parsing error: macro token not of type PREAMBLECOMMAND")
 		return (False, None)
 	else:
-		_preamblemacro.children.append(token)
 		_argument, tokenQueue = argument(tokenQueue)
-		#print("argument is ",_argument[0].children[0])
-		if len(_argument) == 1:
+		if _argument != False and len(_argument.items) == 1:
 			#preamble macro should only have one argument
-			_preamblemacro.children.append(_argument[0])
+			_preamblemacro = nodes.PreambleMacro(token, _argument)
 		else:
-			print("Parsing error: argument for preamble macro not formatted correctly")
+			log.report("Parsing error: argument for preamble macro not formatted correctly")
 			return(False, None)
-	#print("returning preamble macro")
-	#print(f"_preamblemacro is {_preamblemacro}")
 	return(_preamblemacro, tokenQueue)
 
 def passage(tokenQueue):
 	"""
 	This function takes a token queue as input and returns a tuple containing
-	a token and a token queue.
+	a Passage node and a token queue.
 	>>> tokenQueue = make_test_queue("passage")
 	>>> _passage, tokenQueue = passage(tokenQueue)
 	>>> tokenQueue
 	[Token('EOF', 'EOF', 'None')]
 	>>> _passage
-	Token('None', 'PASSAGE', 'None')
+	Passage('test')
 
 	Recall that the first component of a passage is the passage command.
-	>>> _passage.children[0]
+	>>> _passage.command
 	Token('passage', 'PASSAGECOMMAND', '\passage')
+	>>> _passage.body.items
+	[Token('This is some text in a passage. ', 'CHARACTER', 'This is some text in a passage. '), Link('link')]
 
 	Passages can be followed by other passages.
 	>>> tokenQueue = make_test_queue("passage2")
@@ -281,40 +370,45 @@ def passage(tokenQueue):
 	>>> tokenQueue
 	[Token('passage', 'PASSAGECOMMAND', '\passage'), Token('{', 'LEFTCURLY', '{'), Token('second', 'CHARACTER', 'second'), Token('}', 'RIGHTCURLY', '}')]
 	>>> _passage
-	Token('None', 'PASSAGE', 'None')
+	Passage('first')
+
+	A stray brace is dropped, and the text after it starts a new line.
+	>>> testlex = lexer.Lexer(r"\passage{a} foo } bar")
+	>>> testlex.lex()
+	>>> _passage, tokenQueue = passage(testlex.tokens)
+	>>> _passage.body.items
+	[Token('foo ', 'CHARACTER', 'foo '), Text()]
 	"""
-	token = next_token(tokenQueue)
-	#print("tokenQueue after getting next token in passage:", tokenQueue)
-	_passage = lexer.Token(token_type = "PASSAGE")
-	_passage.children.append(token)
+	command = next_token(tokenQueue)
 	_argument, tokenQueue = argument(tokenQueue) #get arguments (right now just psgtitle)
-	#print("tokenQueue after running argument in passage:", tokenQueue)
 	if _argument == False:
 		return(False, None)
-	elif len(_argument) == 1:
-		_passage.children.append(_argument[0])
-	else:
-		for i in _argument:
-			_passage.children.append(i)
+	body = None
 	token = lexer.Token()
-	while token.token_type != "EOF" and token.token_type !="PASSAGECOMMAND":
+	while token.token_type not in ["EOF", "PASSAGECOMMAND", "INCLUDECOMMAND"]:
 			_text, tokenQueue = text(tokenQueue)
-			#print("tokenQueue in while loop of passage:", tokenQueue)
 			if _text:
-				_passage.children.append(_text)
+				if body is None:
+					body = _text
+				else:
+					# text stopped at a stray brace, which is dropped, and the text
+					# after it starts a new line, as its own Text
+					body.items.append(_text)
 				token = next_token(tokenQueue)
-				#print(token)
 			else:
-				print("Parsing error: text in passage not correctly formatted")
+				log.report("Parsing error: text in passage not correctly formatted")
 				return (False, None)
-	#print(token)
 	tokenQueue.put(token)
-	return (_passage, tokenQueue)
+	return (nodes.Passage(command, _argument, body), tokenQueue)
+
+# what parts() parses for each command a part can start with
+PARTS = {"PASSAGECOMMAND": passage, "INCLUDECOMMAND": include}
+SNIPPET = 40	# characters of stray text shown in an error
 
 def macro(token, tokenQueue):
 	"""
 	This function takes a token and a token queue as input and returns a tuple containing
-	a token queue and a token input.
+	a Macro node (a Link, for \\link) and a token queue.
 
 	>>> _token = None
 	>>> _macro = None
@@ -323,14 +417,23 @@ def macro(token, tokenQueue):
 	>>> _token = next_token(tokenQueue)
 	>>> _macro, tokenQueue = macro(_token, tokenQueue)
 	>>> _macro
-	Token('None', 'MACRO', 'None')
+	Link('link')
 
 	>>> tokenQueue
 	[Token('EOF', 'EOF', 'None')]
 
 	Recall that the test macro is the link macro.
-	>>> _macro.children[0]
+	>>> _macro.command
 	Token('link', 'MACROCOMMAND', '\link')
+	>>> _macro.text, _macro.target
+	(Token('link_text', 'CHARACTER', 'link_text'), None)
+
+	A macro can't have more arguments than the commands library says it takes.
+	>>> testlex = lexer.Lexer(r"\goto{one}{two}")
+	>>> testlex.lex()
+	>>> macro(next_token(testlex.tokens), testlex.tokens)
+	Parsing error: \goto takes 1 argument, not 2
+	(False, None)
 
 	Macro cannot handle a preamblemacro.
     >>>	tokenQueue = make_test_queue("preamblemacropass")
@@ -338,52 +441,52 @@ def macro(token, tokenQueue):
 	>>> _macro, tokenQueue = macro(_token, tokenQueue)
 	Parsing error: macro token not of type MACROCOMMAND
 	"""
-	_macro = lexer.Token(token_type =  "MACRO")
 	if token.token_type != "MACROCOMMAND":
-		print("Parsing error: macro token not of type MACROCOMMAND")
+		log.report("Parsing error: macro token not of type MACROCOMMAND")
 		return (False, None)
 	else:
-		_macro.children.append(token)
 		_argument, tokenQueue = argument(tokenQueue)
-		if len(_argument) == 1:
-			_macro.children.append(_argument[0])
-		elif len(_argument) > 1:
-			for i in _argument:
-				_macro.children.append(i)
-		else:
-			print("Parsing error: argument for macro not formatted correctly")
+		if _argument == False: 		# the argument didn't parse
+			log.report("Parsing error: argument for macro not formatted correctly")
+			return(False, None)
+		arity = commands.COMMANDS[token.value].arity
+		if len(_argument.items) > arity:
+			log.report(f"Parsing error: {token.match} takes {arity} argument"
+					   f"{'' if arity == 1 else 's'}, not {len(_argument.items)}")
 			return(False, None)
-	return(_macro, tokenQueue)
+	return(nodes.make_macro(token, _argument), tokenQueue)
 
 def argument(tokenQueue):
 	"""
-	This function takes a token queue as input and returns a tuple containing a list of
-	tokens (which may be length 1) and a token queue.
+	This function takes a token queue as input and returns a tuple containing an
+	Argument node and a token queue. One Argument holds all of the arguments in a row,
+	so \\link{text}{target} has one Argument with two items.
 
 	>>> _argument, tokenQueue = argument(make_test_queue("argumentpass"))
 	>>> _argument
-	[Token('None', 'ARGUMENT', 'None')]
+	Argument()
 
 	>>> tokenQueue
 	[Token('EOF', 'EOF', 'None')]
 
-	The list _argument contains a list of the ARGUMENT type tokens.
-	>>> _argument[0]
-	Token('None', 'ARGUMENT', 'None')
+	The items of the Argument are the actual arguments contained in curly braces.
+	>>> _argument.items
+	[Token('argument', 'CHARACTER', 'argument')]
 
-	Each token in this list should have children, which are the actual arguments
-	contained in curly braces.
-	>>> _argument[0].children[0]
-	Token('argument', 'CHARACTER', 'argument')
+	An argument can be a macro.
+	>>> _argument, tokenQueue = argument(make_test_queue("argumentmacro"))
+	>>> _argument.items
+	[Link('link'), Token('target', 'CHARACTER', 'target')]
+	>>> _argument.items[0].arguments
+	[Token('inner', 'CHARACTER', 'inner'), Token('innertarget', 'CHARACTER', 'innertarget')]
 
 	A preamble macro cannot be an argument.
 	>>> _argument, tokenQueue = argument(make_test_queue("argumentfail"))
 	Parsing Error: argument provided is not a valid argument type.
 	"""
 
-	_argument = lexer.Token(token_type = "ARGUMENT")
+	_argument = nodes.Argument()
 	token = next_token(tokenQueue)
-	arguments = []
 
 	if token.token_type == "LEFTCURLY":
 		pass
@@ -393,37 +496,40 @@ def argument(tokenQueue):
 	while token.token_type == "LEFTCURLY":
 		anothertoken = next_token(tokenQueue)
 		if anothertoken.token_type == "CHARACTER":
-			_argument.children.append(anothertoken)
+			_argument.items.append(anothertoken)
 			anothertoken = next_token(tokenQueue)
 			if anothertoken.token_type == "RIGHTCURLY":
-				arguments.append(_argument)
 				token = next_token(tokenQueue)
 			else:
 				return (False, None)
 		elif anothertoken.token_type == "MACROCOMMAND":
-			_macro, tokenQueue = macro(token, tokenQueue)
-			#print(_macro.children)
-			_argument.children.append(_macro)
-			if _argument:
-				return(_argument, tokenQueue)
+			_macro, tokenQueue = macro(anothertoken, tokenQueue)
+			if _macro == False:
+				return (False, None)
+			_argument.items.append(_macro)
+			anothertoken = next_token(tokenQueue)
+			if anothertoken.token_type == "RIGHTCURLY":
+				token = next_token(tokenQueue)
+			else:
+				return (False, None)
 		else:
-			print("Parsing Error: argument provided is not a valid argument type.")
+			log.report("Parsing Error: argument provided is not a valid argument type.")
 			return(False, None)
 	tokenQueue.put(token)
-	return(arguments, tokenQueue)
+	return(_argument, tokenQueue)
 
 def text(tokenQueue):
 	"""
 	Takes a tokenQueue as input. If next token is a character or a command, then
-	returns a tuple with a 'TEXT' token and the original token queue. Processes all of
+	returns a tuple with a Text node and the original token queue. Processes all of
 	the text in a passage until a new passage is reached, or until EOF.
 
 	>>> _text, tokenQueue = text(make_test_queue("textpass"))
 	>>> _text
-	Token('None', 'TEXT', 'None')
+	Text()
 
 	Recall that make_test_queue makes the first token a character string.
-	>>> _text.children[0]
+	>>> _text.items[0]
 	Token('This is some text in a passsage. ', 'CHARACTER', 'This is some text in a passsage. ')
 
 	Text cannot contain preamble macros.
@@ -432,21 +538,23 @@ def text(tokenQueue):
 	>>> _text
 	False
 	"""
-	_text = lexer.Token(token_type = "TEXT")
+	_text = nodes.Text()
+	items = _text.items
+	trace = logger.isEnabledFor(log.TRACE)
 	token = next_token(tokenQueue)
 	while token.token_type != "PASSAGECOMAMAND" and token.token_type != "EOF":
 		if token.token_type == "CHARACTER":
-			print('text token contents:', token.value)
-			_text.children.append(token)
+			if trace:
+				logger.log(log.TRACE, "text token contents: %s", token.value)
+			items.append(token)
 		elif token.token_type == "MACROCOMMAND":
 			_macro, tokenQueue = macro(token, tokenQueue)
-			#print(f"_macro is {_macro}")
 			if _macro != False:
-				_text.children.append(_macro)
+				items.append(_macro)
 			else:
 				return(False, None)
 		elif token.token_type == "PREAMBLECOMMAND":
-			print("Parsing failed: preamble command in passage text")
+			log.report("Parsing failed: preamble command in passage text")
 			return(False, None)
 		else:
 			tokenQueue.put(token)
@@ -459,5 +567,3 @@ def text(tokenQueue):
 if __name__ == "__main__":
 	import doctest
 	doctest.testmod()
-
-
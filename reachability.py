@@ -0,0 +1,200 @@
+"""
+reachability.py
+
+The passage link graph of a story, and which passages a player can get
+to from its \\start passage. Reachability makes the graph in one pass
+over the passages, from the target of every \\link (and \\goto, see
+symbols.links), and finds what can be reached from the start with a
+breadth-first search, so both take time in proportion to the number of
+passages and links. It also finds the cycles in the graph, as its
+strongly connected components.
+
+prune() makes a copy of a story without the passages that can't be
+reached, so they're never templated; tweetex.py does this with
+--prune-unreachable. A link whose target is made by another macro can't
+be followed, so a passage that is only reached that way is pruned too.
+
+MIT License
+"""
+from collections import deque
+
+import log
+import nodes
+import symbols
+
+logger = log.getLogger("reachability")
+
+# passages SugarCube uses without a link to them, which are always kept
+SPECIAL = {"StoryInit", "StoryInterface", "StoryBanner", "StorySubtitle", "StoryAuthor",
+           "StoryCaption", "StoryMenu", "StoryDisplayTitle", "StoryShare",
+           "PassageReady", "PassageDone", "PassageHeader", "PassageFooter"}
+
+class Reachability:
+    """
+    The link graph of story: edges maps the title of every passage to the
+    titles it links to (which might not exist), and reachable is the set
+    of titles that can be reached from the start passage or a SPECIAL one.
+
+    >>> import lexer, parser
+    >>> mylexer = lexer.Lexer("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{a} "
+    ...                       "\\\\passage{a} \\\\link{On}{b} \\\\passage{b} \\\\link{Back}{a} \\\\goto{c} "
+    ...                       "\\\\passage{c} The end. \\\\passage{d} \\\\link{Loop}{d} \\\\link{To}{e} "
+    ...                       "\\\\passage{e} \\\\link{Loop}{d} \\\\passage{StoryInit} \\\\set{$x}{1}")
+    >>> mylexer.lex()
+    >>> story = parser.parse(mylexer.tokens)
+    >>> graph = Reachability(story)
+    >>> sorted(graph.edges["b"])
+    ['a', 'c']
+    >>> sorted(graph.reachable)
+    ['StoryInit', 'a', 'b', 'c']
+    >>> graph.unreachable
+    ['d', 'e']
+    >>> graph.cycles()
+    [['a', 'b'], ['d', 'e']]
+    >>> print(graph.report())
+    4 of 6 passages are reachable from 'a'; 2 are not
+    2 cycles, the largest of 2 passages
+    >>> prune(story, graph.reachable).parts
+    [Passage('a'), Passage('b'), Passage('c'), Passage('StoryInit')]
+
+    The graph SymbolTable.check() finds is the same.
+    >>> import symbols
+    >>> table = symbols.SymbolTable()
+    >>> for _passage in story.parts:
+    ...     table.add(_passage)
+    >>> table.check(story)
+    True
+    >>> Reachability(story, table.edges).edges == graph.edges
+    True
+    """
+
+    def __init__(self, story, links = None):
+        """
+        links, if given, is the link graph of story as SymbolTable.check()
+        leaves it in edges, so the links don't have to be found again.
+        """
+        self.start = None
+        for macro in story.preamble.macros:
+            if macro.name == "start":
+                self.start = macro.argument.text
+        self.edges = edges = {}
+        for _passage in nodes.passages(story):
+            title = _passage.name
+            if links is not None:
+                edges[title] = links.get(title, [])
+                continue
+            # passages with the same title are one node, with all their links
+            targets = edges.setdefault(title, [])
+            targets += [target.value for _command, target in symbols.links(_passage)
+                        if target is not None]
+        self.reachable = self.search([self.start] + [title for title in SPECIAL
+                                                     if title in self.edges])
+
+    def search(self, roots):
+        """ the titles of the passages that can be reached from roots, breadth first. """
+        edges = self.edges
+        found = {root for root in roots if root in edges}
+        queue = deque(found)
+        while queue:
+            for target in edges[queue.popleft()]:
+                if target not in found and target in edges:
+                    found.add(target)
+                    queue.append(target)
+        return found
+
+    @property
+    def unreachable(self):
+        """ the titles that can't be reached, in the order they're in the story. """
+        return [title for title in self.edges if title not in self.reachable]
+
+    def cycles(self):
+        """
+        The cycles in the graph, as lists of titles: every strongly connected
+        component with more than one passage in it, or one that links to itself.
+        Found with Tarjan's algorithm, using a stack rather than recursion,
+        on the passages numbered in story order.
+        """
+        titles = list(self.edges)
+        number = {title: count for count, title in enumerate(titles)}
+        # the links to passages that exist, by number
+        graph = [[number[target] for target in self.edges[title] if target in number]
+                 for title in titles]
+        index = [-1] * len(titles)  # the order passages were found in, or -1
+        low = [0] * len(titles)
+        on_stack = [False] * len(titles)
+        stack = []
+        found = []
+        counter = 0
+        for root in range(len(titles)):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work = [(root, iter(graph[root]))]
+            while work:
+                node, targets = work[-1]
+                for target in targets:
+                    if index[target] < 0:
+                        index[target] = low[target] = counter
+                        counter += 1
+                        stack.append(target)
+                        on_stack[target] = True
+                        work.append((target, iter(graph[target])))
+                        break
+                    if on_stack[target] and index[target] < low[node]:
+                        low[node] = index[target]
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        if low[node] < low[parent]:
+                            low[parent] = low[node]
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in graph[node]:
+                            found.append(sorted(titles[member] for member in component))
+        return found
+
+    def report(self, cycles = None):
+        """ how many passages can be reached, and the cycles (found if not given), for people. """
+        if cycles is None:
+            cycles = self.cycles()
+        total = len(self.edges)
+        lost = total - len(self.reachable)
+        lines = [f"{len(self.reachable)} of {total} passages are reachable from {self.start!r}; "
+                 f"{lost} {'is' if lost == 1 else 'are'} not"]
+        if not cycles:
+            lines.append("no cycles")
+        else:
+            largest = max(len(cycle) for cycle in cycles)
+            lines.append(f"{len(cycles)} cycle{'' if len(cycles) == 1 else 's'}, "
+                         f"the largest of {largest} passage{'' if largest == 1 else 's'}")
+        return "\n".join(lines)
+
+def prune(story, keep):
+    """
+    A copy of story with only the passages whose titles are in keep. Includes
+    stay where they are, with only the passages of theirs that are kept.
+    """
+    def kept(parts):
+        result = []
+        for part in parts:
+            if type(part) is nodes.Include:
+                result.append(nodes.Include(part.command, part.argument, kept(part.parts)))
+            elif part.name in keep:
+                result.append(part)
+        return result
+    return nodes.Story(story.preamble, kept(story.parts))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
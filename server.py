@@ -0,0 +1,533 @@
+"""
+server.py
+
+A compile server, for editors and build tools that compile stories
+often and don't want to start Python and import the compiler every
+time. It runs on asyncio, listens on a Unix socket or for HTTP on
+localhost, and hands the compiling to a pool of worker processes that
+stay up between requests, so the event loop is never busy compiling
+and a slow story doesn't hold up anyone else's.
+
+A request is a JSON object: {"source": "<story>"} to compile some
+text, or {"path": "story.twx"} to compile a file, with an optional
+"out" naming a file to write the Twee code to as well. Both are taken
+relative to the server's root directory (--root, by default the one it
+runs in), and have to be inside it once any symbolic links are
+followed, as do the files a story \\includes. The reply is a JSON
+object too:
+
+    {"ok": true, "twee": "...", "errors": [], "warnings": [...],
+     "cached": false, "ms": 12.5}
+
+errors are the messages the compiler would have printed (twee is null
+if there are any), and warnings are the ones it logs, such as links to
+passages that don't exist. On a Unix socket every request and reply is
+one line, and a connection can send as many requests as it likes, one
+after another; over HTTP, POST a request to /compile with a
+Content-Type of application/json. HTTP requests that come from a web
+page (with an Origin header) or name a Host other than localhost are
+refused, so a page in a browser can't reach the server, and a client
+that takes longer than read_timeout seconds to send its request is cut
+off.
+
+    python3 server.py --socket /tmp/tweetex.sock
+    python3 server.py --port 8765
+
+Stories sent as text are cached by their hash, so sending the same
+story again (an editor preview often does) doesn't compile it again,
+unless it has an \\include, as the included files might have changed.
+Each worker keeps the files it has parsed for a path (see
+includes.Includes), so compiling a file again only parses the files
+that changed. A request bigger than max_size bytes is refused, and a
+compile that takes longer than timeout seconds gets an error reply;
+the worker still finishes it in the background, as a process in a pool
+can't be interrupted.
+
+MIT License
+"""
+import argparse
+import asyncio
+import collections
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import compiler
+import includes
+import log
+
+logger = log.getLogger("server")
+
+MAX_SIZE = 16 * 1024 * 1024 # bytes in a request
+TIMEOUT = 30.0              # seconds a compile can take
+READ_TIMEOUT = 10.0         # seconds an HTTP client has to send its request
+CACHE_SIZE = 64             # replies Server.cache keeps
+
+STATUS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+          405: "Method Not Allowed", 408: "Request Timeout", 411: "Length Required",
+          413: "Content Too Large", 415: "Unsupported Media Type",
+          500: "Internal Server Error", 504: "Gateway Timeout"}
+
+# the names an HTTP client can use for the server in its Host header
+LOCAL_HOSTS = {"localhost", "127.0.0.1", "[::1]"}
+
+class RequestError(Exception):
+    """ a request that can't be compiled, with the HTTP status that says why. """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Diagnostics(logging.Handler):
+    """ collects the compiler's warnings while it's added to the tweetex logger. """
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+_includes = {} # absolute path -> includes.Includes, in each worker
+
+def _context():
+    # forking the server itself, with its event loop and the pool's threads
+    # running, can leave a new worker waiting for work that never comes;
+    # a fork server is a quiet process to fork workers from, and has the
+    # compiler imported already
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["compiler", "includes"])
+    return context
+
+def _start_worker():
+    # a worker's warnings go back in its replies rather than to the server's log
+    root = logging.getLogger("tweetex")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+
+def compile_request(source = None, path = None, out = None, include_root = None):
+    """
+    Compiles a story, for a worker process: the text in source, or the file
+    called path, writing it to out if that's given. Files the story
+    includes have to be inside include_root, if it's given, and the
+    includes of source are taken relative to it. Returns (twee, errors,
+    warnings), where twee is None if the story didn't compile.
+    """
+    diagnostics = Diagnostics()
+    root = logging.getLogger("tweetex")
+    root.addHandler(diagnostics)
+    try:
+        with log.capture() as errors:
+            if path is None:
+                twee = compiler.compile_string(source, include_root = include_root)
+            else:
+                path = os.path.abspath(path)
+                if path not in _includes:
+                    _includes[path] = includes.Includes(include_root)
+                try:
+                    twee = _includes[path].compile_file(path, out)
+                except OSError as error:
+                    log.report(f"can't write {out}: {error.strerror}")
+                    twee = False
+    finally:
+        root.removeHandler(diagnostics)
+    return (None if twee == False else twee), errors, diagnostics.messages
+
+def error_reply(message):
+    return {"ok": False, "twee": None, "errors": [message], "warnings": [],
+            "cached": False, "ms": 0.0}
+
+class Server:
+    """
+    Compiles the requests that come in on the sockets it serves.
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> address = os.path.join(directory.name, "tweetex.sock")
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...          "\\\\passage{one} \\\\link{Go}{two}")
+    >>> async def session(server, requests):
+    ...     await server.serve_unix(address)
+    ...     reader, writer = await asyncio.open_unix_connection(address)
+    ...     replies = []
+    ...     for request in requests:
+    ...         writer.write(request.encode() + b"\\n")
+    ...         replies.append(json.loads(await reader.readline()))
+    ...     writer.close()
+    ...     await server.close()
+    ...     return replies
+    >>> server = Server(workers = 1)
+    >>> first, again, bad = asyncio.run(session(server, [
+    ...     json.dumps({"source": story}), json.dumps({"source": story}), "{}"]))
+    >>> first["ok"], first["twee"].splitlines()[-2:], first["cached"]
+    (True, [':: one', '[[Go|two]]'], False)
+    >>> first["warnings"]
+    ["line 1, column 57: link to missing passage 'two'"]
+    >>> again["twee"] == first["twee"], again["cached"]
+    (True, True)
+    >>> bad["errors"]
+    ['a request needs either "source" or "path"']
+
+    A story that includes other files is compiled every time, as they might have changed.
+    >>> server = Server(workers = 1)
+    >>> replies = asyncio.run(session(server, [json.dumps({"source": story + " \\\\include{ch.twx}"})] * 2))
+    >>> [reply["cached"] for reply in replies]
+    [False, False]
+
+    Files outside the server's root directory can't be read or written.
+    >>> server = Server(workers = 1, root = directory.name)
+    >>> outside, = asyncio.run(session(server, [
+    ...     json.dumps({"path": "story.twx", "out": "../story.tw"})]))
+    >>> outside["errors"]
+    ['"../story.tw" is outside the directory the server compiles files in']
+    >>> up, absolute = asyncio.run(session(server, [
+    ...     json.dumps({"source": story + " \\\\include{../secret.twx}"}),
+    ...     json.dumps({"source": story + " \\\\include{/etc/passwd}"})]))
+    >>> print(up["errors"][0], absolute["errors"][0], sep = "\\n")
+    Include error: '../secret.twx' is outside the directory files can be included from
+    Include error: '/etc/passwd' is outside the directory files can be included from
+
+    Errors in the story come back in the reply, and so do requests that are too big.
+    >>> server = Server(workers = 1, max_size = 100)
+    >>> broken, huge = asyncio.run(session(server, [
+    ...     json.dumps({"source": "\\\\title{T} \\\\passage{one} Hi."}), " " * 200]))
+    >>> broken["ok"], broken["errors"]
+    (False, ['Parsing Error: Preamble not formatted correctly.', 'Parsing failed'])
+    >>> huge["errors"]
+    ['the request is bigger than 100 bytes']
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, workers = None, timeout = TIMEOUT, max_size = MAX_SIZE,
+                 cache_size = CACHE_SIZE, root = None, read_timeout = READ_TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout     # seconds a compile can take
+        self.max_size = max_size   # bytes in a request
+        self.read_timeout = read_timeout # seconds an HTTP client has to send its request
+        # the directory that "path" and "out" are taken relative to, and kept in
+        self.root = os.path.realpath(os.getcwd() if root is None else root)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict() # hash of a source -> its reply, oldest first
+        self.pool = None
+        self.servers = []
+        self.connections = set()   # tasks answering a connection
+        self.sockets = []          # Unix socket files to remove on close()
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, _context(), _start_worker)
+        return self.pool
+
+    async def start(self):
+        """ starts every worker process, so the first requests don't wait for them. """
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _start_worker)
+                               for _ in range(self.workers)))
+
+    def resolve(self, name):
+        """
+        The real path of the file called name, relative to root. Raises
+        RequestError if it isn't inside root.
+        """
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise RequestError(403, f'"{name}" is outside the directory the server compiles files in')
+        return path
+
+    def check(self, request):
+        """
+        raises RequestError if request isn't one the server can compile, and
+        replaces its "path" and "out" with the real paths they name.
+        """
+        if not isinstance(request, dict):
+            raise RequestError(400, "a request must be a JSON object")
+        if ("source" in request) == ("path" in request):
+            raise RequestError(400, 'a request needs either "source" or "path"')
+        for field in ("source", "path", "out"):
+            if field in request and not isinstance(request[field], str):
+                raise RequestError(400, f'"{field}" must be a string')
+        if "out" in request and "path" not in request:
+            raise RequestError(400, '"out" only goes with "path"')
+        if "path" in request:
+            name = request["path"]
+            request["path"] = self.resolve(name)
+            if "out" in request:
+                request["out"] = self.resolve(request["out"])
+            try:
+                size = os.path.getsize(request["path"])
+            except OSError as error:
+                raise RequestError(400, f"can't read {name}: {error.strerror}")
+            if size > self.max_size:
+                raise RequestError(413, f"{name} is bigger than {self.max_size} bytes")
+
+    async def compile(self, request):
+        """
+        Compiles request (a decoded JSON object) on the worker pool and returns
+        the reply. Raises RequestError if it can't.
+        """
+        start = time.perf_counter()
+        self.check(request)
+        source = request.get("source")
+        key = None
+        # included files are read by the worker, and might have changed since
+        if source is not None and "\\include" not in source:
+            key = hashlib.blake2b(source.encode("utf-8", "surrogatepass"), digest_size = 16).digest()
+            reply = self.cache.get(key)
+            if reply is not None:
+                self.cache.move_to_end(key)
+                return dict(reply, cached = True, ms = round((time.perf_counter() - start) * 1000, 3))
+        job = functools.partial(compile_request, source, request.get("path"), request.get("out"),
+                                self.root)
+        try:
+            twee, errors, warnings = await asyncio.wait_for(
+                asyncio.get_running_loop().run_in_executor(self._pool(), job), self.timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(504, f"the compile took longer than {self.timeout:g} seconds")
+        except BrokenProcessPool:
+            self.pool = None # a worker died; start a new pool for the next request
+            raise RequestError(500, "a worker process died while compiling")
+        except Exception as error: # a compiler bug shouldn't take the server down
+            raise RequestError(500, f"{type(error).__name__}: {error}")
+        reply = {"ok": twee is not None, "twee": twee, "errors": errors, "warnings": warnings}
+        if key is not None:
+            self.cache[key] = reply
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        milliseconds = (time.perf_counter() - start) * 1000
+        logger.info("compiled %s in %.0f ms%s", os.path.relpath(request["path"], self.root)
+                    if "path" in request else "a story",
+                    milliseconds, "" if reply["ok"] else " (failed)")
+        return dict(reply, cached = False, ms = round(milliseconds, 3))
+
+    async def _reply(self, request):
+        try:
+            return await self.compile(request)
+        except RequestError as error:
+            return error_reply(str(error))
+
+    async def _serve_lines(self, reader, writer):
+        # a Unix socket connection: one JSON request per line, one reply per line
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # longer than the limit; the rest of it can't be skipped
+                    reply = error_reply(f"the request is bigger than {self.max_size} bytes")
+                    writer.write(json.dumps(reply).encode() + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    reply = error_reply(f"the request isn't JSON: {error}")
+                else:
+                    reply = await self._reply(request)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _serve_http(self, reader, writer):
+        # an HTTP connection: one request, then the connection is closed
+        self.connections.add(asyncio.current_task())
+        try:
+            try:
+                try:
+                    request = await asyncio.wait_for(self._read_http(reader), self.read_timeout)
+                except asyncio.TimeoutError:
+                    raise RequestError(408, f"the request took longer than "
+                                            f"{self.read_timeout:g} seconds to send")
+                status, reply = 200, await self.compile(request)
+            except RequestError as error:
+                status, reply = error.status, error_reply(str(error))
+            body = json.dumps(reply).encode()
+            writer.write(f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                         f"Content-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _read_http(self, reader):
+        """ reads an HTTP request and returns the JSON object in its body. """
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise RequestError(413, f"the request is bigger than {self.max_size} bytes")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _version = lines[0].split(" ")
+        except ValueError:
+            raise RequestError(400, "not an HTTP request")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if target != "/compile":
+            raise RequestError(404, f"nothing at {target}; POST requests to /compile")
+        if method != "POST":
+            raise RequestError(405, "POST requests to /compile")
+        # a web page can send a POST to localhost without asking first, but
+        # its browser always says where it came from, in Origin
+        if "origin" in headers:
+            raise RequestError(403, "requests from web pages aren't accepted")
+        host = headers.get("host")
+        if host is not None:
+            name = host.lower()
+            if not name.endswith("]"): # the colons in an IPv6 address aren't a port
+                name = name.rpartition(":")[0] or name
+            if name not in LOCAL_HOSTS:
+                raise RequestError(403, f"requests for {host} aren't accepted")
+        if headers.get("content-type", "").partition(";")[0].strip().lower() != "application/json":
+            raise RequestError(415, "the request's Content-Type must be application/json")
+        length = headers.get("content-length", "")
+        if not length.isdigit():
+            raise RequestError(411, "the request needs a Content-Length")
+        if int(length) > self.max_size:
+            raise RequestError(413, f"the request is bigger than {self.max_size} bytes")
+        try:
+            return json.loads(await reader.readexactly(int(length)))
+        except ValueError as error:
+            raise RequestError(400, f"the request isn't JSON: {error}")
+
+    async def serve_unix(self, path):
+        """ starts answering requests on the Unix socket at path. """
+        server = await asyncio.start_unix_server(self._serve_lines, path,
+                                                 limit = self.max_size + 1) # and the newline
+        self.servers.append(server)
+        self.sockets.append(path)
+        return server
+
+    async def serve_http(self, port, host = "127.0.0.1"):
+        """
+        starts answering HTTP requests on port.
+
+        >>> JSON = b"Content-Type: application/json\\r\\n"
+        >>> async def post(server, body, headers = JSON):
+        ...     http = await server.serve_http(0)
+        ...     port = http.sockets[0].getsockname()[1]
+        ...     reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        ...     writer.write(b"POST /compile HTTP/1.1\\r\\n%sContent-Length: %d\\r\\n\\r\\n%s"
+        ...                  % (headers, len(body), body))
+        ...     response = await reader.read()
+        ...     writer.close()
+        ...     await server.close()
+        ...     return response.split(b"\\r\\n")[0], json.loads(response.split(b"\\r\\n\\r\\n")[1])
+        >>> status, reply = asyncio.run(post(Server(workers = 1), b'{"source": "\\\\\\\\title{T}"}',
+        ...                                  JSON + b"Host: localhost:8765\\r\\n"))
+        >>> status, reply["errors"]
+        (b'HTTP/1.1 200 OK', ['Parsing Error: Preamble not formatted correctly.', 'Parsing failed'])
+        >>> asyncio.run(post(Server(workers = 1), b'{"path": 1}'))[0]
+        b'HTTP/1.1 400 Bad Request'
+
+        Requests from web pages, for other hosts or not sent as JSON are refused.
+        >>> asyncio.run(post(Server(workers = 1), b'{"path": "story.twx"}',
+        ...                  JSON + b"Origin: http://example.com\\r\\n"))[0]
+        b'HTTP/1.1 403 Forbidden'
+        >>> asyncio.run(post(Server(workers = 1), b'{"path": "story.twx"}',
+        ...                  JSON + b"Host: attacker.example:8765\\r\\n"))[0]
+        b'HTTP/1.1 403 Forbidden'
+        >>> asyncio.run(post(Server(workers = 1), b'{"path": "story.twx"}',
+        ...                  b"Content-Type: text/plain\\r\\n"))[0]
+        b'HTTP/1.1 415 Unsupported Media Type'
+
+        A client that doesn't send its request in time is cut off.
+        >>> async def silent(server):
+        ...     http = await server.serve_http(0)
+        ...     port = http.sockets[0].getsockname()[1]
+        ...     reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        ...     response = await reader.read()
+        ...     writer.close()
+        ...     await server.close()
+        ...     return response.split(b"\\r\\n")[0]
+        >>> asyncio.run(silent(Server(workers = 1, read_timeout = 0.1)))
+        b'HTTP/1.1 408 Request Timeout'
+        """
+        server = await asyncio.start_server(self._serve_http, host, port, limit = self.max_size)
+        self.servers.append(server)
+        return server
+
+    async def close(self):
+        """ stops serving and shuts the worker pool down. """
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        for task in list(self.connections): # connections still open
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions = True)
+        for path in self.sockets:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self.sockets = []
+        if self.pool is not None:
+            if sys.version_info >= (3, 9):
+                self.pool.shutdown(wait = False, cancel_futures = True)
+            else: # no cancel_futures yet; compiles still queued run to the end
+                self.pool.shutdown(wait = False)
+            self.pool = None
+
+def getargs():
+    parser = argparse.ArgumentParser(description="compiles TweeTeX stories sent over a Unix socket or HTTP")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', help='listen on this Unix socket')
+    where.add_argument('--port', type=int, help='listen for HTTP on this port of localhost')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+            help='number of worker processes (default: one per core)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+            help=f'seconds a compile can take (default: {TIMEOUT:g})')
+    parser.add_argument('--max-size', type=int, default=MAX_SIZE,
+            help=f'largest request, in bytes (default: {MAX_SIZE})')
+    parser.add_argument('--root', default=None,
+            help='the directory that requests can compile files in (default: this one)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+            help='only print warnings and errors')
+    return parser.parse_args()
+
+async def serve(args):
+    server = Server(args.jobs, args.timeout, args.max_size, root = args.root)
+    await server.start()
+    if args.socket:
+        await server.serve_unix(args.socket)
+        logger.info("listening on %s", args.socket)
+    else:
+        await server.serve_http(args.port)
+        logger.info("listening on http://127.0.0.1:%d/compile", args.port)
+    try:
+        await asyncio.Event().wait() # until interrupted
+    finally:
+        await server.close()
+
+def main():
+    args = getargs()
+    log.configure(log.level(args.quiet))
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+stats.py
+
+Compile statistics: how long the lex, parse and generate phases took,
+how big the story was, and (optionally) the peak memory traced while
+compiling. Pass a Stats object to the compiler functions to have it
+filled in, or register a hook with add_hook() to be handed the numbers
+for every compile without touching the calls themselves.
+
+tweetex.py prints them with --stats (or --stats=json).
+
+MIT License
+"""
+import time
+
+import nodes
+
+# json and tracemalloc are imported when they're first needed, since every
+# compile imports this module but few of them ask for JSON or memory use.
+
+HOOKS = []
+
+def add_hook(hook):
+    """
+    Calls hook(record) after every compile, where record is the
+    dictionary from Stats.as_dict(). Returns hook, so this can be used
+    as a decorator.
+    """
+    HOOKS.append(hook)
+    return hook
+
+def remove_hook(hook):
+    HOOKS.remove(hook)
+
+class Stats:
+    """
+    Collects the numbers for one compile.
+
+    >>> mystats = Stats()
+    >>> list(mystats.count_tokens(["a", "b", "c"]))
+    ['a', 'b', 'c']
+    >>> mystats.tokens
+    3
+    >>> with mystats.phase("parse"):
+    ...     pass
+    >>> sorted(mystats.as_dict())
+    ['ast_nodes', 'cycles', 'links', 'passages', 'peak_memory', 'reachable', 'seconds', 'source', 'tokens', 'tokens_per_second', 'unreachable']
+    """
+
+    def __init__(self, memory = False):
+        self.memory = memory # trace memory (slows the compile down a lot)
+        self.source = None
+        self.seconds = {"lex": 0.0, "parse": 0.0, "load": 0.0, "check": 0.0, "prune": 0.0,
+                        "generate": 0.0, "total": 0.0}
+        self.tokens = 0
+        self.passages = 0
+        self.links = 0
+        self.ast_nodes = 0
+        # passages that can and can't be reached from the start, and cycles
+        # in the links between them, if those were looked for
+        self.reachable = None
+        self.unreachable = None
+        self.cycles = None
+        self.peak_memory = None
+        self._started = None
+        self._tracing = False
+
+    def start(self, source = None):
+        self.source = source
+        if self.memory:
+            import tracemalloc
+            self._tracing = not tracemalloc.is_tracing()
+            if self._tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else: # before Python 3.9, starting again is the only way to reset the peak
+                limit = tracemalloc.get_traceback_limit()
+                tracemalloc.stop()
+                tracemalloc.start(limit)
+        self._started = time.perf_counter()
+
+    def finish(self):
+        self.seconds["total"] = time.perf_counter() - self._started
+        if self.memory:
+            import tracemalloc
+            _size, self.peak_memory = tracemalloc.get_traced_memory()
+            if self._tracing:
+                tracemalloc.stop()
+        record = self.as_dict()
+        for hook in HOOKS:
+            hook(record)
+
+    def phase(self, name):
+        """ a context manager that adds the time spent in it to phase name. """
+        return _Phase(self, name)
+
+    def count_tokens(self, tokens):
+        """
+        passes tokens through, counting them and adding the time spent
+        making them to the lex phase. Lexing and parsing overlap when the
+        parser pulls tokens from the lexer, so parse time is the time spent
+        in the parser less this.
+        """
+        clock = time.perf_counter
+        tokens = iter(tokens)
+        while True:
+            start = clock()
+            try:
+                token = next(tokens)
+            except StopIteration:
+                self.seconds["lex"] += clock() - start
+                return
+            self.seconds["lex"] += clock() - start
+            self.tokens += 1
+            yield token
+
+    def count_ast(self, ast):
+        """
+        counts the passages, links and nodes (tokens included) in ast. A node
+        that's in the tree more than once is counted once.
+
+        >>> import lexer, parser
+        >>> mylexer = lexer.Lexer("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{a} "
+        ...                       "\\\\passage{a} \\\\link{Out}{\\\\link{In}{a}}")
+        >>> mylexer.lex()
+        >>> mystats = Stats()
+        >>> mystats.count_ast(parser.parse(mylexer.tokens))
+        >>> mystats.passages, mystats.links, mystats.ast_nodes
+        (1, 2, 32)
+        """
+        seen = set()
+        stack = [ast]
+        while stack:
+            token = stack.pop()
+            if not token.leaf:
+                if id(token) in seen:
+                    continue
+                seen.add(id(token))
+                stack.extend(token.children)
+            self.ast_nodes += 1
+            if type(token) is nodes.Passage:
+                self.passages += 1
+            elif type(token) is nodes.Link:
+                self.links += 1
+
+    def as_dict(self):
+        lexed = self.seconds["lex"]
+        return {"source": self.source,
+                "seconds": dict(self.seconds),
+                "tokens": self.tokens,
+                "tokens_per_second": self.tokens / lexed if lexed else None,
+                "passages": self.passages,
+                "links": self.links,
+                "ast_nodes": self.ast_nodes,
+                "reachable": self.reachable,
+                "unreachable": self.unreachable,
+                "cycles": self.cycles,
+                "peak_memory": self.peak_memory}
+
+    def json(self):
+        import json
+        return json.dumps(self.as_dict(), indent = 2)
+
+    def report(self):
+        """ the numbers, for people. """
+        seconds = self.seconds
+        lines = [f"source:      {self.source}"]
+        for name in ["lex", "parse", "load", "check", "prune", "generate", "total"]:
+            lines.append(f"{name + ':':<12} {seconds[name]:8.3f} s")
+        if seconds["lex"]:
+            lines.append(f"tokens:      {self.tokens} ({self.tokens / seconds['lex']:,.0f}/s lexing)")
+        else:
+            lines.append(f"tokens:      {self.tokens}")
+        lines.append(f"passages:    {self.passages}")
+        lines.append(f"links:       {self.links}")
+        lines.append(f"AST nodes:   {self.ast_nodes}")
+        if self.reachable is not None:
+            lines.append(f"reachable:   {self.reachable} ({self.unreachable} pruned)")
+            lines.append(f"cycles:      {self.cycles}")
+        if self.peak_memory is not None:
+            lines.append(f"peak memory: {self.peak_memory / 1e6:.1f} MB")
+        return "\n".join(lines)
+
+class _Phase:
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+    def __exit__(self, *exc):
+        self.stats.seconds[self.name] += time.perf_counter() - self.start
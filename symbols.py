@@ -0,0 +1,228 @@
+"""
+symbols.py
+
+The passage symbol table. parser.story fills one in as it parses,
+mapping the title of every passage to its Passage node and where it
+starts in the source, and check() then looks up the target of every
+\\link (and every other macro that names a passage, like \\goto) and
+the \\start passage in it, in one pass over the tree, so that
+links to passages that don't exist are caught here rather than when
+the story is played.
+
+MIT License
+"""
+import commands
+import log
+import nodes
+
+logger = log.getLogger("symbols")
+
+def line_number(source, offset):
+    """
+    The line and column (both counting from 1) of offset in source.
+
+    >>> line_number("one\\ntwo\\nthree", 9)
+    (3, 2)
+    """
+    line = source.count("\n", 0, offset) + 1
+    return line, offset - source.rfind("\n", 0, offset)
+
+def links(_passage):
+    """
+    The \\link macros in a Passage node, and any other macros whose
+    command has a target argument (see commands.Command), nested ones
+    included, as (command, target) pairs: the MACROCOMMAND token and the
+    CHARACTER token naming the passage the macro goes to, or None if it
+    doesn't name one. Targets that are themselves macros are left out.
+
+    >>> import incremental
+    >>> _passage = incremental.passage("\\\\passage{a} \\\\link{Go}{b} \\\\link{Stay} \\\\goto{c}")
+    >>> [(command.start, target and target.value) for command, target in links(_passage)]
+    [(37, 'c'), (25, None), (12, 'b')]
+    """
+    registry = commands.COMMANDS
+    Macro = nodes.Macro
+    items = _passage.body.items
+    macros = [item for item in items if isinstance(item, Macro)]
+    for item in items:
+        if type(item) is nodes.Text:  # the text after a stray brace
+            macros += [inner for inner in item.items if isinstance(inner, Macro)]
+    while macros:
+        macro = macros.pop()
+        command = macro.command
+        arguments = macro.argument.items
+        index = registry[command.value].target_index
+        if index is not None:
+            if index >= len(arguments):
+                yield command, None
+            elif not isinstance(arguments[index], nodes.Node):
+                yield command, arguments[index]
+        for item in arguments:
+            if isinstance(item, Macro):
+                macros.append(item)
+
+def summary(_passage):
+    """
+    What the symbol table needs to know about a Passage node, in lists that
+    can be kept without the node (incremental.py keeps them in its cache
+    file, and parallel.py sends them between processes): [title, offset of
+    its \\passage, links], where links holds [command name, offset, target
+    title or None] for each of links(_passage).
+
+    >>> import incremental
+    >>> summary(incremental.passage("\\\\passage{a} \\\\link{Go}{b} \\\\goto{c}"))
+    ['a', 0, [['goto', 25, 'c'], ['link', 12, 'b']]]
+    """
+    return [_passage.name, _passage.command.start,
+            [[command.value, command.start, None if target is None else target.value]
+             for command, target in links(_passage)]]
+
+def _shift(offset, base):
+    return None if offset is None else offset + base
+
+class SymbolTable:
+    """
+    Maps passage titles to (Passage node, offset in the source), and
+    collects the problems found by add() and check() as (offset, message)
+    pairs. Offsets are None for tokens that weren't made by a lexer.
+
+    >>> import lexer, parser
+    >>> mylexer = lexer.Lexer("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...     "\\\\passage{one} \\\\link{Go}{two} \\\\link{Lost}{nowhere} "
+    ...     "\\\\passage{two} \\\\link{Back}{\\\\link{x}{one}} \\\\passage{one}")
+    >>> mylexer.lex()
+    >>> symbols = SymbolTable()
+    >>> ast = parser.parse(mylexer.tokens, symbols)
+    >>> sorted(symbols.passages)
+    ['one', 'two']
+    >>> symbols.passages['two'][1]
+    92
+    >>> symbols.check(ast)
+    False
+    >>> for offset, message in symbols.problems:
+    ...     print(offset, message)
+    133 duplicate passage 'one' (first defined at offset 42)
+    71 link to missing passage 'nowhere'
+    """
+
+    def __init__(self):
+        self.passages = {}
+        self.problems = []
+        self.origins = {} # id of a PASSAGE node -> (filename, source) it was included from
+        self.edges = {} # title -> titles its links go to, filled in by check()
+
+    def __len__(self):
+        return len(self.passages)
+
+    def __contains__(self, title):
+        return title in self.passages
+
+    def add(self, _passage, origin = None):
+        """
+        adds a Passage node to the table. origin is (filename, source) for
+        a passage from an included file, whose offsets aren't in the main source.
+        """
+        if origin is not None:
+            self.origins[id(_passage)] = origin
+        self._add_title(_passage.name, _passage.command.start, _passage, origin)
+
+    def _add_title(self, title, offset, _passage = None, origin = None):
+        if title in self.passages:
+            first = self.passages[title][1]
+            self.problem(origin, offset, f"duplicate passage {title!r} "
+                                         f"(first defined at offset {first})")
+        else:
+            self.passages[title] = (_passage, offset)
+
+    def problem(self, origin, offset, message):
+        """ adds a problem at offset in the main source, or in origin if it's given. """
+        if origin is None:
+            self.problems.append((offset, message))
+            return
+        filename, source = origin
+        if offset is not None:
+            filename += ", line %d, column %d" % line_number(source, offset)
+        self.problems.append((None, f"{filename}: {message}"))
+
+    def check(self, story):
+        """
+        Checks the \\start passage and the target of every link in story
+        against the table, adding a problem for each one that isn't in it.
+        Returns True if there were no problems at all. The links are kept
+        in edges, as the passage link graph (see reachability.py).
+        """
+        passages = self.passages
+        edges = self.edges = {}
+        parts = list(story.parts)
+        while parts:
+            child = parts.pop()
+            if type(child) is nodes.Include:
+                parts += child.parts
+                continue
+            origin = self.origins.get(id(child))
+            targets = edges.setdefault(child.name, [])
+            for command, target in links(child):
+                if target is None:
+                    self.problem(origin, command.start,
+                                 f"{command.value} has no target passage")
+                    continue
+                title = target.value
+                targets.append(title)
+                if title not in passages:
+                    self.problem(origin, command.start,
+                                 f"{command.value} to missing passage {title!r}")
+        self._check_start(story.preamble)
+        return not self.problems
+
+    def check_summaries(self, summaries, preamble):
+        """
+        Adds passages known only by their summary() to the table and checks
+        them as check() does, along with the \\start macro in preamble.
+        summaries holds (summary, base) pairs, where base is the offset in
+        the story of the source the passage was parsed from on its own.
+
+        >>> import incremental
+        >>> symbols = SymbolTable()
+        >>> symbols.check_summaries([(summary(incremental.passage("\\\\passage{a} \\\\link{Go}{b}")), 30)],
+        ...                         incremental.preamble("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{a} "))
+        False
+        >>> symbols.problems, symbols.edges
+        ([(42, "link to missing passage 'b'")], {'a': ['b']})
+        """
+        summaries = list(summaries)
+        for (title, offset, _links), base in summaries:
+            self._add_title(title, _shift(offset, base))
+        passages = self.passages
+        edges = self.edges = {}
+        for (title, _offset, found), base in summaries:
+            targets = edges.setdefault(title, [])
+            for name, offset, target in found:
+                if target is None:
+                    self.problem(None, _shift(offset, base), f"{name} has no target passage")
+                    continue
+                targets.append(target)
+                if target not in passages:
+                    self.problem(None, _shift(offset, base), f"{name} to missing passage {target!r}")
+        self._check_start(preamble)
+        return not self.problems
+
+    def _check_start(self, preamble):
+        for macro in preamble.macros:
+            if macro.name == "start":
+                start = macro.argument.text
+                if start not in self.passages:
+                    self.problem(None, macro.command.start,
+                                 f"start passage {start!r} doesn't exist")
+
+    def report(self, source = None):
+        """
+        Logs every problem as a warning, by line and column if the source
+        is given and by offset otherwise.
+        """
+        for offset, message in sorted(self.problems, key = lambda problem: problem[0] or 0):
+            if offset is None:
+                logger.warning("%s", message)
+            elif source is None:
+                logger.warning("offset %d: %s", offset, message)
+            else:
+                logger.warning("line %d, column %d: %s", *line_number(source, offset), message)
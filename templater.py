@@ -1,7 +1,7 @@
 """
-templater.py - This is a simple template library which takes Token objects from the
-TweeTeX parser and creates an equivalent document in Twee3 syntax using the sugarcube
-story format.
+templater.py - This is a simple template library which takes the AST made by the
+TweeTeX parser (see nodes.py) and creates an equivalent document in Twee3 syntax
+using the sugarcube story format.
 
 Twee3 Specification:
 https://github.com/iftechfoundation/twine-specs/blob/master/twee-3-specification.md
@@ -10,88 +10,227 @@ https://www.motoslave.net/sugarcube/2/
 
 Nick Creel - Mar 4 2020 - MIT License
 """
+import commands
 import lexer
+import log
+import nodes
 
-TEMPLATES = {
-	"link": "f'[[{text}|{link}]]'",
-	#"MACROCOMMAND": "f'<<{command} '", THIS CAN BE DONE LATER
-	#"MACROEND": '>>',
-	"PREAMBLEMACRO": r"f'\"{name}\": \"{value}\",\n'",
-	"TEXT" : '\n'
-}
+logger = log.getLogger("templater")
+
+TEMPLATES = {}
+
+def register_template(name, template):
+	"""
+	Adds a template to TEMPLATES under name (a token or node type, or a macro). A template is
+	either a str.format string, which is turned into a callable once here rather than
+	being re-parsed every time it's used, or a callable that takes the template's
+	fields as keyword arguments and returns a string. Templates for token types that
+	visitTokens doesn't otherwise handle are called with the token's value.
+
+	>>> register_template("EXAMPLE", "<<{value}>>")
+	>>> TEMPLATES["EXAMPLE"](value = "hello")
+	'<<hello>>'
+	>>> register_template("EXAMPLE", lambda value: value.upper())
+	>>> TEMPLATES["EXAMPLE"](value = "hello")
+	'HELLO'
+	>>> del TEMPLATES["EXAMPLE"]
+	"""
+	if callable(template):
+		TEMPLATES[name] = template
+	else:
+		TEMPLATES[name] = template.format
+
+register_template("PREAMBLEMACRO", '"{name}": "{value}",\n')
+register_template("TEXT", "\n")
+
+EMITTERS = {} # macro name -> function that returns the macro's Twee code
+
+def _emitter(name):
+	"""
+	Makes the function that writes out the macro called name, from its command in
+	the commands library, and adds it to EMITTERS (and the command's template to
+	TEMPLATES, unless one has been registered for it already). Returns None for a
+	macro with no template.
+
+	The function takes the text of each argument the macro was given, in order.
+
+	>>> import commands
+	>>> _ = commands.register("say", "macro", ["words", "who"], "<<say {who} {words}>>")
+	>>> _emitter("say")(["hi"])
+	'<<say  hi>>'
+	>>> commands.unregister("say"); del EMITTERS["say"], TEMPLATES["say"]
+	"""
+	command = commands.COMMANDS.get(name)
+	if command is None or command.template is None:
+		return None
+	if name not in TEMPLATES:
+		register_template(name, command.template)
+	fields = command.arguments
+	def emit(texts):
+		# arguments that weren't given are left empty
+		values = dict.fromkeys(fields, "")
+		values.update(zip(fields, texts))
+		return TEMPLATES[name](**values)
+	EMITTERS[name] = emit
+	return emit
+
+for _name in commands.of_kind("macro"):
+	_emitter(_name)
 
 
 def visitTokens(parent):
 	"""
-	visitTokens takes a parent token as input and returns a string. Call recursively
-	on token children to parse the entire AST.
+	visitTokens takes a parent token as input and returns a string, the Twee code for
+	that token and everything under it. See writeTokens, which does the work.
+
+	>>> import parser
+	>>> mylexer = lexer.Lexer("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+	...                       "\\\\passage{one} Hi. \\\\link{Go}{two} \\\\passage{two} Bye.")
+	>>> mylexer.lex()
+	>>> print(visitTokens(parser.parse(mylexer.tokens)))
+	:: StoryData 
+	{ 
+	    "author": "A",
+	    "ifid": "I",
+	    "start": "one",
+	    "format": "SugarCube"
+	}
+	:: StoryTitle 
+	T
+	<BLANKLINE>
+	:: one
+	Hi. [[Go|two]]
+	:: two
+	Bye.
+
+	The SugarCube macros are written out from their templates in the commands library.
+	>>> mylexer = lexer.Lexer("\\\\set{$seen}{true} \\\\if{$seen}{\\\\link{Back}{one}} \\\\goto{two}")
+	>>> mylexer.lex()
+	>>> _text = parser.text(mylexer.tokens)[0]
+	>>> visitTokens(_text)
+	'\\n<<set $seen to true>><<if $seen>>[[Back|one]]<</if>><<goto "two">>'
+	"""
+	result = []
+	writeTokens(parent, result)
+	return "".join(result)
+
+def writeTokens(parent, sink):
+	"""
+	Writes the Twee code for parent and everything under it to sink, which can be
+	anything with a write method (eg an open file) or a list to append strings to.
+	The tree is walked with an explicit stack rather than by recursion, so deeply
+	nested tokens can't hit the recursion limit, and pieces of output are written as
+	soon as they're made, so the whole story is never held as one string. A macro
+	with macros in its arguments is written out once they are, so each of its
+	arguments is written to a list of its own first, on the same stack.
+
+	>>> import parser
+	>>> mylexer = lexer.Lexer("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} \\\\passage{one} "
+	...                       + "\\\\link{Go}{" * 300 + "one" + "}" * 300)
+	>>> mylexer.lex()
+	>>> result = []
+	>>> writeTokens(parser.parse(mylexer.tokens), result)
+	>>> "".join(result).endswith("\\n:: one\\n" + "[[Go|" * 300 + "one" + "]]" * 300)
+	True
 	"""
-	result = ""
-	if parent.token_type in ["ARGUMENT", "STORY"]:
-		for child in parent.children:
-			result += visitTokens(child)
+	if isinstance(sink, list):
+		write = output = sink.append
 	else:
-		if parent.token_type == "PREAMBLE":
-			preambledata = ""
-			for child in parent.children:
-				if child.children[0].value == "title":
+		write = output = sink.write
+	stack = [parent] # nodes and tokens still to visit, strings still to write, and markers
+	buffers = [] # the text of the arguments being written, innermost last
+	while stack:
+		parent = stack.pop()
+		kind = type(parent)
+		if kind is str:
+			write(parent)
+
+		elif kind is lexer.Token: # should be CHARACTER
+			token_type = parent.token_type
+			if token_type in TEMPLATES:
+				write(TEMPLATES[token_type](value = parent.value))
+			else:
+				write(parent.value)
+
+		elif kind is nodes.Text:
+			write(TEMPLATES["TEXT"]())
+			stack.extend(reversed(parent.items))
+
+		elif kind is nodes.Link or kind is nodes.Macro:
+			emit = EMITTERS.get(parent.name) or _emitter(parent.name)
+			if emit is None:
+				logger.warning("this shouldn't happen!! skipping unknown macro %s", parent.name)
+				continue
+			arguments = parent.argument.items
+			texts = [item.value for item in arguments]
+			if None not in texts: # no macros in the arguments (nodes have no value)
+				write(emit(texts))
+				continue
+			# write each argument to a buffer of its own, on this stack, then the macro
+			texts = []
+			stack.append(("emit", emit, texts))
+			for item in reversed(arguments):
+				stack.append(("close", texts))
+				stack.append(item)
+				stack.append(("open",))
+
+		elif kind is tuple:
+			marker = parent[0]
+			if marker == "open": # an argument starts
+				buffers.append([])
+				write = buffers[-1].append
+			elif marker == "close": # and ends, so keep its text
+				parent[1].append("".join(buffers.pop()))
+				write = buffers[-1].append if buffers else output
+			else: # all the arguments are written, so write what they're in
+				write(parent[1](parent[2]))
+
+		elif kind is nodes.Argument:
+			stack.extend(reversed(parent.items))
+
+		elif kind is nodes.Passage:
+			write('\n:: ')
+			stack.append(parent.body)
+			stack.append(parent.title)
+
+		elif kind is nodes.Story:
+			stack.extend(reversed(parent.parts))
+			stack.append(parent.preamble)
+
+		elif kind is nodes.Include:
+			# once the includes library has read the file, its passages are in parts
+			stack.extend(reversed(parent.parts))
+
+		elif kind is nodes.Preamble:
+			write(':: StoryData \n{ \n')
+			title = ""
+			pending = []
+			for child in parent.macros:
+				if child.name == "title":
 					title = ":: StoryTitle \n"
-					title += (child.children[1].children[0].value)  # FIX THIS-- may cause problems in the future because it's too hardcoded.
+					title += (child.argument.items[0].value)  # FIX THIS-- may cause problems in the future because it's too hardcoded.
 					title += '\n'
 				else:
-					preambledata += "    " + visitTokens(child)
-			preamble = (':: StoryData \n{ \n' +
-						preambledata + '    "format": "SugarCube"\n}\n')
-			result += preamble
-			result += title
-
-		elif parent.token_type =="MACRO":
-			if parent.children[0].value == "link":
-				print('evaluating link')
-				print(f'text is {parent.children[1].children[0]}, link is {parent.children[2].children[0]}')
-				formatdict = {'text': parent.children[1].children[0].value, 'link': parent.children[2].children[1].value}
-				result += eval(TEMPLATES['link'], formatdict)
-			else:
-				print("this shouldn't happen!!")
-
-		elif parent.token_type == "PASSAGE":
-			result += '\n'
-			title = ":: "
-			title += visitTokens(parent.children[1])
-			result += title
-			for child in parent.children:
-				if child.token_type in ["TEXT"]:
-					result += visitTokens(child)
-
-		elif parent.token_type in TEMPLATES:
-			print(f"token type is {parent.token_type}")
-			print("token type is in templates")
-			if parent.token_type == "TEXT":
-				result += TEMPLATES["TEXT"]
-				for child in parent.children:
-					result += visitTokens(child)
-			elif parent.token_type == "PREAMBLEMACRO":
-				formatdict = {}
-				for child in parent.children:
-					if child.token_type == "PREAMBLECOMMAND":
-						formatdict['name'] = child.value
-					else:
-						formatdict['value'] = visitTokens(child)
-				result += eval(TEMPLATES["PREAMBLEMACRO"], formatdict)
+					pending += ["    ", child]
+			pending += ['    "format": "SugarCube"\n}\n', title]
+			stack.extend(reversed(pending))
 
-			else:
-				formatdict = {'value' : parent.value}
-				result += eval(TEMPLATES[parent.token_type], formatdict)
-		else: # should be CHARACTER
-			print(f"value is {parent.value}, token_type is {parent.token_type}")
-			result += parent.value
-	print("result is", result)
-	return result
+		elif kind is nodes.PreambleMacro:
+			name = parent.name
+			texts = []
+			stack.append(("emit", lambda texts: TEMPLATES["PREAMBLEMACRO"](
+				name = name, value = "".join(texts)), texts))
+			stack.append(("close", texts))
+			stack.append(parent.argument)
+			stack.append(("open",))
+
+		else:
+			write(parent.value)
 
 def makeNewFile(filename, story):
-	tweestory = visitTokens(story)
+	"""
+	Writes the Twee code for story to the file called filename, a piece at a time.
+	"""
 	with open(filename, 'w') as file:
-		file.write(tweestory)
-	print("successfully wrote story to file")
-	return tweestory
-
+		writeTokens(story, file)
+	logger.info("successfully wrote story to file")
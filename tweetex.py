@@ -1,52 +1,175 @@
 """
 tweetex.py
 
+The TweeTeX compiler. Run it to compile a story:
+
+    python3 tweetex.py story.twx
+
+or import it and call compile_string() or compile_file(), which don't
+print anything; they raise CompileError if the story doesn't compile.
+Importing it doesn't do anything else, and only loads what compiling
+needs; the command line's extras are imported when main() runs.
+
+    import tweetex
+    twee = tweetex.compile_string(source)
+
+(The compiler's own modules have short names, like parser, that are only
+safe to import because the standard library's parser module is gone as
+of Python 3.10.)
+
 Nick Creel | Feb 5 2020 | MIT License
 """
 
-from lexer import Lexer # my lexer
-import argparse  		# external library for handling input from command line
-import parser 			# parser
-import templater 		# code generator
-import re		 		# for regular expressions
+import compiler 		# lexer -> parser -> templater
+import log 				# -q/-v output levels
+import sys
+
+logger = log.getLogger("cli")
 
+class CompileError(Exception):
+    """
+    Raised when a story doesn't compile. messages is the list of error
+    messages the compiler would have printed.
 
-def getfile():
+    >>> compile_string("\\\\title{T} \\\\passage{one} Hi.")
+    Traceback (most recent call last):
+    ...
+    tweetex.CompileError: Parsing Error: Preamble not formatted correctly.
+    Parsing failed
+    """
+
+    def __init__(self, messages):
+        super().__init__("\n".join(messages) or "the story didn't compile")
+        self.messages = messages
+
+def compile_string(source, backend = "twee", prune = False):
+    """
+    Compiles the TweeTeX story in the string source and returns its Twee code,
+    or its Twine 2 HTML story archive if backend is "html". If prune is true,
+    passages that can't be reached from the start passage are left out.
+
+    >>> twee = compile_string("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...                       "\\\\passage{one} Hi.")
+    >>> twee.splitlines()[-2:]
+    [':: one', 'Hi.']
+    """
+    with log.capture() as messages:
+        result = compiler.compile_string(source, backend = backend, prune = prune)
+    if result == False:
+        raise CompileError(messages)
+    return result
+
+def compile_file(path, out = None, backend = "twee", prune = False):
+    """
+    Compiles the TweeTeX story in the file called path and writes its Twee
+    code (or its Twine 2 HTML story archive, if backend is "html") to the file
+    called out (by default, path with a .tw or .html extension), leaving out
+    unreachable passages if prune is true.
+    """
+    if out is None:
+        out = path[:-3] + compiler.BACKENDS[backend]
+    with log.capture() as messages:
+        result = compiler.compile_file(path, out, backend = backend, prune = prune)
+    if result == False:
+        raise CompileError(messages)
+
+def getargs():
+    import argparse  		# external library for handling input from command line
     parser = argparse.ArgumentParser(description="accepts input \ for TweeTex compiler")
     parser.add_argument('file', metavar='filename', type=str, nargs=1,
             help='the location of the TweeTex file to compile')
+    parser.add_argument('-q', '--quiet', action='store_true',
+            help='only print warnings and errors')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+            help='print the stages of the compile and the AST (-vv: every token too)')
+    parser.add_argument('--incremental', action='store_true',
+            help='only recompile passages that changed since the last --incremental compile')
+    parser.add_argument('--stats', nargs='?', const='text', choices=['text', 'json'],
+            help='print timings and counts for the compile; --stats=json for JSON '
+                 '(put a bare --stats after the filename)')
+    parser.add_argument('--trace-memory', action='store_true',
+            help='with --stats, also report peak traced memory (slows the compile down)')
+    parser.add_argument('--ast-cache', action='store_true',
+            help='keep the parsed story next to the output and reuse it while the story is unchanged')
+    parser.add_argument('-j', '--jobs', type=int, metavar='N',
+            help='compile the passages of the story on N processes (0: one per core)')
+    parser.add_argument('--watch', action='store_true',
+            help='keep running and recompile whenever the file changes')
+    parser.add_argument('--format', choices=sorted(compiler.BACKENDS), default='twee',
+            help='write Twee 3 code to a .tw file (the default) or a Twine 2 HTML '
+                 'story archive to a .html file')
+    parser.add_argument('--prune-unreachable', action='store_true',
+            help='leave out passages that can\'t be reached from the \\start passage, and '
+                 'report how many there are and the cycles between passages')
     args = parser.parse_args()
-    with open(args.file[0], "r") as file:
-        source = file.read()
-    return (source, args.file[0])
+    for option, used in [('--format html', args.format != 'twee'),
+                         ('--prune-unreachable', args.prune_unreachable),
+                         ('--stats', args.stats is not None),
+                         ('--ast-cache', args.ast_cache)]:
+        if used and (args.incremental or args.jobs is not None or args.watch):
+            parser.error(f'{option} can only be used without --incremental, -j and --watch')
+    return args
 
 def printchildren(token):
     #this is depth first, just a test.
     if type(token.children) != list:
-        print(token.children)
+        logger.debug("%s", token.children)
         printchildren(token.children)
     else:
         for atoken in token.children:
             if len(token.children) > 0:
-                print(atoken)
+                logger.debug("%s", atoken)
                 printchildren(atoken)
             else:
-                print(atoken)
+                logger.debug("%s", atoken)
 
 def main():
-    source, sourceName = getfile()
-    sourceName = sourceName[:-3] + 'tw' #change to Twee extension
-    mylexer = Lexer(source)
-    mylexer.lex()
-    tokens = mylexer.tokens
-    print("-------printing tokens produced by lexer")
-    for i in tokens.queue:
-        print(i)
-    print("\n--------beginning parse routine")
-    ast = parser.parse(tokenQueue = tokens) #this is NOT the same as argparse
-    print(ast)
-    printchildren(ast)
-    print("\n--------beginning code generation")
-    result = templater.makeNewFile(sourceName,ast)
-
-main()
+    # the command line's extras, which the library functions don't need
+    import incremental 		# --incremental
+    import parallel 		# --jobs
+    import stats 			# --stats
+    import watch 			# --watch
+    args = getargs()
+    # keep stdout clean for the JSON
+    log.configure(log.level(args.quiet, args.verbose),
+                  sys.stderr if args.stats == 'json' else sys.stdout)
+    sourceName = args.file[0]
+    outName = sourceName[:-3] + compiler.BACKENDS[args.format] #change to Twee (or HTML) extension
+    logger.debug("\n--------lexing, parsing and generating code")
+    if args.watch:
+        with open(sourceName, encoding = 'utf-8') as file:
+            several_files = '\\include' in file.read()
+        if several_files:
+            # only the files that changed are parsed again on each save
+            import includes
+            mycompiler = includes.Includes()
+        else:
+            # only the passages that changed are recompiled on each save
+            mycompiler = incremental.IncrementalCompiler(
+                outName + '.cache' if args.incremental else None)
+        watch.Watcher(sourceName, outName, compiler = mycompiler).run()
+        return
+    if args.jobs is not None:
+        parallel.compile_file(sourceName, outName, args.jobs or None)
+        return
+    if args.incremental:
+        # passages that haven't changed come out of outName.cache
+        mycompiler = incremental.IncrementalCompiler(outName + '.cache')
+        mycompiler.compile_file(sourceName, outName)
+        return
+    # the parser pulls tokens from the lexer as it goes, so the whole
+    # token list never has to be in memory at once.
+    metrics = stats.Stats(memory = args.trace_memory) if args.stats else None
+    cache = outName + '.ast' if args.ast_cache else None
+    ast = compiler.compile_file(sourceName, outName, metrics = metrics, cache = cache,
+                                backend = args.format, prune = args.prune_unreachable)
+    if ast and logger.isEnabledFor(log.DEBUG):
+        logger.debug("%s", ast)
+        printchildren(ast)
+    if args.stats == 'json':
+        print(metrics.json())
+    elif args.stats:
+        print(metrics.report())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+twine2.py
+
+Writes a story as a Twine 2 story archive, the HTML that Twine 2 keeps
+its stories in and that Twine and tweego can import or publish: one
+<tw-storydata> element for the story, holding a <tw-passagedata> element
+for each passage. The text of each passage is the same Twee code the
+templater writes for it (macros come out as SugarCube markup), escaped
+for HTML.
+
+It has the same functions as templater, so the compiler can use either
+one. Each passage is numbered (its pid) and written out as soon as it's
+been made, so the archive is never held in memory all at once; the only
+other look at the passages is a scan of their titles for the start
+passage's pid, which the archive needs before any passage.
+
+MIT License
+"""
+import html
+
+import compiler
+import log
+import nodes
+import templater
+
+logger = log.getLogger("twine2")
+
+FORMAT = "SugarCube"
+FORMAT_VERSION = "2.37.3"
+
+STORY = ('<tw-storydata name="{name}" startnode="{startnode}" creator="TweeTeX" '
+         'creator-version="{version}" ifid="{ifid}" zoom="1" format="{format}" '
+         'format-version="{format_version}" options="" hidden>\n'
+         '<style role="stylesheet" id="twine-user-stylesheet" type="text/twine-css"></style>\n'
+         '<script role="script" id="twine-user-script" type="text/twine-javascript"></script>\n').format
+PASSAGE = ('<tw-passagedata pid="{pid}" name="{name}" tags="" position="{x},{y}" '
+           'size="100,100">{text}</tw-passagedata>\n').format
+END = '</tw-storydata>\n'
+
+# passages are laid out on Twine's story map in rows of this many
+COLUMNS = 20
+
+def visitTokens(story):
+    """
+    Returns the Twine 2 archive for story as a string. See writeTokens.
+
+    >>> import lexer, parser
+    >>> mylexer = lexer.Lexer("\\\\title{Fish & Chips} \\\\author{A} \\\\ifid{I} \\\\start{two} "
+    ...                       "\\\\passage{one} 1 < 2. \\\\link{Go}{two} "
+    ...                       "\\\\passage{two} \\\\goto{one}")
+    >>> mylexer.lex()
+    >>> print(visitTokens(parser.parse(mylexer.tokens)))  # doctest: +ELLIPSIS
+    <tw-storydata name="Fish &amp; Chips" startnode="2" creator="TweeTeX" ... ifid="I" ... format="SugarCube" ...>
+    <style role="stylesheet" id="twine-user-stylesheet" type="text/twine-css"></style>
+    <script role="script" id="twine-user-script" type="text/twine-javascript"></script>
+    <tw-passagedata pid="1" name="one" tags="" position="100,100" size="100,100">1 &lt; 2. [[Go|two]]</tw-passagedata>
+    <tw-passagedata pid="2" name="two" tags="" position="225,100" size="100,100">&lt;&lt;goto &quot;one&quot;&gt;&gt;</tw-passagedata>
+    </tw-storydata>
+    <BLANKLINE>
+    """
+    result = []
+    writeTokens(story, result)
+    return "".join(result)
+
+def writeTokens(story, sink):
+    """
+    Writes the Twine 2 archive for story to sink, anything with a write
+    method (eg an open file) or a list to append strings to.
+    """
+    if isinstance(sink, list):
+        write = sink.append
+    else:
+        write = sink.write
+    escape = html.escape
+    fields = {macro.name: macro.argument.text for macro in story.preamble.macros}
+    start = fields.get("start")
+    # the start passage's pid is needed up front, so look for it by title
+    startnode = next((pid for pid, _passage in enumerate(nodes.passages(story), 1)
+                      if _passage.name == start), "")
+    write(STORY(name = escape(fields.get("title", "")), startnode = startnode,
+                version = compiler.VERSION, ifid = escape(fields.get("ifid", "")),
+                format = FORMAT, format_version = FORMAT_VERSION))
+    pieces = []
+    for pid, _passage in enumerate(nodes.passages(story), 1):
+        # an Argument writes just its items, without the newline a Text starts with
+        templater.writeTokens(nodes.Argument(_passage.body.items), pieces)
+        row, column = divmod(pid - 1, COLUMNS)
+        write(PASSAGE(pid = pid, name = escape(_passage.name),
+                      x = 100 + 125 * column, y = 100 + 125 * row,
+                      text = escape("".join(pieces))))
+        pieces.clear()
+    write(END)
+
+def makeNewFile(filename, story):
+    """
+    Writes the Twine 2 archive for story to the file called filename, a passage at a time.
+    """
+    with open(filename, 'w', encoding = 'utf-8') as file:
+        writeTokens(story, file)
+    logger.info("successfully wrote story to file")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,119 @@
+"""
+watch.py
+
+Watch mode: keeps a warm IncrementalCompiler (or includes.Includes, for
+a story in several files) around and recompiles a story whenever its
+source file, or a file it includes, changes. The file is polled with
+os.stat(), which is cheap enough to do every few tens of milliseconds
+and works the same everywhere. Editors often save with several writes
+in a row, so a change is only compiled once the file has stopped
+changing for the debounce time.
+
+MIT License
+"""
+import os
+import time
+
+import log
+from incremental import IncrementalCompiler
+
+logger = log.getLogger("watch")
+
+class Watcher:
+    """
+    Recompiles filename to outname when it changes. poll() checks once;
+    run() polls until interrupted.
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> source = os.path.join(directory.name, "story.twx")
+    >>> def save(text):
+    ...     with open(source, "w") as file:
+    ...         _ = file.write(text)
+    >>> story = ("\\\\title{T} \\\\author{A} \\\\ifid{I} \\\\start{one} "
+    ...          "\\\\passage{one} Hi. \\\\passage{two} Bye.")
+    >>> save(story)
+    >>> watcher = Watcher(source, source[:-3] + "tw", debounce = 0.1)
+    >>> watcher.poll(now = 0.0)
+    True
+    >>> watcher.poll(now = 1.0)
+    False
+
+    A change waits for the debounce time, and a second write restarts the wait.
+    >>> save(story + " More.")
+    >>> watcher.poll(now = 2.0), watcher.poll(now = 2.05)
+    (False, False)
+    >>> save(story + " More!")
+    >>> watcher.poll(now = 2.12)
+    False
+    >>> watcher.poll(now = 2.25)
+    True
+    >>> watcher.compiler.compiled, watcher.compiler.reused
+    (1, 1)
+    >>> directory.cleanup()
+    """
+
+    def __init__(self, filename, outname, interval = 0.02, debounce = 0.05, compiler = None):
+        self.filename = filename
+        self.outname = outname
+        self.interval = interval # seconds between polls
+        self.debounce = debounce # seconds the file has to stay the same
+        self.compiler = compiler or IncrementalCompiler()
+        self.compiled = None     # signature of the file at the last compile
+        self.pending = None      # (signature, time first seen) of a change
+                                 # that hasn't been compiled yet
+
+    def signature(self):
+        """
+        what changes when the file, or a file it includes, does, or None if
+        the file is missing.
+        """
+        files = [self.filename]
+        if hasattr(self.compiler, "dependencies"):
+            files += self.compiler.dependencies()
+        signature = []
+        for filename in files:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                if filename == self.filename:
+                    return None
+                signature.append(None) # an included file that's gone
+                continue
+            signature.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        return tuple(signature)
+
+    def poll(self, now = None):
+        """ recompiles if the file has changed and settled; returns True if it did. """
+        if now is None:
+            now = time.monotonic()
+        signature = self.signature()
+        if signature is None or signature == self.compiled:
+            self.pending = None
+            return False
+        if self.compiled is not None: # the first compile doesn't wait
+            if self.pending is None or self.pending[0] != signature:
+                self.pending = (signature, now)
+                return False
+            if now - self.pending[1] < self.debounce:
+                return False
+        self.pending = None
+        self.compiled = signature
+        start = time.perf_counter()
+        result = self.compiler.compile_file(self.filename, self.outname)
+        if hasattr(self.compiler, "dependencies"):
+            # the compile may have changed which files the story includes
+            self.compiled = self.signature()
+        if result != False:
+            logger.info("recompiled %s in %.0f ms", self.filename,
+                        (time.perf_counter() - start) * 1000)
+        return True
+
+    def run(self):
+        logger.info("watching %s (Ctrl-C to stop)", self.filename)
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass